@@ -0,0 +1,34 @@
+"""Add file hash and size
+
+Revision ID: 3f7a9c2e4b61
+Revises: 5ecbc66db0ac
+Create Date: 2026-10-18 09:12:31.502114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f7a9c2e4b61'
+down_revision: Union[str, None] = '5ecbc66db0ac'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('pedidos', sa.Column('original_sha256', sa.String(length=64), nullable=True))
+    op.add_column('pedidos', sa.Column('original_size', sa.BigInteger(), nullable=True))
+    op.add_column('disenos', sa.Column('design_sha256', sa.String(length=64), nullable=True))
+    op.add_column('disenos', sa.Column('design_size', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('disenos', 'design_size')
+    op.drop_column('disenos', 'design_sha256')
+    op.drop_column('pedidos', 'original_size')
+    op.drop_column('pedidos', 'original_sha256')
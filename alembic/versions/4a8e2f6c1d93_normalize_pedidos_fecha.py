@@ -0,0 +1,57 @@
+"""Store pedidos.fecha in UTC with microseconds, also from the server default
+
+Revision ID: 4a8e2f6c1d93
+Revises: e1b7c4a9d052
+Create Date: 2026-10-18 23:41:12.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4a8e2f6c1d93'
+down_revision: Union[str, None] = 'e1b7c4a9d052'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Default del servidor en UTC sin zona, con el formato que usa la aplicación (ver database.utc_now)
+UTC_NOW = {
+    'postgresql': "timezone('utc', now())",
+    'sqlite': "(strftime('%Y-%m-%d %H:%M:%f', 'now') || '000')",
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # En SQLite las fechas son texto: las de CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS') se llevan al
+        # formato con microsegundos con el que SQLAlchemy guarda y compara los valores de Python
+        op.execute(
+            "UPDATE pedidos SET fecha = strftime('%Y-%m-%d %H:%M:%f', fecha) || '000' "
+            "WHERE length(fecha) = 19"
+        )
+        with op.batch_alter_table('pedidos') as batch_op:
+            batch_op.alter_column('fecha', existing_type=sa.DateTime(), server_default=sa.text(UTC_NOW['sqlite']))
+    elif dialect == 'postgresql':
+        # now() guardó la hora local de la zona del servidor: se pasa a UTC, como los valores nuevos
+        op.execute(
+            "UPDATE pedidos SET fecha = (fecha AT TIME ZONE current_setting('TimeZone')) AT TIME ZONE 'UTC' "
+            "WHERE fecha IS NOT NULL"
+        )
+        op.alter_column('pedidos', 'fecha', existing_type=sa.DateTime(), server_default=sa.text(UTC_NOW['postgresql']))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Las fechas quedan en UTC
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        with op.batch_alter_table('pedidos') as batch_op:
+            batch_op.alter_column('fecha', existing_type=sa.DateTime(), server_default=sa.func.now())
+    else:
+        op.alter_column('pedidos', 'fecha', existing_type=sa.DateTime(), server_default=sa.func.now())
@@ -0,0 +1,48 @@
+"""Store only MinIO object paths for previews
+
+Revision ID: 8b2d41e7c0a9
+Revises: 3f7a9c2e4b61
+Create Date: 2026-10-18 10:02:47.118903
+
+"""
+from typing import Sequence, Union
+from urllib.parse import urlsplit, unquote
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2d41e7c0a9'
+down_revision: Union[str, None] = '3f7a9c2e4b61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (tabla, columna URL antigua, columna con la ruta minio://bucket/objeto)
+COLUMNS = [
+    ('pedidos', 'original_cache_url_minio', 'original_cache_path_minio'),
+    ('disenos', 'design_cache_url_minio', 'design_cache_path_minio'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    conn = op.get_bind()
+    for table, url_column, path_column in COLUMNS:
+        # Recuperar la ruta del objeto a partir de la URL presignada guardada (http://host/bucket/objeto?...)
+        rows = conn.execute(sa.text(
+            f"SELECT id, {url_column} FROM {table} WHERE {url_column} IS NOT NULL AND {path_column} IS NULL"
+        )).fetchall()
+        for row_id, url in rows:
+            object_path = unquote(urlsplit(url).path).lstrip('/')
+            conn.execute(
+                sa.text(f"UPDATE {table} SET {path_column} = :path WHERE id = :id"),
+                {"path": f"minio://{object_path}", "id": row_id},
+            )
+        op.drop_column(table, url_column)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table, url_column, _ in COLUMNS:
+        op.add_column(table, sa.Column(url_column, sa.String(), nullable=True))
@@ -0,0 +1,30 @@
+"""Add lookup indexes on disenos.pedido_id and pedidos(estado, fecha)
+
+Revision ID: b2c8f1e6d4a0
+Revises: a7d4e2b9c316
+Create Date: 2026-10-18 17:05:52.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2c8f1e6d4a0'
+down_revision: Union[str, None] = 'a7d4e2b9c316'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_disenos_pedido_id'), 'disenos', ['pedido_id'], unique=False)
+    op.create_index('ix_pedidos_estado_fecha', 'pedidos', ['estado', 'fecha'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_pedidos_estado_fecha', table_name='pedidos')
+    op.drop_index(op.f('ix_disenos_pedido_id'), table_name='disenos')
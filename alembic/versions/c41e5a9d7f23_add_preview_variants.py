@@ -0,0 +1,41 @@
+"""Add preview variants
+
+Revision ID: c41e5a9d7f23
+Revises: 8b2d41e7c0a9
+Create Date: 2026-10-18 11:26:05.774310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e5a9d7f23'
+down_revision: Union[str, None] = '8b2d41e7c0a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('preview_variants',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pedido_id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=False),
+    sa.Column('cache_path', sa.String(), nullable=True),
+    sa.Column('cache_path_minio', sa.String(), nullable=True),
+    sa.Column('fecha', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['pedido_id'], ['pedidos.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('pedido_id', 'tipo', 'width')
+    )
+    op.create_index(op.f('ix_preview_variants_id'), 'preview_variants', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_preview_variants_id'), table_name='preview_variants')
+    op.drop_table('preview_variants')
@@ -0,0 +1,28 @@
+"""Add pedidos(fecha, id) index for keyset pagination
+
+Revision ID: c6e0a9f3b185
+Revises: b2c8f1e6d4a0
+Create Date: 2026-10-18 17:48:30.604127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6e0a9f3b185'
+down_revision: Union[str, None] = 'b2c8f1e6d4a0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_pedidos_fecha_id', 'pedidos', ['fecha', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_pedidos_fecha_id', table_name='pedidos')
@@ -0,0 +1,28 @@
+"""Add job result
+
+Revision ID: d3f9b7a1e4c2
+Revises: c6e0a9f3b185
+Create Date: 2026-10-18 21:42:16.508213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3f9b7a1e4c2'
+down_revision: Union[str, None] = 'c6e0a9f3b185'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('result', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('jobs', 'result')
@@ -0,0 +1,30 @@
+"""Add pedido public link
+
+Revision ID: e1b7c4a9d052
+Revises: d3f9b7a1e4c2
+Create Date: 2026-10-18 22:15:03.927714
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1b7c4a9d052'
+down_revision: Union[str, None] = 'd3f9b7a1e4c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('pedidos', sa.Column('public_link', sa.String(), nullable=True))
+    op.add_column('pedidos', sa.Column('public_link_fecha', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('pedidos', 'public_link_fecha')
+    op.drop_column('pedidos', 'public_link')
@@ -0,0 +1,32 @@
+"""Add preview etags
+
+Revision ID: e93b0f6a2c58
+Revises: c41e5a9d7f23
+Create Date: 2026-10-18 12:41:19.036582
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e93b0f6a2c58'
+down_revision: Union[str, None] = 'c41e5a9d7f23'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('pedidos', sa.Column('original_preview_etag', sa.String(length=32), nullable=True))
+    op.add_column('disenos', sa.Column('design_preview_etag', sa.String(length=32), nullable=True))
+    op.add_column('preview_variants', sa.Column('etag', sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('preview_variants', 'etag')
+    op.drop_column('disenos', 'design_preview_etag')
+    op.drop_column('pedidos', 'original_preview_etag')
@@ -0,0 +1,63 @@
+"""Add content-addressed blobs
+
+Revision ID: f5a1c3d8b7e2
+Revises: e93b0f6a2c58
+Create Date: 2026-10-18 15:02:44.518305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5a1c3d8b7e2'
+down_revision: Union[str, None] = 'e93b0f6a2c58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('remote_path', sa.String(), nullable=False),
+    sa.Column('fecha', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.create_table('blob_previews',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=False),
+    sa.Column('cache_path', sa.String(), nullable=True),
+    sa.Column('cache_path_minio', sa.String(), nullable=True),
+    sa.Column('etag', sa.String(length=32), nullable=True),
+    sa.Column('fecha', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['sha256'], ['blobs.sha256'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('sha256', 'width')
+    )
+    op.create_index(op.f('ix_blob_previews_id'), 'blob_previews', ['id'], unique=False)
+
+    # Los archivos ya subidos pasan a ser blobs (uno por hash, el del pedido más antiguo)
+    op.execute(
+        "INSERT INTO blobs (sha256, size, remote_path) "
+        "SELECT p.original_sha256, p.original_size, p.original_path FROM pedidos p "
+        "WHERE p.id IN (SELECT MIN(id) FROM pedidos WHERE original_sha256 IS NOT NULL "
+        "AND original_path <> '' GROUP BY original_sha256)"
+    )
+    op.execute(
+        "INSERT INTO blobs (sha256, size, remote_path) "
+        "SELECT d.design_sha256, d.design_size, d.design_path FROM disenos d "
+        "WHERE d.id IN (SELECT MIN(id) FROM disenos WHERE design_sha256 IS NOT NULL GROUP BY design_sha256) "
+        "AND d.design_sha256 NOT IN (SELECT sha256 FROM blobs)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_blob_previews_id'), table_name='blob_previews')
+    op.drop_table('blob_previews')
+    op.drop_table('blobs')
@@ -0,0 +1,119 @@
+"""
+Microbenchmark de generate_preview por formato, tamaño (megapíxeles) y ancho de salida.
+
+Genera fixtures sintéticos JPEG, PNG y TIFF de cada tamaño (los CDR no se pueden sintetizar:
+se toman de --cdr-dir y requieren inkscape en el PATH; si no hay, se reportan como omitidos).
+Cada caso corre en un proceso nuevo, que repite el render --repeats veces: se reportan
+latencia p50/p95/p99, renders por segundo, mediana de cada etapa (inkscape, decodificación,
+reducción, codificación), tamaño de salida y pico de memoria residente del proceso, en JSON.
+
+Uso:
+    python benchmarks/bench_generate_preview.py --megapixels 1,12,48 --widths 0,256,1024 --output preview.json
+    python benchmarks/bench_generate_preview.py --cdr-dir fixtures/cdr --formats CDR
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_preview_variants import FORMATS, make_image  # noqa: E402
+from harness import latency_summary, peak_rss_kb, write_report  # noqa: E402
+from image_processing import generate_preview  # noqa: E402
+
+
+def run_case(path: str, width, repeats: int) -> dict:
+    samples = []
+    stages = {}
+    size = 0
+    for _ in range(repeats):
+        timings = {}
+        start = time.perf_counter()
+        try:
+            size = len(generate_preview(path, width, timings))
+        except Exception as e:
+            # HTTPException no se puede devolver entre procesos: se reporta solo el detalle
+            return {"error": str(getattr(e, "detail", e))}
+        samples.append(time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "latency": latency_summary(samples),
+        "throughput_per_s": round(len(samples) / sum(samples), 3),
+        "stages_p50_ms": {stage: round(statistics.median(values) * 1000, 3) for stage, values in stages.items()},
+        "output_bytes": size,
+        "peak_rss_kb": peak_rss_kb()["self"],
+    }
+
+
+def fixtures(directory: str, args) -> list:
+    """
+    Retorna [(formato, megapíxeles o None, ruta)] de los fixtures a medir.
+    """
+    cases = []
+    formats = [f.strip().upper() for f in args.formats.split(",")]
+    for fmt in formats:
+        if fmt in FORMATS:
+            for megapixels in (float(mp) for mp in args.megapixels.split(",")):
+                cases.append((fmt, megapixels, make_image(directory, fmt, megapixels)))
+    if "CDR" in formats and args.cdr_dir:
+        for path in sorted(glob.glob(os.path.join(args.cdr_dir, "*.cdr"))):
+            cases.append(("CDR", None, path))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", default="1,12,48")
+    parser.add_argument("--widths", default="0,256,1024", help="anchos de salida; 0 es la resolución completa")
+    parser.add_argument("--formats", default="JPEG,PNG,TIFF,CDR")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--cdr-dir", help="directorio con fixtures .cdr")
+    parser.add_argument("--output", help="archivo JSON (por defecto, salida estándar)")
+    args = parser.parse_args()
+    widths = [int(w) or None for w in args.widths.split(",")]
+
+    results = []
+    if "CDR" in args.formats.upper():
+        if not args.cdr_dir:
+            results.append({"format": "CDR", "skipped": "sin --cdr-dir (los CDR no se pueden generar)"})
+        elif shutil.which("inkscape") is None:
+            results.append({"format": "CDR", "skipped": "inkscape no está en el PATH"})
+            args.cdr_dir = None
+
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="bench_generate_") as directory:
+        for fmt, megapixels, path in fixtures(directory, args):
+            for width in widths:
+                # Un proceso por caso: ru_maxrss es el pico de ese caso y no de los anteriores
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    measured = pool.submit(run_case, path, width, args.repeats).result()
+                case = {
+                    "format": fmt,
+                    "megapixels": megapixels,
+                    "fixture": os.path.basename(path),
+                    "input_bytes": os.path.getsize(path),
+                    "width": width,
+                }
+                case.update(measured)
+                results.append(case)
+                if "error" in case:
+                    print(f"{fmt:5} {os.path.basename(path):24} w={width or 'completa':>8} error: {case['error']}", file=sys.stderr)
+                    continue
+                print(
+                    f"{fmt:5} {os.path.basename(path):24} w={width or 'completa':>8} "
+                    f"p50={case['latency']['p50_ms']:9.1f} ms  pico={case['peak_rss_kb'] / 1024:7.1f} MB",
+                    file=sys.stderr,
+                )
+    write_report("generate_preview", args, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Benchmark de las consultas de pedidos y diseños con y sin los índices de búsqueda.
+
+Carga N pedidos sintéticos (1M por defecto) y un diseño por cada dos pedidos, y mide la
+latencia de:
+  - diseño por pedido_id (lo que hacen los endpoints de previsualización, convert y estado);
+  - GET /pedido/{id}: antes con dos consultas, después con una sola (joinedload);
+  - últimos 50 pedidos de un estado ordenados por fecha.
+Primero sin los índices ix_disenos_pedido_id / ix_pedidos_estado_fecha y luego con ellos.
+Usa SQLite en un directorio temporal salvo que se indique DB_URL.
+
+Uso:
+    python benchmarks/bench_pedido_lookup.py --pedidos 1000000 --lookups 200
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Entorno aislado: debe definirse antes de importar config/database
+_tmp = tempfile.mkdtemp(prefix="bench_lookup_")
+os.environ.setdefault("DB_URL", f"sqlite:///{os.path.join(_tmp, 'bench.sqlite')}")
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(_tmp, "uploads"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, text  # noqa: E402
+from sqlalchemy.orm import joinedload, sessionmaker  # noqa: E402
+from database import Base, Pedido, Diseno  # noqa: E402
+
+# Se mide el plan de cada consulta, no el driver: basta un engine síncrono sobre la misma BD
+engine = create_engine(os.environ["DB_URL"])
+SessionLocal = sessionmaker(bind=engine)
+
+ESTADOS = ["nuevo", "en diseño", "aprobado", "entregado"]
+INDEXES = {
+    "ix_disenos_pedido_id": "CREATE INDEX ix_disenos_pedido_id ON disenos (pedido_id)",
+    "ix_pedidos_estado_fecha": "CREATE INDEX ix_pedidos_estado_fecha ON pedidos (estado, fecha)",
+}
+CHUNK = 50000
+
+
+def seed(n: int):
+    Base.metadata.create_all(bind=engine)
+    start = datetime.datetime(2024, 1, 1)
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        for offset in range(0, n, CHUNK):
+            conn.execute(insert(Pedido), [
+                {
+                    "id": i + 1,
+                    "client_info": f"cliente {i % 5000}",
+                    "fecha": start + datetime.timedelta(seconds=rng.randrange(2 * 365 * 86400)),
+                    "estado": rng.choice(ESTADOS),
+                    "original_path": f"bench:bench/original_{i + 1}.jpg",
+                }
+                for i in range(offset, min(offset + CHUNK, n))
+            ])
+        for offset in range(0, n, 2 * CHUNK):
+            conn.execute(insert(Diseno), [
+                {"pedido_id": i + 1, "design_path": f"bench:bench/{i + 1}_design.png"}
+                for i in range(offset, min(offset + 2 * CHUNK, n), 2)
+            ])
+
+
+def set_indexes(enabled: bool):
+    with engine.begin() as conn:
+        for name, ddl in INDEXES.items():
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            if enabled:
+                conn.execute(text(ddl))
+        if engine.dialect.name == "sqlite":
+            conn.execute(text("ANALYZE"))
+
+
+def measure(fn, ids: list) -> dict:
+    db = SessionLocal()
+    try:
+        samples = []
+        for pedido_id in ids:
+            start = time.perf_counter()
+            fn(db, pedido_id)
+            samples.append((time.perf_counter() - start) * 1000)
+            db.expunge_all()
+    finally:
+        db.close()
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+        "mean": statistics.fmean(samples),
+    }
+
+
+def design_by_pedido(db, pedido_id):
+    db.query(Diseno).filter(Diseno.pedido_id == pedido_id).first()
+
+
+def get_pedido_two_queries(db, pedido_id):
+    db.query(Pedido).filter(Pedido.id == pedido_id).first()
+    db.query(Diseno).filter(Diseno.pedido_id == pedido_id).first()
+
+
+def get_pedido_joined(db, pedido_id):
+    db.query(Pedido).options(joinedload(Pedido.disenos)).filter(Pedido.id == pedido_id).first()
+
+
+def latest_by_estado(db, pedido_id):
+    (db.query(Pedido).filter(Pedido.estado == ESTADOS[pedido_id % len(ESTADOS)])
+     .order_by(Pedido.fecha.desc()).limit(50).all())
+
+
+def report(label: str, stats: dict):
+    print(f"  {label:<28} p50 {stats['p50']:8.3f} ms   p95 {stats['p95']:8.3f} ms   media {stats['mean']:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pedidos", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    seed(args.pedidos)
+    print(f"{args.pedidos} pedidos cargados en {time.perf_counter() - start:.1f} s ({engine.url.get_backend_name()})")
+    ids = random.Random(7).sample(range(1, args.pedidos + 1), args.lookups)
+
+    set_indexes(False)
+    print("sin índices:")
+    report("diseño por pedido_id", measure(design_by_pedido, ids))
+    report("GET /pedido (2 consultas)", measure(get_pedido_two_queries, ids))
+    report("últimos 50 por estado", measure(latest_by_estado, ids[:20]))
+
+    set_indexes(True)
+    print("con índices:")
+    report("diseño por pedido_id", measure(design_by_pedido, ids))
+    report("GET /pedido (2 consultas)", measure(get_pedido_two_queries, ids))
+    report("GET /pedido (joinedload)", measure(get_pedido_joined, ids))
+    report("últimos 50 por estado", measure(latest_by_estado, ids[:20]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark de GET /preview/original/{id} en el camino "hit de MinIO".
+
+Mide peticiones por segundo del endpoint cuando la previsualización ya está en MinIO y la
+URL se firma localmente, con y sin el LRU de URLs presignadas. No necesita red: usa SQLite
+en un directorio temporal y la aplicación ASGI en el mismo proceso.
+
+Uso:
+    python benchmarks/bench_preview_minio_hit.py --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Entorno aislado: debe definirse antes de importar config/database
+_tmp = tempfile.mkdtemp(prefix="bench_minio_hit_")
+os.environ.update({
+    "UPLOAD_FOLDER": os.path.join(_tmp, "uploads"),
+    "CACHE_ORIGINAL_DIR": os.path.join(_tmp, "cache_original"),
+    "CACHE_DESIGN_DIR": os.path.join(_tmp, "cache_design"),
+    "DB_URL": f"sqlite:///{os.path.join(_tmp, 'bench.sqlite')}",
+    "PREVIEW_ENABLED": "true",
+    "RCLONE_REMOTE": "bench:bench",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import storage  # noqa: E402
+from database import Base, engine, SessionLocal, Pedido  # noqa: E402
+from endpoints import router  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+
+async def seed(n: int) -> list:
+    # El esquema normalmente lo crea Alembic; aquí se crea directamente en la BD temporal
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        pedidos = [
+            Pedido(original_path=f"bench:bench/original_{i}.jpg",
+                   original_cache_path_minio=f"minio://preview-cache/cache_original_{i}.webp")
+            for i in range(n)
+        ]
+        db.add_all(pedidos)
+        await db.commit()
+        return [p.id for p in pedidos]
+
+
+async def run(app, ids: list, total: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    counter = iter(range(total))
+
+    async def worker(client):
+        for i in counter:
+            response = await client.get(f"/preview/original/{ids[i % len(ids)]}")
+            assert response.status_code == 200, response.text
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+async def bench(args):
+    # Todo en un solo event loop: el pool de conexiones async queda ligado al loop que lo creó
+    app = FastAPI()
+    app.include_router(router)
+    ids = await seed(args.pedidos)
+
+    # Sin LRU: cada petición vuelve a firmar
+    cached = storage._presign_minio_url
+    storage._presign_minio_url = cached.__wrapped__
+    try:
+        elapsed = await run(app, ids, args.requests, args.concurrency)
+    finally:
+        storage._presign_minio_url = cached
+    print(f"sin LRU de URLs:  {args.requests / elapsed:8.1f} req/s")
+
+    cached.cache_clear()
+    elapsed = await run(app, ids, args.requests, args.concurrency)
+    print(f"con LRU de URLs:  {args.requests / elapsed:8.1f} req/s  ({cached.cache_info()})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pedidos", type=int, default=100, help="pedidos distintos (objetos a firmar)")
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
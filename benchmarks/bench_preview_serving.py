@@ -0,0 +1,149 @@
+"""
+Microbenchmark de cómo se sirve una previsualización que ya está en la caché local.
+
+Compara, para un archivo pequeño (cabe en el nivel de memoria) y uno grande (solo en disco):
+- streaming: StreamingResponse(open(archivo, "rb")), como se servía antes (itera el archivo
+  binario por "líneas" y no cierra el archivo);
+- bytes: leer el archivo completo en cada petición y responder con Response(content=bytes);
+- memoryview: el memoryview preasignado del nivel de memoria (PreviewCache.lookup);
+- file: FileResponse sobre el archivo del nivel de disco (sendfile si el servidor lo soporta).
+
+Cada respuesta se ejecuta directamente como aplicación ASGI (sin red ni servidor), así que
+se mide solo el costo del lado de la aplicación: peticiones por segundo y tiempo de CPU por
+petición (time.process_time, incluye los hilos que leen el archivo). Con --pathsend el scope
+anuncia la extensión http.response.pathsend, como un servidor que envía el archivo con sendfile.
+
+Uso:
+    python benchmarks/bench_preview_serving.py --requests 2000 --small-kb 40 --large-kb 4096
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import StreamingResponse  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+from http_cache import preview_etag, preview_response, preview_file_response  # noqa: E402
+
+
+def make_scope(headers: dict = None, pathsend: bool = False) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/preview/original/1",
+        "raw_path": b"/preview/original/1",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "server": ("bench", 80),
+        "client": ("bench", 1234),
+        "extensions": {"http.response.pathsend": {}} if pathsend else {},
+    }
+
+
+async def run_response(build, scope: dict) -> int:
+    """
+    Construye la respuesta con build(request) y la ejecuta como ASGI; retorna los bytes enviados.
+    """
+    disconnected = asyncio.Event()
+    sent = 0
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal sent
+        if message["type"] == "http.response.body":
+            sent += len(message.get("body", b""))
+        elif message["type"] == "http.response.pathsend":
+            sent += os.path.getsize(message["path"])
+
+    response = build(Request(scope, receive))
+    await response(scope, receive, send)
+    return sent
+
+
+async def measure(build, requests: int, expected: int, headers: dict = None,
+                  pathsend: bool = False) -> tuple:
+    scope = make_scope(headers, pathsend)
+    # Calentamiento
+    for _ in range(min(10, requests)):
+        await run_response(build, scope)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for _ in range(requests):
+        sent = await run_response(build, scope)
+        if sent != expected:
+            raise RuntimeError(f"se enviaron {sent} bytes, se esperaban {expected}")
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return requests / wall, cpu / requests * 1e6
+
+
+def strategies(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    view = memoryview(data)
+    etag = preview_etag(data)
+
+    def streaming(request):
+        return StreamingResponse(open(path, "rb"), media_type="image/webp")
+
+    def read_bytes(request):
+        with open(path, "rb") as f:
+            return preview_response(request, f.read(), etag)
+
+    def from_memoryview(request):
+        return preview_response(request, view, etag)
+
+    def from_file(request):
+        return preview_file_response(request, path, etag)
+
+    return {
+        "streaming": streaming,
+        "bytes": read_bytes,
+        "memoryview": from_memoryview,
+        "file": from_file,
+    }, len(data)
+
+
+async def bench(args):
+    with tempfile.TemporaryDirectory(prefix="bench_serving_") as directory:
+        print(f"{'tamaño':>10} {'estrategia':>11} {'rango':>6} {'req/s':>10} {'CPU µs/req':>11}")
+        for label, kb in (("pequeño", args.small_kb), ("grande", args.large_kb)):
+            path = os.path.join(directory, f"preview_{kb}kb.webp")
+            with open(path, "wb") as f:
+                # Contenido aleatorio con muchos '\n', como un WebP real
+                f.write(os.urandom(kb * 1024))
+            builders, size = strategies(path)
+            for name, build in builders.items():
+                # El streaming por "líneas" es órdenes de magnitud más lento: pocas peticiones bastan
+                requests = min(args.requests, 10) if name == "streaming" else args.requests
+                rps, cpu_us = await measure(build, requests, size, pathsend=args.pathsend)
+                print(f"{label:>10} {name:>11} {'-':>6} {rps:>10.0f} {cpu_us:>11.1f}")
+            # Peticiones de rango (reproductores y descargas reanudables)
+            for name in ("bytes", "memoryview", "file"):
+                rps, cpu_us = await measure(builders[name], args.requests, 1024, {"Range": "bytes=0-1023"})
+                print(f"{label:>10} {name:>11} {'1 KB':>6} {rps:>10.0f} {cpu_us:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--small-kb", type=int, default=40)
+    parser.add_argument("--large-kb", type=int, default=4096)
+    parser.add_argument("--pathsend", action="store_true", help="simular un servidor con sendfile")
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark de render_preview por variante de tamaño (?w=) sobre imágenes grandes.
+
+Genera imágenes sintéticas (JPEG, PNG y TIFF) de N megapíxeles y, para cada variante
+(resolución completa y cada ancho de PREVIEW_WIDTHS), mide el tiempo de render y el pico
+de memoria residente (ru_maxrss) en un proceso nuevo por medición, para que el pico de
+una variante no contamine a la siguiente.
+
+Uso:
+    python benchmarks/bench_preview_variants.py --megapixels 60
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from image_processing import render_preview  # noqa: E402
+
+DEFAULT_WIDTHS = (256, 1024, 2048)
+FORMATS = {"JPEG": ".jpg", "PNG": ".png", "TIFF": ".tif"}
+
+
+def make_image(directory: str, fmt: str, megapixels: float) -> str:
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    # Degradado + ruido barato: evita que la compresión haga trivial la decodificación
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    img = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    path = os.path.join(directory, f"bench_{megapixels:g}mp{FORMATS[fmt]}")
+    img.save(path, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return path
+
+
+def measure(path: str, width) -> tuple:
+    start = time.perf_counter()
+    data = render_preview(path, width)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, peak_kb, len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=60)
+    parser.add_argument("--widths", default=",".join(str(w) for w in DEFAULT_WIDTHS))
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    args = parser.parse_args()
+    variants = [None] + [int(w) for w in args.widths.split(",")]
+
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="bench_variants_") as directory:
+        print(f"{'formato':8} {'variante':>9} {'tiempo (s)':>11} {'pico RSS (MB)':>14} {'salida (KB)':>12}")
+        for fmt in args.formats.split(","):
+            path = make_image(directory, fmt, args.megapixels)
+            for width in variants:
+                # Un proceso por medición: ru_maxrss es el pico de ese render
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    elapsed, peak_kb, size = pool.submit(measure, path, width).result()
+                label = f"w={width}" if width else "completa"
+                print(f"{fmt:8} {label:>9} {elapsed:11.3f} {peak_kb / 1024:14.1f} {size / 1024:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
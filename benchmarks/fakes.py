@@ -0,0 +1,224 @@
+"""
+Sustitutos locales de los backends de almacenamiento para los benchmarks (sin red):
+
+- rclone: un remoto 'bench:' sobre un directorio local. Por defecto es un script (shim) que
+  implementa los subcomandos que usa storage.py en modo proceso (copy, cat, size, lsf, link, delete);
+  con real=True se usa el rclone instalado, con el remoto definido por variables de entorno
+  (backend 'local'), para medir también el costo real de arrancar rclone.
+- MinIO: un servidor S3 mínimo en un hilo del mismo proceso (objetos en memoria) que acepta lo
+  que hace storage.py: verificar/crear el bucket y subir objetos. No valida firmas.
+
+isolated_environment() prepara un directorio temporal con todo lo anterior y define las
+variables de entorno de config.py; debe llamarse antes de importar config/database/endpoints.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REMOTE_NAME = "bench"
+
+# Implementa la estructura '<remoto>/<nombre>/<nombre>' que deja 'rclone copy <archivo> <remoto>/<nombre>'
+RCLONE_SHIM = r'''#!{python}
+import json, os, shutil, sys
+
+PREFIX = "{remote}:"
+
+def local(path):
+    return path[len(PREFIX):] if path.startswith(PREFIX) else path
+
+def option(args, name, default=None):
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+def main(args):
+    command = args[0]
+    if command == "copy":
+        src, dst = local(args[1]), local(args[2])
+        os.makedirs(dst, exist_ok=True)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, dirs_exist_ok=True)
+        elif os.path.exists(src):
+            shutil.copyfile(src, os.path.join(dst, os.path.basename(src)))
+        else:
+            sys.exit("ERROR : " + args[1] + ": not found")
+    elif command == "cat":
+        path = local(args[1])
+        if os.path.isdir(path):
+            path = os.path.join(path, os.path.basename(path))
+        offset, count = int(option(args, "--offset", 0)), int(option(args, "--count", -1))
+        with open(path, "rb") as f:
+            f.seek(offset)
+            if count < 0:
+                shutil.copyfileobj(f, sys.stdout.buffer)
+            else:
+                sys.stdout.buffer.write(f.read(count))
+    elif command == "size":
+        path = local(args[-1])
+        files = [os.path.join(d, f) for d, _, names in os.walk(path) for f in names] if os.path.isdir(path) else [path]
+        print(json.dumps({{"count": len(files), "bytes": sum(os.path.getsize(f) for f in files)}}))
+    elif command == "lsf":
+        # Solo la forma que usa storage.py: --files-from con --format sp ("tamaño;ruta")
+        root = local(args[1])
+        with open(option(args, "--files-from")) as f:
+            names = f.read().split()
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                print(str(os.path.getsize(path)) + ";" + name)
+    elif command == "link":
+        print("https://disk.bench.invalid/" + args[1].replace(PREFIX, "", 1).lstrip("/"))
+    elif command in ("delete", "deletefile", "purge"):
+        path = local(args[1])
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    else:
+        sys.exit("ERROR : unsupported command " + command)
+
+main(sys.argv[1:])
+'''
+
+
+def install_rclone(directory: str, real: bool = False) -> dict:
+    """
+    Prepara el remoto 'bench:' sobre '<directory>/remote' y retorna las variables de entorno
+    necesarias (PATH con el shim, o la configuración del remoto para el rclone real).
+    """
+    remote_root = os.path.join(directory, "remote")
+    os.makedirs(remote_root, exist_ok=True)
+    env = {"RCLONE_REMOTE": f"{REMOTE_NAME}:{remote_root}", "RCLONE_MODE": "process"}
+    if real:
+        if shutil.which("rclone") is None:
+            raise SystemExit("No se encontró rclone en el PATH (quite --real-rclone para usar el shim)")
+        env[f"RCLONE_CONFIG_{REMOTE_NAME.upper()}_TYPE"] = "local"
+        return env
+    bin_dir = os.path.join(directory, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    shim = os.path.join(bin_dir, "rclone")
+    with open(shim, "w") as f:
+        f.write(RCLONE_SHIM.format(python=sys.executable, remote=REMOTE_NAME))
+    os.chmod(shim, 0o755)
+    env["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    return env
+
+
+class FakeS3:
+    """
+    Servidor S3 mínimo (buckets y objetos en memoria) para sustituir a MinIO.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.buckets = set()
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        s3 = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _target(self):
+                path = self.path.split("?", 1)[0].lstrip("/")
+                bucket, _, key = path.partition("/")
+                return bucket, key
+
+            def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body and self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def do_HEAD(self):
+                bucket, key = self._target()
+                with s3._lock:
+                    found = (bucket, key) in s3.objects if key else bucket in s3.buckets
+                self._reply(200 if found else 404)
+
+            def do_PUT(self):
+                bucket, key = self._target()
+                body = self._read_body()
+                with s3._lock:
+                    if not key:
+                        s3.buckets.add(bucket)
+                    else:
+                        s3.objects[(bucket, key)] = body
+                        s3.bytes_received += len(body)
+                self._reply(200, headers={"ETag": '"bench"'})
+
+            def do_GET(self):
+                bucket, key = self._target()
+                if not key:
+                    # get_bucket_location (si el cliente no tiene región fija)
+                    body = b'<?xml version="1.0" encoding="UTF-8"?><LocationConstraint>us-east-1</LocationConstraint>'
+                    self._reply(200, body, {"Content-Type": "application/xml"})
+                    return
+                with s3._lock:
+                    data = s3.objects.get((bucket, key))
+                if data is None:
+                    self._reply(404)
+                else:
+                    self._reply(200, data, {"Content-Type": "application/octet-stream"})
+
+            def do_DELETE(self):
+                bucket, key = self._target()
+                with s3._lock:
+                    s3.objects.pop((bucket, key), None)
+                self._reply(204)
+
+        return Handler
+
+
+def isolated_environment(prefix: str, real_rclone: bool = False, db_url: str = None) -> tuple:
+    """
+    Crea un directorio temporal con carpetas de subida y caché, el remoto rclone 'bench:' y un
+    S3 falso, y define las variables de entorno de config.py para usarlos (SQLite en el mismo
+    directorio salvo que se pase 'db_url', p. ej. un PostgreSQL local).
+    Retorna (directorio, FakeS3 ya iniciado).
+    """
+    directory = tempfile.mkdtemp(prefix=prefix)
+    s3 = FakeS3().start()
+    os.environ.update({
+        "UPLOAD_FOLDER": os.path.join(directory, "uploads"),
+        "CACHE_ORIGINAL_DIR": os.path.join(directory, "cache_original"),
+        "CACHE_DESIGN_DIR": os.path.join(directory, "cache_design"),
+        "DB_URL": db_url or f"sqlite:///{os.path.join(directory, 'bench.sqlite')}",
+        "PREVIEW_ENABLED": "true",
+        "MINIO_ENDPOINT": s3.endpoint,
+        "MINIO_SECURE": "false",
+    })
+    os.environ.update(install_rclone(directory, real_rclone))
+    for name in ("UPLOAD_FOLDER", "CACHE_ORIGINAL_DIR", "CACHE_DESIGN_DIR"):
+        os.makedirs(os.environ[name], exist_ok=True)
+    return directory, s3
@@ -0,0 +1,84 @@
+"""
+Utilidades comunes de los benchmarks: percentiles, pico de memoria y reporte JSON.
+
+El reporte incluye los metadatos necesarios para comparar corridas entre versiones (commit,
+Python, CPU, argumentos) y se escribe en --output o en la salida estándar.
+"""
+import datetime
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def latency_summary(samples: list) -> dict:
+    """
+    Resumen de latencias en segundos: p50/p95/p99 (rango más cercano), media, mínimo y máximo,
+    en milisegundos.
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(50) * 1000, 3),
+        "p95_ms": round(percentile(95) * 1000, 3),
+        "p99_ms": round(percentile(99) * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def peak_rss_kb() -> dict:
+    """
+    Pico de memoria residente (ru_maxrss, en KB en Linux) de este proceso y del mayor de sus
+    hijos ya terminados (p. ej. los workers de render tras cerrar el pool). Es un máximo desde
+    el arranque: no baja entre escenarios.
+    """
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_report(benchmark: str, args, results, output: str = None) -> dict:
+    """
+    Escribe el reporte JSON de 'benchmark' con sus resultados y metadatos.
+    """
+    report = {
+        "benchmark": benchmark,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+        print(f"Reporte escrito en {output}", file=sys.stderr)
+    else:
+        print(text)
+    return report
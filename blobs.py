@@ -0,0 +1,55 @@
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Blob, BlobPreview
+
+async def find_blob(db: AsyncSession, sha256: str):
+    """
+    Retorna el Blob con ese SHA-256, o None si el contenido no se ha subido antes.
+    """
+    if not sha256:
+        return None
+    return await db.get(Blob, sha256)
+
+async def register_blob(db: AsyncSession, sha256: str, size: int, remote_path: str):
+    """
+    Registra un contenido recién subido. Si otra petición registró el mismo hash al mismo tiempo
+    se conserva el existente (ambas copias son idénticas). No hace commit.
+    """
+    try:
+        async with db.begin_nested():
+            db.add(Blob(sha256=sha256, size=size, remote_path=remote_path))
+    except IntegrityError:
+        pass
+
+async def find_blob_preview(db: AsyncSession, sha256: str, width: int = None):
+    """
+    Retorna la previsualización ya subida del contenido 'sha256' con ese ancho, o None.
+    """
+    if not sha256:
+        return None
+    result = await db.execute(select(BlobPreview).where(
+        BlobPreview.sha256 == sha256,
+        BlobPreview.width == (width or 0),
+    ))
+    return result.scalars().first()
+
+async def register_blob_preview(db: AsyncSession, sha256: str, width: int, cache_path: str, cache_path_minio: str, etag: str):
+    """
+    Guarda (o actualiza) las rutas de la previsualización del contenido 'sha256' para que la
+    reutilicen los demás pedidos con el mismo archivo. No hace commit.
+    """
+    if not sha256 or await find_blob(db, sha256) is None:
+        return
+    preview = await find_blob_preview(db, sha256, width)
+    if preview is None:
+        preview = BlobPreview(sha256=sha256, width=width or 0)
+        try:
+            async with db.begin_nested():
+                db.add(preview)
+        except IntegrityError:
+            preview = await find_blob_preview(db, sha256, width)
+    preview.cache_path = cache_path
+    preview.cache_path_minio = cache_path_minio
+    preview.etag = etag
@@ -14,21 +14,132 @@ YANDEX_DISK_TOKEN = os.getenv("YANDEX_DISK_TOKEN")
 
 # Tiempo de expiración para la caché en segundos (24 horas por defecto)
 CACHE_EXPIRATION_SECONDS = int(os.getenv("CACHE_EXPIRATION_SECONDS", 86400))
+# Caché de previsualizaciones: presupuesto en disco, política de desalojo ("lru" o "lfu") y nivel en memoria
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 5 * 1024 ** 3))
+CACHE_EVICTION_POLICY = os.getenv("CACHE_EVICTION_POLICY", "lru").lower()
+CACHE_INDEX_PATH = os.getenv("CACHE_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(CACHE_ORIGINAL_DIR)), "preview_index.sqlite"))
+CACHE_MEMORY_MAX_BYTES = int(os.getenv("CACHE_MEMORY_MAX_BYTES", 64 * 1024 ** 2))  # por proceso
+CACHE_MEMORY_MAX_ITEM_BYTES = int(os.getenv("CACHE_MEMORY_MAX_ITEM_BYTES", 1024 ** 2))
+
+# Subidas: tamaño de bloque al escribir a disco y tamaño máximo permitido (0 = sin límite)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 1024 * 1024 * 1024))
+# Content-Length máximo de POST /pedidos/bulk (varios archivos o un zip; 0 = sin límite)
+BULK_MAX_REQUEST_SIZE = int(os.getenv("BULK_MAX_REQUEST_SIZE", 10 * 1024 ** 3))
+# Ingesta masiva (POST /pedidos/bulk): máximo de archivos por lote (sueltos o dentro del zip)
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 1000))
+# Zip de la ingesta: tamaño total descomprimido y relación descomprimido/comprimido máximos (0 = sin límite)
+BULK_ZIP_MAX_TOTAL_SIZE = int(os.getenv("BULK_ZIP_MAX_TOTAL_SIZE", 10 * 1024 ** 3))
+BULK_ZIP_MAX_RATIO = float(os.getenv("BULK_ZIP_MAX_RATIO", 100))
 
 # Configuración de la base de datos
 DB_URL = os.getenv("DB_URL")
+# Pool de conexiones (no aplica a SQLite) y tiempo máximo por sentencia en ms (PostgreSQL; 0 = sin límite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 30000))
 
 # Configuración de Rclone para Yandex Disk
 RCLONE_REMOTE = os.getenv("RCLONE_REMOTE")
+RCLONE_MAX_CONCURRENCY = int(os.getenv("RCLONE_MAX_CONCURRENCY", 4))  # transferencias simultáneas por worker
+RCLONE_TIMEOUT_SECONDS = float(os.getenv("RCLONE_TIMEOUT_SECONDS", 600))
+# "process": un proceso rclone por operación; "rcd": un 'rclone rcd' persistente controlado por HTTP.
+# Ojo: rclone interpreta las variables RCLONE_<FLAG> como flags (p. ej. RCLONE_RC_ADDR), por eso
+# estas se llaman RCLONE_DAEMON_*.
+RCLONE_MODE = os.getenv("RCLONE_MODE", "process").lower()
+RCLONE_DAEMON_ADDR = os.getenv("RCLONE_DAEMON_ADDR", "127.0.0.1:5572")
+RCLONE_DAEMON_STARTUP_TIMEOUT = float(os.getenv("RCLONE_DAEMON_STARTUP_TIMEOUT", 15))
+# Credenciales de la API del daemon (la API expone la configuración con el token de Yandex). Sin
+# RCLONE_DAEMON_PASS se genera una contraseña y se guarda en RCLONE_DAEMON_AUTH_FILE (modo 0600),
+# que comparten todos los workers de la máquina.
+RCLONE_DAEMON_USER = os.getenv("RCLONE_DAEMON_USER", "api")
+RCLONE_DAEMON_PASS = os.getenv("RCLONE_DAEMON_PASS")
+RCLONE_DAEMON_AUTH_FILE = os.getenv("RCLONE_DAEMON_AUTH_FILE", os.path.join(os.path.dirname(os.path.abspath(CACHE_ORIGINAL_DIR)), "rclone_rcd.auth"))
+# Transferencias en paralelo de una subida por lotes (un solo 'rclone copy --transfers N')
+RCLONE_BATCH_TRANSFERS = int(os.getenv("RCLONE_BATCH_TRANSFERS", 16))
+# Velocidad mínima esperada de esa subida: su tiempo máximo es RCLONE_TIMEOUT_SECONDS más lo que
+# tardaría el total de bytes a esta velocidad
+RCLONE_BATCH_MIN_BYTES_PER_SECOND = int(os.getenv("RCLONE_BATCH_MIN_BYTES_PER_SECOND", 1024 * 1024))
+# Lectura en streaming de Yandex Disk ('rclone cat', o el servidor HTTP del daemon en modo rcd)
+CLOUD_STREAM_CHUNK_SIZE = int(os.getenv("CLOUD_STREAM_CHUNK_SIZE", 256 * 1024))
+CLOUD_STREAM_MAX_CONCURRENCY = int(os.getenv("CLOUD_STREAM_MAX_CONCURRENCY", 16))  # lecturas abiertas a la vez por worker
+# Archivos de hasta este tamaño se decodifican para la previsualización desde memoria, sin archivo
+# temporal; como mucho CLOUD_READ_MAX_CONCURRENCY a la vez por worker (aparte de las descargas en streaming)
+STREAM_DECODE_MAX_BYTES = int(os.getenv("STREAM_DECODE_MAX_BYTES", 32 * 1024 * 1024))
+CLOUD_READ_MAX_CONCURRENCY = int(os.getenv("CLOUD_READ_MAX_CONCURRENCY", 4))
 
 # Variable para habilitar o restringir previsualizaciones
 PREVIEW_ENABLED = os.getenv("PREVIEW_ENABLED", "false").lower() == "true"
+# Anchos permitidos para ?w= en los endpoints de previsualización
+PREVIEW_WIDTHS = tuple(int(w) for w in os.getenv("PREVIEW_WIDTHS", "256,1024,2048").split(","))
+# Generar las previsualizaciones al subir el archivo (desde la copia local, en background) y qué anchos además del completo
+EAGER_PREVIEW_ENABLED = os.getenv("EAGER_PREVIEW_ENABLED", "false").lower() == "true"
+EAGER_PREVIEW_WIDTHS = tuple(int(w) for w in os.getenv("EAGER_PREVIEW_WIDTHS", "").split(",") if w.strip())
+# POST /previews/batch: máximo de previsualizaciones por petición y cuántas faltantes se generan a la vez
+PREVIEW_BATCH_MAX_ITEMS = int(os.getenv("PREVIEW_BATCH_MAX_ITEMS", 200))
+PREVIEW_BATCH_CONCURRENCY = int(os.getenv("PREVIEW_BATCH_CONCURRENCY", 2))
+
+# Motor de render de previsualizaciones (pool de procesos)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", 2 * (os.cpu_count() or 1)))  # trabajos en espera además de los que corren
+RENDER_TIMEOUT_SECONDS = float(os.getenv("RENDER_TIMEOUT_SECONDS", 120))
+RENDER_MEMORY_LIMIT_MB = int(os.getenv("RENDER_MEMORY_LIMIT_MB", 4096))  # por proceso; 0 = sin límite
+RENDER_MAX_TASKS_PER_CHILD = int(os.getenv("RENDER_MAX_TASKS_PER_CHILD", 50))  # reciclar workers; 0 = nunca
+
+# Conversión para impresión (POST /convert): trabajo de la cola con su propio pool de procesos.
+# Antes de convertir se estima la memoria a partir de la cabecera de la imagen y solo corren a la vez
+# las conversiones que caben en CONVERT_MEMORY_BUDGET_MB (por proceso de API/worker).
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", os.cpu_count() or 1))
+CONVERT_MEMORY_BUDGET_MB = int(os.getenv("CONVERT_MEMORY_BUDGET_MB", 8192))
+CONVERT_MEMORY_LIMIT_MB = int(os.getenv("CONVERT_MEMORY_LIMIT_MB", 8192))  # por proceso de conversión; 0 = sin límite
+CONVERT_MAX_PIXELS = int(os.getenv("CONVERT_MAX_PIXELS", 1_000_000_000))  # límite anti "decompression bomb" de Pillow
+CONVERT_JPEG_QUALITY = int(os.getenv("CONVERT_JPEG_QUALITY", 90))
+# Tiempo máximo esperando memoria y convirtiendo (el lease del trabajo se renueva mientras tanto)
+CONVERT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("CONVERT_QUEUE_TIMEOUT_SECONDS", 240))
+CONVERT_TIMEOUT_SECONDS = float(os.getenv("CONVERT_TIMEOUT_SECONDS", 600))
+CONVERT_MAX_ATTEMPTS = int(os.getenv("CONVERT_MAX_ATTEMPTS", 3))
+
+# Pool de procesos 'inkscape --shell' para rasterizar CDR (0 = un proceso inkscape por archivo)
+INKSCAPE_POOL_SIZE = int(os.getenv("INKSCAPE_POOL_SIZE", 2))
+INKSCAPE_TIMEOUT_SECONDS = float(os.getenv("INKSCAPE_TIMEOUT_SECONDS", 120))
+INKSCAPE_STARTUP_TIMEOUT_SECONDS = float(os.getenv("INKSCAPE_STARTUP_TIMEOUT_SECONDS", 30))
+INKSCAPE_HEALTHCHECK_IDLE_SECONDS = float(os.getenv("INKSCAPE_HEALTHCHECK_IDLE_SECONDS", 60))  # ping si estuvo inactivo
+
+# Cola de trabajos persistente (sincronización con Yandex Disk / MinIO); ver worker.py
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 4))  # trabajos simultáneos por worker
+JOB_WORKER_IN_API = os.getenv("JOB_WORKER_IN_API", "true").lower() == "true"  # procesar la cola también dentro de la API
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 1))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 8))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", 5))  # espera antes del 1er reintento; se duplica en cada uno
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", 3600))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 900))  # sin renovar el lease por más tiempo, un trabajo se considera abandonado
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", JOB_LEASE_SECONDS / 3))  # cada cuánto renueva el lease el worker
 
 # Configuración de MinIO
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "dikals")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "dikals123")
 MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME", "preview-cache")
+MINIO_MAX_CONCURRENCY = int(os.getenv("MINIO_MAX_CONCURRENCY", 8))
+MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() == "true"
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+MINIO_POOL_SIZE = int(os.getenv("MINIO_POOL_SIZE", 16))  # conexiones urllib3 por proceso
+MINIO_CONNECT_TIMEOUT = float(os.getenv("MINIO_CONNECT_TIMEOUT", 5))
+MINIO_READ_TIMEOUT = float(os.getenv("MINIO_READ_TIMEOUT", 60))
+# URLs presignadas: se firman bajo demanda y se reutilizan dentro de una ventana de tiempo
+MINIO_PRESIGNED_URL_EXPIRY_SECONDS = int(os.getenv("MINIO_PRESIGNED_URL_EXPIRY_SECONDS", 60 * 60 * 24))
+MINIO_PRESIGNED_URL_WINDOW_SECONDS = int(os.getenv("MINIO_PRESIGNED_URL_WINDOW_SECONDS", 60 * 60))
+MINIO_PRESIGNED_URL_CACHE_SIZE = int(os.getenv("MINIO_PRESIGNED_URL_CACHE_SIZE", 4096))
+
+# Enlaces públicos de descarga (GET /download/link): se guardan en el pedido y se cachean en memoria
+PUBLIC_LINK_MAX_AGE_SECONDS = int(os.getenv("PUBLIC_LINK_MAX_AGE_SECONDS", 60 * 60 * 24 * 30))  # luego se regeneran; 0 = nunca
+PUBLIC_LINK_CACHE_TTL_SECONDS = float(os.getenv("PUBLIC_LINK_CACHE_TTL_SECONDS", 300))
+PUBLIC_LINK_CACHE_SIZE = int(os.getenv("PUBLIC_LINK_CACHE_SIZE", 4096))
+PUBLIC_LINK_BATCH_MAX_ITEMS = int(os.getenv("PUBLIC_LINK_BATCH_MAX_ITEMS", 200))
+PUBLIC_LINK_BATCH_CONCURRENCY = int(os.getenv("PUBLIC_LINK_BATCH_CONCURRENCY", 4))  # enlaces generados a la vez por lote
 
 # Asegurarse de que las carpetas necesarias existan
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
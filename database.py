@@ -1,46 +1,181 @@
 # database.py
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy import make_url, Column, Integer, BigInteger, String, Text, DateTime, JSON, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
+from datetime import datetime, timezone
 
-from config import DB_URL
+from metrics import instrument_engine
+from config import (
+    DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT_MS,
+)
 
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Driver asíncrono para cada motor: asyncpg (PostgreSQL) y aiosqlite (SQLite, desarrollo y pruebas)
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def async_db_url(url: str):
+    """
+    Convierte DB_URL (p. ej. postgresql://... o sqlite:///...) a su equivalente con driver asíncrono.
+    Alembic sigue usando la URL síncrona de alembic.ini.
+    """
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        return url
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}")
+
+def engine_options(url: str) -> dict:
+    """
+    Opciones de create_async_engine según el motor: tamaño del pool, pre-ping y statement_timeout.
+    SQLite no usa un pool de conexiones de red ni admite statement_timeout.
+    """
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        return options
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if backend == "postgresql" and DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+    return options
+
+engine = create_async_engine(async_db_url(DB_URL), **engine_options(DB_URL))
+# Duración de cada sentencia SQL en /metrics
+instrument_engine(engine)
+# expire_on_commit=False: tras un commit los atributos siguen cargados (en async no hay carga perezosa)
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+def utcnow() -> datetime:
+    """
+    Fecha actual en UTC sin zona, con microsegundos. Se asigna desde Python (y no con
+    server_default) donde la columna se compara con valores enviados por la aplicación: en SQLite
+    CURRENT_TIMESTAMP se guarda sin microsegundos y no se ordena igual que un valor enlazado.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class utc_now(FunctionElement):
+    """
+    Equivalente de utcnow para server_default (filas insertadas sin pasar por el modelo): en
+    PostgreSQL now() da la hora de la zona del servidor, y en SQLite CURRENT_TIMESTAMP no guarda
+    microsegundos. Así ambos valores se ordenan igual que los que asigna la aplicación.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utc_now, "postgresql")
+def _utc_now_postgresql(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+@compiles(utc_now, "sqlite")
+def _utc_now_sqlite(element, compiler, **kw):
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'"
+
+@compiles(utc_now)
+def _utc_now_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
 class Pedido(Base):
     __tablename__ = "pedidos"
+    __table_args__ = (
+        Index("ix_pedidos_estado_fecha", "estado", "fecha"),
+        Index("ix_pedidos_fecha_id", "fecha", "id"),  # paginación por cursor de GET /pedidos
+    )
     id = Column(Integer, primary_key=True, index=True)
     client_info = Column(String, nullable=True)
-    fecha = Column(DateTime, server_default=func.now())  # Se asigna la fecha automáticamente con func.now()
+    fecha = Column(DateTime, default=utcnow, server_default=utc_now())  # UTC; ver utcnow (paginación por cursor)
     estado = Column(String, default="nuevo")
     original_path = Column(String, nullable=False)  # Ruta remota en Yandex Disk
+    original_sha256 = Column(String(64), nullable=True)  # SHA-256 del archivo original (hex)
+    original_size = Column(BigInteger, nullable=True)  # Tamaño del archivo original en bytes
     original_cache_path = Column(String, nullable=True)  # URL de la previsualización en la nube (Yandex)
-    original_cache_path_minio = Column(String, nullable=True) # Ruta de la previsualización en MinIO (opcional)
-    original_cache_url_minio = Column(String, nullable=True) # URL de la previsualización en MinIO
+    original_preview_etag = Column(String(32), nullable=True)  # Hash de contenido de la previsualización (ETag)
+    original_cache_path_minio = Column(String, nullable=True) # Ruta de la previsualización en MinIO (minio://bucket/objeto); la URL se firma bajo demanda
+    public_link = Column(String, nullable=True)  # Enlace público de descarga del original (rclone link)
+    public_link_fecha = Column(DateTime, nullable=True)  # Cuándo se generó el enlace (UTC)
 
     disenos = relationship("Diseno", back_populates="pedido")
 
 class Diseno(Base):
     __tablename__ = "disenos"
     id = Column(Integer, primary_key=True, index=True)
-    pedido_id = Column(Integer, ForeignKey("pedidos.id"))
+    pedido_id = Column(Integer, ForeignKey("pedidos.id"), index=True)
     design_path = Column(String, nullable=False)  # Ruta del diseño final en Yandex Disk
+    design_sha256 = Column(String(64), nullable=True)  # SHA-256 del archivo de diseño (hex)
+    design_size = Column(BigInteger, nullable=True)  # Tamaño del archivo de diseño en bytes
     design_cache_path = Column(String, nullable=True)  # URL de la previsualización en la nube (Yandex)
-    design_cache_path_minio = Column(String, nullable=True) # Ruta de la previsualización en MinIO (opcional)
-    design_cache_url_minio = Column(String, nullable=True) # URL de la previsualización en MinIO
+    design_preview_etag = Column(String(32), nullable=True)  # Hash de contenido de la previsualización (ETag)
+    design_cache_path_minio = Column(String, nullable=True) # Ruta de la previsualización en MinIO (minio://bucket/objeto); la URL se firma bajo demanda
     converted_path = Column(String, nullable=True)  # Ruta del archivo convertido para impresión
     estado = Column(String, default="diseño completado")
     fecha = Column(DateTime, server_default=func.now())  # Se asigna la fecha automáticamente
 
     pedido = relationship("Pedido", back_populates="disenos")
 
-Base.metadata.create_all(bind=engine)
+class PreviewVariant(Base):
+    """Previsualización reducida (?w=) de un original o diseño; la de resolución completa vive en Pedido/Diseno."""
+    __tablename__ = "preview_variants"
+    __table_args__ = (UniqueConstraint("pedido_id", "tipo", "width"),)
+    id = Column(Integer, primary_key=True, index=True)
+    pedido_id = Column(Integer, ForeignKey("pedidos.id"), nullable=False)
+    tipo = Column(String, nullable=False)  # 'original' o 'design'
+    width = Column(Integer, nullable=False)  # Ancho máximo en píxeles
+    cache_path = Column(String, nullable=True)  # Ruta de la previsualización en la nube (Yandex)
+    cache_path_minio = Column(String, nullable=True)  # Ruta de la previsualización en MinIO (minio://bucket/objeto)
+    etag = Column(String(32), nullable=True)  # Hash de contenido de la previsualización (ETag)
+    fecha = Column(DateTime, server_default=func.now())
+
+class Blob(Base):
+    """Archivo subido identificado por su contenido: el mismo SHA-256 se sube una sola vez a Yandex Disk."""
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True)  # SHA-256 del contenido (hex)
+    size = Column(BigInteger, nullable=False)  # Tamaño en bytes
+    remote_path = Column(String, nullable=False)  # Ruta remota en Yandex Disk
+    fecha = Column(DateTime, server_default=func.now())
+
+    previews = relationship("BlobPreview", back_populates="blob")
+
+class BlobPreview(Base):
+    """Previsualización de un blob; la comparten todos los pedidos y diseños con el mismo contenido."""
+    __tablename__ = "blob_previews"
+    __table_args__ = (UniqueConstraint("sha256", "width"),)
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=False)
+    width = Column(Integer, nullable=False, default=0)  # Ancho máximo en píxeles (0 = resolución completa)
+    cache_path = Column(String, nullable=True)  # Ruta de la previsualización en la nube (Yandex)
+    cache_path_minio = Column(String, nullable=True)  # Ruta de la previsualización en MinIO (minio://bucket/objeto)
+    etag = Column(String(32), nullable=True)  # Hash de contenido de la previsualización (ETag)
+    fecha = Column(DateTime, server_default=func.now())
+
+    blob = relationship("Blob", back_populates="previews")
+
+class Job(Base):
+    """Trabajo en segundo plano persistente (ver jobs.py y worker.py)."""
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # Tipo de trabajo, p. ej. 'preview_sync'
+    key = Column(String, nullable=False, unique=True)  # Clave de idempotencia: un solo trabajo vivo por clave
+    payload = Column(JSON, nullable=False)
+    estado = Column(String, nullable=False, default="pendiente")  # pendiente, en_proceso, completado, fallido
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    run_at = Column(DateTime, nullable=False, index=True)  # No se ejecuta antes de esta fecha (UTC)
+    locked_by = Column(String, nullable=True)  # Worker que lo tomó
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    result = Column(JSON, nullable=True)  # Lo que retornó el handler al completarse (p. ej. la ruta convertida)
+    fecha = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, nullable=True)
+
+# El esquema lo gestiona Alembic (alembic upgrade head); aquí no se crean tablas
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
\ No newline at end of file
@@ -1,106 +1,485 @@
 # main.py
 import os
-import io
+import json
+import base64
+import shutil
+import uuid
 import asyncio
-import subprocess
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, BackgroundTasks, requests
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+import tempfile
+import mimetypes
+from typing import List, Optional
+from datetime import datetime, timezone
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, BackgroundTasks, Query, Request, Body, requests
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import select, insert, update, delete, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 
-from config import UPLOAD_FOLDER, PREVIEW_ENABLED, CACHE_EXPIRATION_SECONDS, CACHE_ORIGINAL_DIR, CACHE_DESIGN_DIR, YANDEX_DISK_TOKEN, MINIO_BUCKET_NAME
-from database import Pedido, Diseno, get_db
-from storage import upload_to_cloud, download_from_cloud, delete_from_cloud, upload_to_minio, generate_minio_presigned_url
-from image_processing import generate_preview
-from preview_cache import get_cached_preview, set_cached_preview
+from config import UPLOAD_FOLDER, PREVIEW_ENABLED, PREVIEW_WIDTHS, EAGER_PREVIEW_ENABLED, EAGER_PREVIEW_WIDTHS, PREVIEW_BATCH_MAX_ITEMS, PREVIEW_BATCH_CONCURRENCY, BULK_MAX_ITEMS, CONVERT_MAX_ATTEMPTS, PUBLIC_LINK_BATCH_MAX_ITEMS, PUBLIC_LINK_BATCH_CONCURRENCY, STREAM_DECODE_MAX_BYTES, CACHE_EXPIRATION_SECONDS, CACHE_ORIGINAL_DIR, CACHE_DESIGN_DIR, YANDEX_DISK_TOKEN, MINIO_BUCKET_NAME
+from database import Pedido, Diseno, PreviewVariant, Blob, BlobPreview, Job, SessionLocal, get_db
+from storage import (upload_to_cloud, upload_batch_to_cloud, download_from_cloud, delete_from_cloud, upload_to_minio, generate_minio_presigned_url,
+    stream_from_cloud, read_from_cloud, get_cloud_file_size)
+import render_engine
+from preview_cache import (get_cached_preview, get_cached_preview_bytes, get_cached_preview_entry, set_cached_preview,
+    preview_filename, get_cache_stats, CachedPreview)
+from ingest import save_upload_file, extract_zip
+from image_processing import PRINT_FORMATS
+from singleflight import SingleFlight, file_lock
+from http_cache import preview_etag, etag_matches, not_modified, preview_response, preview_file_response, parse_range
+from blobs import find_blob, register_blob, find_blob_preview, register_blob_preview
+from jobs import enqueue_job, DONE
+from public_links import cached_link, resolve_public_link
+import metrics
+from metrics import PREVIEW_CACHE_REQUESTS, PREVIEWS_GENERATED
 
 router = APIRouter()
 
-def upload_preview_and_update_db(cache_file: str, preview_filename: str, pedido_obj, tipo: str):
+PREVIEW_SYNC_JOB = "preview_sync"
+
+async def enqueue_preview_sync(db: AsyncSession, owner, pedido_id: int, tipo: str, width: int, source_path: str):
+    """
+    Encola (en la cola persistente) la subida de la previsualización a Yandex Disk y MinIO.
+    La clave es única por pedido/diseño, tipo y ancho, así que regenerar no duplica trabajos.
+    """
+    key = f"{PREVIEW_SYNC_JOB}:{tipo}:{owner.id}:{width or 0}"
+    await enqueue_job(db, PREVIEW_SYNC_JOB, key, {
+        "pedido_id": pedido_id,
+        "tipo": tipo,
+        "owner_id": owner.id,
+        "width": width,
+        "source_path": source_path,
+        "source_size": owner_size(owner, tipo),
+    })
+
+async def sync_preview(payload: dict):
     """
-    Función auxiliar que se ejecuta en background para subir la previsualización a la nube
-    y actualizar el registro en la base de datos (Yandex Disk y MinIO).
+    Handler de los trabajos 'preview_sync': sube la previsualización a Yandex Disk y MinIO en
+    paralelo y guarda las rutas en el pedido/diseño (o en preview_variants si tiene 'width').
+    Si la previsualización ya no está en la caché local (p. ej. el worker corre en otra máquina)
+    se vuelve a obtener. Cualquier error se propaga para que la cola lo reintente.
     """
+    pedido_id, tipo, width = payload["pedido_id"], payload["tipo"], payload["width"]
+    if tipo == "design":
+        # La previsualización de diseño en caché es la del primer diseño del pedido: no se registra
+        # con el contenido (blob) de otro
+        async with SessionLocal() as db:
+            first_design = await get_first_design(db, pedido_id)
+        if first_design is None or first_design.id != payload["owner_id"]:
+            print(f"Se omite la previsualización del diseño {payload['owner_id']}: no es el primero del pedido {pedido_id}")
+            return
+    preview_bytes = await get_cached_preview_bytes(pedido_id, tipo, width)
+    if preview_bytes is None:
+        # Los trabajos encolados antes de guardar 'source_size' no lo tienen
+        preview_bytes, _ = await get_or_build_preview(
+            pedido_id, tipo, payload["source_path"], width=width, source_size=payload.get("source_size")
+        )
+
+    filename = preview_filename(pedido_id, tipo, width)
+    minio_object_path = f"minio://{MINIO_BUCKET_NAME}/{filename}"
+    # rclone sube el archivo con su nombre local: se escribe con el nombre definitivo en un directorio propio
+    temp_dir = tempfile.mkdtemp(prefix=f"sync_{tipo}_{pedido_id}_", dir=UPLOAD_FOLDER)
     try:
-        cloud_cache_path_yandex = upload_to_cloud(cache_file, preview_filename)
-        minio_object_name = preview_filename
-        minio_object_path = f"minio://{MINIO_BUCKET_NAME}/{minio_object_name}"
-        upload_to_minio(cache_file, minio_object_name)
-        minio_url = generate_minio_presigned_url(minio_object_path)
-
-        # Obtener una nueva sesión llamando a get_db() manualmente
-        db = next(get_db())
-        # Buscar el pedido con la nueva sesión (usando el id)
-        pedido = db.query(Pedido).get(pedido_obj.id)
+        local_file = os.path.join(temp_dir, filename)
+        with open(local_file, "wb") as f:
+            f.write(preview_bytes)
+        cloud_cache_path_yandex, _ = await asyncio.gather(
+            upload_to_cloud(local_file, filename),
+            upload_to_minio(preview_bytes, filename),
+        )
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    async with SessionLocal() as db:
+        # Buscar el pedido (o diseño) con la nueva sesión (usando el id)
+        model = Pedido if tipo == "original" else Diseno
+        pedido = await db.get(model, payload["owner_id"])
         if pedido is None:
             print("No se encontró el pedido en la base de datos con la nueva sesión")
-            db.close()
             return
+        etag = preview_etag(preview_bytes)
 
-        if tipo == "original":
+        if width:
+            variant = await get_or_create_variant(db, pedido_id, tipo, width)
+            variant.cache_path = cloud_cache_path_yandex
+            variant.cache_path_minio = minio_object_path
+            variant.etag = etag
+            print(f"Se subió previsualización {tipo} ({width}px) a Yandex Disk y MinIO: ", minio_object_path)
+        elif tipo == "original":
             pedido.original_cache_path = cloud_cache_path_yandex
-            pedido.original_cache_url_minio = minio_url
+            pedido.original_cache_path_minio = minio_object_path
+            pedido.original_preview_etag = etag
             print("Se subió previsualización original a Yandex Disk: ", cloud_cache_path_yandex)
-            print("Se generó URL de previsualización original en MinIO: ", minio_url)
+            print("Se subió previsualización original a MinIO: ", minio_object_path)
         else:  # tipo == "design"
             pedido.design_cache_path = cloud_cache_path_yandex
-            pedido.design_cache_url_minio = minio_url
+            pedido.design_cache_path_minio = minio_object_path
+            pedido.design_preview_etag = etag
             print("Se subió previsualización de diseño a Yandex Disk: ", cloud_cache_path_yandex)
-            print("Se generó URL de previsualización de diseño en MinIO: ", minio_url)
+            print("Se subió previsualización de diseño a MinIO: ", minio_object_path)
+
+        # Los demás pedidos con el mismo archivo reutilizan esta previsualización
+        await register_blob_preview(db, owner_sha256(pedido, tipo), width, cloud_cache_path_yandex, minio_object_path, etag)
+        await db.commit()
+
+def check_preview_width(width: Optional[int]):
+    """
+    Valida el parámetro ?w= de los endpoints de previsualización.
+    """
+    if width is not None and width not in PREVIEW_WIDTHS:
+        allowed = ", ".join(str(w) for w in PREVIEW_WIDTHS)
+        raise HTTPException(status_code=400, detail=f"Ancho de previsualización no permitido; use uno de: {allowed}")
+
+async def get_preview_locations(db: AsyncSession, owner, pedido_id: int, tipo: str, width: int = None) -> tuple:
+    """
+    Retorna (ruta en MinIO, ruta en Yandex Disk, etag) de la previsualización, o None en cada una.
+    'owner' es el Pedido (tipo 'original') o el Diseno (tipo 'design').
+    """
+    if width is None:
+        if tipo == "original":
+            return owner.original_cache_path_minio, owner.original_cache_path, owner.original_preview_etag
+        return owner.design_cache_path_minio, owner.design_cache_path, owner.design_preview_etag
+    variant = await find_variant(db, pedido_id, tipo, width)
+    if variant is None:
+        return None, None, None
+    return variant.cache_path_minio, variant.cache_path, variant.etag
+
+async def find_variant(db: AsyncSession, pedido_id: int, tipo: str, width: int):
+    """
+    Retorna la fila de preview_variants de (pedido, tipo, ancho), o None.
+    """
+    result = await db.execute(select(PreviewVariant).where(
+        PreviewVariant.pedido_id == pedido_id,
+        PreviewVariant.tipo == tipo,
+        PreviewVariant.width == width,
+    ))
+    return result.scalars().first()
+
+async def get_or_create_variant(db: AsyncSession, pedido_id: int, tipo: str, width: int) -> PreviewVariant:
+    """
+    Retorna la fila de preview_variants de (pedido, tipo, ancho), creándola si no existe.
+    """
+    variant = await find_variant(db, pedido_id, tipo, width)
+    if variant is None:
+        variant = PreviewVariant(pedido_id=pedido_id, tipo=tipo, width=width)
+        try:
+            async with db.begin_nested():
+                db.add(variant)
+        except IntegrityError:
+            # Otra petición la creó al mismo tiempo
+            variant = await find_variant(db, pedido_id, tipo, width)
+    return variant
+
+async def get_first_design(db: AsyncSession, pedido_id: int):
+    """
+    Retorna el primer diseño registrado del pedido, o None.
+    """
+    result = await db.execute(select(Diseno).where(Diseno.pedido_id == pedido_id).order_by(Diseno.id).limit(1))
+    return result.scalars().first()
+
+def owner_sha256(owner, tipo: str):
+    """
+    SHA-256 del archivo del que se genera la previsualización (original del pedido o diseño).
+    """
+    return owner.original_sha256 if tipo == "original" else owner.design_sha256
+
+def owner_size(owner, tipo: str):
+    """
+    Tamaño en bytes del archivo del que se genera la previsualización, o None si no se registró.
+    """
+    return owner.original_size if tipo == "original" else owner.design_size
+
+async def adopt_blob_preview(db: AsyncSession, owner, pedido_id: int, tipo: str, width: int = None) -> tuple:
+    """
+    Si el contenido del archivo ya tiene previsualización subida (por otro pedido), copia sus
+    rutas y ETag a la fila de este pedido/diseño y las retorna como get_preview_locations.
+    """
+    blob_preview = await find_blob_preview(db, owner_sha256(owner, tipo), width)
+    if blob_preview is None:
+        return None, None, None
+    if width is not None:
+        variant = await get_or_create_variant(db, pedido_id, tipo, width)
+        variant.cache_path = blob_preview.cache_path
+        variant.cache_path_minio = blob_preview.cache_path_minio
+        variant.etag = blob_preview.etag
+    elif tipo == "original":
+        owner.original_cache_path = blob_preview.cache_path
+        owner.original_cache_path_minio = blob_preview.cache_path_minio
+        owner.original_preview_etag = blob_preview.etag
+    else:
+        owner.design_cache_path = blob_preview.cache_path
+        owner.design_cache_path_minio = blob_preview.cache_path_minio
+        owner.design_preview_etag = blob_preview.etag
+    await db.commit()
+    return blob_preview.cache_path_minio, blob_preview.cache_path, blob_preview.etag
+
+async def store_preview_etag(db: AsyncSession, owner, pedido_id: int, tipo: str, width: int, etag: str):
+    """
+    Guarda el hash de contenido (ETag) de la previsualización en su fila.
+    """
+    if width is not None:
+        (await get_or_create_variant(db, pedido_id, tipo, width)).etag = etag
+    elif tipo == "original":
+        owner.original_preview_etag = etag
+    else:
+        owner.design_preview_etag = etag
+    await db.commit()
+
+def versioned_preview_url(pedido_id: int, tipo: str, etag: str, width: int = None) -> str:
+    """
+    URL inmutable de una versión concreta de la previsualización.
+    """
+    url = f"/preview/{tipo}/{pedido_id}/{etag}.webp"
+    return f"{url}?w={width}" if width else url
+
+_preview_flights = SingleFlight()
+
+async def get_or_build_preview(pedido_id: int, tipo: str, source_path: str, cloud_cache_path: str = None, width: int = None,
+                               local_source: str = None, source_size: int = None):
+    """
+    Obtiene los bytes de la previsualización 'tipo' ('original' o 'design') del pedido cuando no
+    está en la caché local: la lee de Yandex Disk si ya se subió, o lee 'source_path' en streaming
+    (a disco si es CDR o supera STREAM_DECODE_MAX_BYTES; con 'source_size', el tamaño registrado
+    del archivo, se decide antes de empezar a leer) y la genera (limitada a 'width' si
+    se indica). Con 'local_source' se genera directamente desde
+    esa copia local del archivo, sin descargar nada. Las peticiones simultáneas del mismo
+    pedido/tipo/ancho comparten una sola ejecución
+    (y entre workers se coordinan con un lock de archivo en el directorio de caché).
+    Retorna (preview_bytes, generada); 'generada' es True solo para la petición que la generó.
+    """
+    cache_dir = CACHE_ORIGINAL_DIR if tipo == "original" else CACHE_DESIGN_DIR
+
+    async def build():
+        async with file_lock(cache_dir, preview_filename(pedido_id, tipo, width)):
+            # Otro worker pudo haberla generado mientras se esperaba el lock
+            preview_bytes = await get_cached_preview_bytes(pedido_id, tipo, width)
+            if preview_bytes is not None:
+                return preview_bytes, False
+
+            if local_source:
+                preview_bytes = await render_engine.render(local_source, width)
+                await set_cached_preview(pedido_id, tipo, preview_bytes, width)
+                PREVIEWS_GENERATED.inc("local")
+                return preview_bytes, True
+
+            # Revisar si la previsualización ya está en la nube (Yandex Disk); se lee en streaming
+            if cloud_cache_path:
+                try:
+                    preview_bytes = bytes(await read_from_cloud(cloud_cache_path))
+                    await set_cached_preview(pedido_id, tipo, preview_bytes, width)
+                    PREVIEW_CACHE_REQUESTS.inc("cloud", "hit")
+                    return preview_bytes, False
+                except Exception:
+                    # Si falla la descarga, se continúa con la generación de la previsualización
+                    PREVIEW_CACHE_REQUESTS.inc("cloud", "miss")
+
+            # Los formatos que Pillow abre directamente se decodifican desde memoria, sin archivo temporal
+            fits_in_memory = source_size is None or source_size <= STREAM_DECODE_MAX_BYTES
+            if fits_in_memory and not source_path.lower().endswith(".cdr"):
+                try:
+                    source_bytes = await read_from_cloud(source_path, STREAM_DECODE_MAX_BYTES)
+                except Exception as e:
+                    raise HTTPException(status_code=500, detail=f"Error al descargar archivo: {str(e)}")
+                if source_bytes is not None:
+                    preview_bytes = await render_engine.render(source_bytes, width)
+                    await set_cached_preview(pedido_id, tipo, preview_bytes, width)
+                    PREVIEWS_GENERATED.inc("stream")
+                    return preview_bytes, True
+
+            # Directorio temporal propio: los trabajos no se pisan los archivos entre sí
+            temp_dir = tempfile.mkdtemp(prefix=f"{tipo}_{pedido_id}_", dir=UPLOAD_FOLDER)
+            try:
+                # CDR (Inkscape necesita un archivo) o archivos muy grandes: se descargan al disco
+                temp_download = os.path.join(temp_dir, os.path.basename(source_path))
+                try:
+                    await download_from_cloud(source_path, temp_download)
+                except Exception as e:
+                    raise HTTPException(status_code=500, detail=f"Error al descargar archivo: {str(e)}")
+
+                # La conversión se ejecuta en el pool de procesos de render
+                preview_bytes = await render_engine.render(temp_download, width)
+                await set_cached_preview(pedido_id, tipo, preview_bytes, width)
+                PREVIEWS_GENERATED.inc("download")
+                return preview_bytes, True
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+    (preview_bytes, generated), shared = await _preview_flights.do((tipo, pedido_id, width), build)
+    return preview_bytes, generated and not shared
+
+def schedule_eager_previews(background_tasks: BackgroundTasks, local_path: str, pedido_id: int, tipo: str, owner_id: int) -> bool:
+    """
+    Si está habilitado, programa la generación de las previsualizaciones desde el archivo recién
+    subido. El archivo se renombra a un nombre único y pasa a ser de la tarea, que lo elimina al
+    terminar. Retorna True si se programó (el llamador ya no debe borrar 'local_path').
+    """
+    if not (EAGER_PREVIEW_ENABLED and PREVIEW_ENABLED and background_tasks is not None):
+        return False
+    ext = os.path.splitext(local_path)[1]
+    eager_path = os.path.join(UPLOAD_FOLDER, f"eager_{tipo}_{pedido_id}_{uuid.uuid4().hex}{ext}")
+    os.replace(local_path, eager_path)
+    background_tasks.add_task(render_previews_eagerly, eager_path, pedido_id, tipo, owner_id)
+    return True
 
-        db.commit()
-        db.close()
+async def render_previews_eagerly(local_path: str, pedido_id: int, tipo: str, owner_id: int):
+    """
+    Tarea en background: genera la previsualización completa y las de EAGER_PREVIEW_WIDTHS desde
+    la copia local, las deja en la caché y encola su subida a Yandex Disk y MinIO, de modo que la
+    primera consulta ya sea un acierto. Se omiten las que el mismo contenido ya tiene subidas.
+    """
+    model = Pedido if tipo == "original" else Diseno
+    try:
+        for width in (None,) + EAGER_PREVIEW_WIDTHS:
+            async with SessionLocal() as db:
+                owner = await db.get(model, owner_id)
+                if owner is None:
+                    return
+                if await find_blob_preview(db, owner_sha256(owner, tipo), width):
+                    continue
+            # La sesión no se mantiene abierta mientras se genera (no retiene una conexión del pool)
+            preview_bytes, generated = await get_or_build_preview(
+                pedido_id, tipo, None, width=width, local_source=local_path
+            )
+            if not generated:
+                continue
+            async with SessionLocal() as db:
+                owner = await db.get(model, owner_id)
+                if owner is None:
+                    return
+                await store_preview_etag(db, owner, pedido_id, tipo, width, preview_etag(preview_bytes))
+                source_path = owner.original_path if tipo == "original" else owner.design_path
+                await enqueue_preview_sync(db, owner, pedido_id, tipo, width, source_path)
     except Exception as e:
-        # Aquí se podría registrar el error con logging
-        print(f"Error en upload_preview_and_update_db: {e}")
+        print(f"Error generando previsualizaciones al subir ({tipo} {pedido_id}): {e}")
+    finally:
+        if os.path.exists(local_path):
+            os.remove(local_path)
+
+async def serve_preview(request: Request, db: AsyncSession, owner, pedido_id: int, tipo: str, source_path: str,
+                        width: int = None, version: str = None):
+    """
+    Lógica común de los endpoints de previsualización.
+    Sin 'version' (URL sin versión): si ya está en MinIO retorna la URL firmada; si no, sirve los
+    bytes con ETag y Cache-Control: no-cache, y Content-Location apuntando a la URL versionada.
+    Con 'version' (URL inmutable): sirve los bytes solo si coinciden con ese hash, con
+    Cache-Control immutable. En ambos casos un If-None-Match vigente responde 304 sin tocar disco.
+    """
+    minio_path, cloud_cache_path, etag = await get_preview_locations(db, owner, pedido_id, tipo, width)
+    if not minio_path and not cloud_cache_path:
+        # Otro pedido con el mismo archivo pudo haberla generado ya
+        adopted = await adopt_blob_preview(db, owner, pedido_id, tipo, width)
+        if adopted[0] or adopted[1]:
+            minio_path, cloud_cache_path, etag = adopted
+
+    if version is None:
+        # 1. Verificar si la previsualización ya está en MinIO (la URL se firma localmente)
+        if minio_path:
+            PREVIEW_CACHE_REQUESTS.inc("minio", "hit")
+            return {"preview_url": generate_minio_presigned_url(minio_path)}
+        PREVIEW_CACHE_REQUESTS.inc("minio", "miss")
+        # 2. El cliente ya tiene la versión vigente
+        if etag and etag_matches(request, etag):
+            return not_modified(etag)
+    elif etag != version:
+        raise HTTPException(status_code=404, detail="Versión de previsualización no encontrada")
+
+    # 3. Buscar en caché local (memoria o disco), o descargar de Yandex Disk / generar la previsualización
+    cached = await get_cached_preview_entry(pedido_id, tipo, width)
+    if cached is None:
+        # Cerrar la transacción de lectura: no se retiene una conexión del pool mientras se genera
+        await db.commit()
+        preview_bytes, generated = await get_or_build_preview(
+            pedido_id, tipo, source_path, cloud_cache_path, width, source_size=owner_size(owner, tipo)
+        )
+        # Subir la previsualización a la nube (Yandex Disk y MinIO) desde la cola de trabajos
+        if generated:
+            await enqueue_preview_sync(db, owner, pedido_id, tipo, width, source_path)
+        cached = CachedPreview(memoryview(preview_bytes), None, preview_etag(preview_bytes), len(preview_bytes))
+
+    current_etag = cached.etag
+    if current_etag != etag:
+        await store_preview_etag(db, owner, pedido_id, tipo, width, current_etag)
+    if version is not None and current_etag != version:
+        # Se regeneró con otro contenido: esta versión ya no existe
+        raise HTTPException(status_code=404, detail="Versión de previsualización no encontrada")
+    immutable = version is not None
+    content_location = None if immutable else versioned_preview_url(pedido_id, tipo, current_etag, width)
+    # Desde memoria se sirve el memoryview guardado; desde disco, el archivo (sendfile) sin leerlo
+    if cached.path is not None:
+        return preview_file_response(request, cached.path, current_etag, immutable, content_location)
+    return preview_response(request, cached.data, current_etag, immutable, content_location)
 
 # Endpoint 1: Recepción del Pedido (Fase 1)
 @router.post("/pedido", response_model=dict)
-async def create_pedido(client_info: str = None, file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def create_pedido(client_info: str = None, file: UploadFile = File(...), db: AsyncSession = Depends(get_db),
+                        background_tasks: BackgroundTasks = None):
     upload_path = None
     cloud_path = None
     try:
         # 1. Crear el pedido inicialmente sin la ruta definitiva
         nuevo_pedido = Pedido(client_info=client_info, original_path="")  # valor provisional
         db.add(nuevo_pedido)
-        db.commit()       # Se confirma para generar el ID
-        db.refresh(nuevo_pedido)
+        await db.commit()       # Se confirma para generar el ID
+        await db.refresh(nuevo_pedido)
 
         # 2. Guardar el archivo temporalmente utilizando el ID en el nombre, preservando la extensión original
         ext = os.path.splitext(file.filename)[1]  # extrae la extensión (incluye el punto)
         filename_with_id = f"original_{nuevo_pedido.id}{ext}"
         upload_path = os.path.join(UPLOAD_FOLDER, filename_with_id)
-        with open(upload_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        # 3. Subir el archivo a la nube
         try:
-            cloud_path = upload_to_cloud(upload_path, filename_with_id)
-        except Exception as e:
-            # Si falla la subida a la nube, eliminar el pedido de la BD y propagar el error
-            db.delete(nuevo_pedido)
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"Error subiendo a Yandex Disk: {str(e)}")
+            sha256, size = await save_upload_file(file, upload_path)
+        except HTTPException:
+            # Archivo demasiado grande: se elimina el pedido provisional
+            await db.delete(nuevo_pedido)
+            await db.commit()
+            raise
+
+        # 3. Subir el archivo a la nube, salvo que ese mismo contenido ya se haya subido antes
+        blob = await find_blob(db, sha256)
+        if blob is not None:
+            cloud_path = blob.remote_path
+        else:
+            try:
+                cloud_path = await upload_to_cloud(upload_path, filename_with_id)
+            except Exception as e:
+                # Si falla la subida a la nube, eliminar el pedido de la BD y propagar el error
+                await db.delete(nuevo_pedido)
+                await db.commit()
+                raise HTTPException(status_code=500, detail=f"Error subiendo a Yandex Disk: {str(e)}")
+            await register_blob(db, sha256, size, cloud_path)
 
         # 4. Actualizar el pedido con la ruta del archivo en la nube
         nuevo_pedido.original_path = cloud_path
+        nuevo_pedido.original_sha256 = sha256
+        nuevo_pedido.original_size = size
         try:
-            db.commit()
+            await db.commit()
         except Exception as e:
             # Si falla el commit, eliminar el pedido de la BD y borrar el archivo de la nube
-            db.delete(nuevo_pedido)
-            db.commit()
-            try:
-                delete_from_cloud(cloud_path)  # Función para borrar el archivo de la nube
-            except Exception as del_err:
-                # Se podría registrar el error, pero se propaga el error original
-                pass
+            # (solo si lo subió esta petición: un blob existente lo comparten otros pedidos)
+            await db.rollback()
+            await db.delete(nuevo_pedido)
+            await db.commit()
+            if blob is None:
+                try:
+                    await delete_from_cloud(cloud_path)  # Función para borrar el archivo de la nube
+                except Exception as del_err:
+                    # Se podría registrar el error, pero se propaga el error original
+                    pass
             raise HTTPException(status_code=500, detail=f"Error actualizando el pedido en la base de datos: {str(e)}")
 
+        # 5. Generar las previsualizaciones desde la copia local (opcional, en background)
+        if schedule_eager_previews(background_tasks, upload_path, nuevo_pedido.id, "original", nuevo_pedido.id):
+            upload_path = None  # el archivo ahora es de la tarea en background
+
         return {"pedido_id": nuevo_pedido.id, "estado": nuevo_pedido.estado}
 
+    except HTTPException:
+        await db.rollback()
+        raise
+
     except Exception as general_error:
-        db.rollback()  # Revertir cualquier cambio pendiente en la BD
+        await db.rollback()  # Revertir cualquier cambio pendiente en la BD
         raise HTTPException(status_code=500, detail=f"Error en la creación del pedido: {str(general_error)}")
 
     finally:
@@ -112,181 +491,632 @@ async def create_pedido(client_info: str = None, file: UploadFile = File(...), d
                 # Se podría registrar el error de eliminación
                 pass
 
+# Ingesta masiva de pedidos
+@router.post("/pedidos/bulk", response_model=dict)
+async def create_pedidos_bulk(
+    client_info: str = None,
+    files: List[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    db: AsyncSession = Depends(get_db),
+    background_tasks: BackgroundTasks = None,
+):
+    """
+    Crea un pedido por cada archivo recibido: varios archivos en 'files' y/o un zip en 'archive'
+    (se extrae por bloques, sin cargar los archivos en memoria).
+    - Todas las filas se insertan en una sola sentencia (INSERT ... RETURNING id) y las rutas se
+      actualizan al final en otra: dos commits por lote en lugar de tres por archivo.
+    - Las subidas a Yandex Disk van en lote (un solo rclone con --transfers, ver
+      upload_batch_to_cloud); los contenidos ya conocidos (o repetidos en el lote) se suben una vez.
+    Retorna el estado de cada archivo; los que fallan no dejan pedido creado.
+    """
+    files = files or []
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="Debe enviar archivos en 'files' o un zip en 'archive'")
+    if len(files) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Se permiten como máximo {BULK_MAX_ITEMS} archivos por lote")
+
+    work_dir = tempfile.mkdtemp(prefix="bulk_", dir=UPLOAD_FOLDER)
+    inserted = []
+    try:
+        # 1. Recibir los archivos a disco (con hash y tamaño)
+        items = []
+        for index, file in enumerate(files):
+            path = os.path.join(work_dir, f"file_{index}{os.path.splitext(file.filename)[1]}")
+            try:
+                sha256, size = await save_upload_file(file, path)
+            except HTTPException as e:
+                items.append({"filename": file.filename, "error": e.detail})
+                continue
+            items.append({"filename": file.filename, "path": path, "sha256": sha256, "size": size})
+        if archive is not None:
+            archive_path = os.path.join(work_dir, "archive.zip")
+            await save_upload_file(archive, archive_path)
+            zip_dir = tempfile.mkdtemp(prefix="zip_", dir=work_dir)
+            items += await asyncio.to_thread(extract_zip, archive_path, zip_dir, BULK_MAX_ITEMS - len(files))
+            os.remove(archive_path)
+        valid = [item for item in items if "error" not in item]
+
+        # 2. Insertar todos los pedidos de una vez; los ids vuelven en el orden de las filas
+        if valid:
+            result = await db.execute(
+                insert(Pedido).returning(Pedido.id, sort_by_parameter_order=True),
+                [
+                    {"client_info": client_info, "original_path": "", "estado": "nuevo",
+                     "original_sha256": item["sha256"], "original_size": item["size"]}
+                    for item in valid
+                ],
+            )
+            for item, pedido_id in zip(valid, result.scalars().all()):
+                item["pedido_id"] = pedido_id
+            await db.commit()
+            inserted = [item["pedido_id"] for item in valid]
+
+        # 3. Subir cada contenido distinto una sola vez, salvo los que ya están en la nube
+        hashes = {item["sha256"] for item in valid}
+        known = {}
+        if hashes:
+            result = await db.execute(select(Blob.sha256, Blob.remote_path).where(Blob.sha256.in_(hashes)))
+            known = dict(result.all())
+            await db.commit()
+        first_by_hash = {}
+        for item in valid:
+            if item["sha256"] not in known:
+                first_by_hash.setdefault(item["sha256"], item)
+
+        batch = []
+        for item in first_by_hash.values():
+            filename = f"original_{item['pedido_id']}{os.path.splitext(item['filename'])[1]}"
+            # rclone sube el archivo con su nombre local
+            local_path = os.path.join(os.path.dirname(item["path"]), filename)
+            os.replace(item["path"], local_path)
+            item["path"] = local_path
+            batch.append((local_path, filename))
+        outcomes = await upload_batch_to_cloud(batch)
+        uploaded = dict(zip(first_by_hash, outcomes))
+
+        # 4. Guardar las rutas y registrar los blobs nuevos; borrar los pedidos cuya subida falló
+        paths, failed = [], []
+        for item in valid:
+            remote = known.get(item["sha256"], uploaded.get(item["sha256"]))
+            if isinstance(remote, BaseException):
+                item["error"] = f"Error subiendo a Yandex Disk: {remote}"
+                failed.append(item["pedido_id"])
+            else:
+                item["remote_path"] = remote
+                item["deduplicated"] = item["sha256"] in known or first_by_hash.get(item["sha256"]) is not item
+                paths.append({"id": item["pedido_id"], "original_path": remote})
+        if paths:
+            await db.execute(update(Pedido), paths)
+        if failed:
+            await db.execute(delete(Pedido).where(Pedido.id.in_(failed)))
+        for sha256, remote in uploaded.items():
+            if not isinstance(remote, BaseException):
+                await register_blob(db, sha256, first_by_hash[sha256]["size"], remote)
+        await db.commit()
+
+        # 5. Generar las previsualizaciones desde las copias locales (opcional, en background)
+        for item in valid:
+            if "error" not in item and os.path.exists(item["path"]):
+                schedule_eager_previews(background_tasks, item["path"], item["pedido_id"], "original", item["pedido_id"])
+    except Exception as error:
+        await db.rollback()
+        # Eliminar los pedidos provisionales que quedaron sin ruta en la nube
+        if inserted:
+            await db.execute(delete(Pedido).where(Pedido.id.in_(inserted), Pedido.original_path == ""))
+            await db.commit()
+        if isinstance(error, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Error en la ingesta masiva: {str(error)}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = []
+    for item in items:
+        if "error" in item:
+            results.append({"filename": item["filename"], "estado": "error", "error": item["error"]})
+        else:
+            results.append({
+                "filename": item["filename"],
+                "estado": "ok",
+                "pedido_id": item["pedido_id"],
+                "original_path": item["remote_path"],
+                "sha256": item["sha256"],
+                "size": item["size"],
+                "deduplicated": item["deduplicated"],
+            })
+    return {
+        "items": results,
+        "ok": sum(1 for r in results if r["estado"] == "ok"),
+        "errors": sum(1 for r in results if r["estado"] == "error"),
+    }
+
 # Endpoint 2: Previsualización de la imagen original (Fase 1)
 @router.get("/preview/original/{pedido_id}")
 async def preview_original(
     pedido_id: int,
-    db: Session = Depends(get_db),
-    background_tasks: BackgroundTasks = None
+    request: Request,
+    w: Optional[int] = Query(None, description="Ancho máximo de la previsualización"),
+    db: AsyncSession = Depends(get_db)
 ):
     if not PREVIEW_ENABLED:
         raise HTTPException(status_code=403, detail="Previsualización no habilitada para este usuario")
+    check_preview_width(w)
 
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+    pedido = await db.get(Pedido, pedido_id)
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
 
-    # 1. Verificar si la URL de MinIO ya está disponible
-    if pedido.original_cache_url_minio:
-        return {"preview_url": pedido.original_cache_url_minio}
-
-    # 2. Buscar en caché local
-    cache_file = get_cached_preview(pedido_id, "original")
-    if cache_file:
-        return StreamingResponse(open(cache_file, "rb"), media_type="image/webp")
-
-    # 3. Revisar si la previsualización ya está en la nube (Yandex Disk)
-    if pedido.original_cache_path:
-        # Usar un nombre de archivo por defecto en el directorio de caché
-        cache_file = os.path.join(CACHE_ORIGINAL_DIR, f"cache_original_{pedido_id}.webp")
-        try:
-            download_from_cloud(pedido.original_cache_path, cache_file)
-            return StreamingResponse(open(cache_file, "rb"), media_type="image/webp")
-        except Exception as e:
-            # Si falla la descarga, se continúa con la generación de la previsualización
-            pass
-
-    # 4. Descargar el archivo original desde la nube y generar la previsualización
-    original_filename = os.path.basename(pedido.original_path)
-    temp_download = os.path.join(UPLOAD_FOLDER, original_filename)
-    try:
-        download_from_cloud(pedido.original_path, temp_download)
-        print("SE DESCARGO EL ARCHIVO ORIGINAL")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al descargar archivo: {str(e)}")
+    return await serve_preview(request, db, pedido, pedido_id, "original", pedido.original_path, w)
 
-    # Ejecutar la conversión en un thread para evitar bloquear el event loop
-    preview_bytes = await asyncio.to_thread(generate_preview, temp_download)
-    cache_file = set_cached_preview(pedido_id, "original", preview_bytes)
-    os.remove(temp_download)
+@router.get("/preview/original/{pedido_id}/{version}.webp")
+async def preview_original_version(
+    pedido_id: int,
+    version: str,
+    request: Request,
+    w: Optional[int] = Query(None, description="Ancho máximo de la previsualización"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Versión inmutable de la previsualización original (el hash de contenido va en la URL).
+    """
+    if not PREVIEW_ENABLED:
+        raise HTTPException(status_code=403, detail="Previsualización no habilitada para este usuario")
+    check_preview_width(w)
+    # El contenido de una versión nunca cambia: no hace falta consultar la BD
+    if etag_matches(request, version):
+        return not_modified(version, immutable=True)
 
-    # 5. Subir la previsualización a la nube (Yandex Disk y MinIO) en background
-    preview_filename = f"cache_original_{pedido_id}.webp"
-    if background_tasks:
-        background_tasks.add_task(upload_preview_and_update_db, cache_file, preview_filename, pedido, "original")
+    pedido = await db.get(Pedido, pedido_id)
+    if not pedido:
+        raise HTTPException(status_code=404, detail="Pedido no encontrado")
 
-    return StreamingResponse(io.BytesIO(preview_bytes), media_type="image/webp")
+    return await serve_preview(request, db, pedido, pedido_id, "original", pedido.original_path, w, version)
 
 
 @router.post("/design/{pedido_id}", response_model=dict)
-async def upload_design(pedido_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_design(pedido_id: int, file: UploadFile = File(...), db: AsyncSession = Depends(get_db),
+                        background_tasks: BackgroundTasks = None):
     """
     Sube el archivo del diseño final a la nube y registra la ruta en la BD.
     """
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+    pedido = await db.get(Pedido, pedido_id)
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
 
+    # Cada diseño de un mismo pedido debe tener su propio nombre remoto: un blob apunta a esa ruta
+    # y no puede cambiar de contenido. El nombre lleva el hash, que se conoce tras guardar el archivo.
     ext = os.path.splitext(file.filename)[1]
-    new_filename = f"{pedido_id}_design{ext}"
-    upload_path = os.path.join(UPLOAD_FOLDER, new_filename)
-    with open(upload_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    upload_dir = tempfile.mkdtemp(prefix=f"design_{pedido_id}_", dir=UPLOAD_FOLDER)
+    received_path = os.path.join(upload_dir, f"upload{ext}")
+    try:
+        sha256, size = await save_upload_file(file, received_path)
+    except BaseException:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise
+    new_filename = f"{pedido_id}_design_{sha256[:16]}{ext}"
+    upload_path = os.path.join(upload_dir, new_filename)
+    os.replace(received_path, upload_path)
 
+    # Si el mismo contenido ya está en la nube solo se registra la referencia
     try:
-        cloud_path = upload_to_cloud(upload_path, new_filename)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error subiendo a la nube: {str(e)}")
+        blob = await find_blob(db, sha256)
+        if blob is not None:
+            cloud_path = blob.remote_path
+        else:
+            try:
+                cloud_path = await upload_to_cloud(upload_path, new_filename)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error subiendo a la nube: {str(e)}")
+            await register_blob(db, sha256, size, cloud_path)
 
-    nuevo_diseno = Diseno(pedido_id=pedido_id, design_path=cloud_path)
-    db.add(nuevo_diseno)
-    db.commit()
-    db.refresh(nuevo_diseno)
+        nuevo_diseno = Diseno(pedido_id=pedido_id, design_path=cloud_path, design_sha256=sha256, design_size=size)
+        db.add(nuevo_diseno)
+        await db.commit()
+        await db.refresh(nuevo_diseno)
+        # Generar las previsualizaciones desde la copia local (opcional, en background). Solo para
+        # el primer diseño: es el que sirve /preview/design, y la caché y las variantes son por pedido
+        first_design = await get_first_design(db, pedido_id)
+        if first_design.id == nuevo_diseno.id:
+            schedule_eager_previews(background_tasks, upload_path, pedido_id, "design", nuevo_diseno.id)
+    finally:
+        # Si se programó la generación de previsualizaciones el archivo ya se movió fuera del directorio
+        shutil.rmtree(upload_dir, ignore_errors=True)
     return {"design_id": nuevo_diseno.id, "estado": nuevo_diseno.estado}
 
 @router.get("/preview/design/{pedido_id}")
-async def preview_design(pedido_id: int, db: Session = Depends(get_db), background_tasks: BackgroundTasks = None):
+async def preview_design(
+    pedido_id: int,
+    request: Request,
+    w: Optional[int] = Query(None, description="Ancho máximo de la previsualización"),
+    db: AsyncSession = Depends(get_db)
+):
     """
     Retorna la previsualización del diseño. Si no está cacheada, la genera y la sube a la nube.
     """
     if not PREVIEW_ENABLED:
         raise HTTPException(status_code=403, detail="Previsualización no habilitada")
+    check_preview_width(w)
 
-    diseno = db.query(Diseno).filter(Diseno.pedido_id == pedido_id).first()
+    diseno = await get_first_design(db, pedido_id)
     if not diseno:
         raise HTTPException(status_code=404, detail="Diseño no encontrado para el pedido")
 
-    # 1. Verificar si la URL de MinIO ya está disponible
-    if diseno.design_cache_url_minio:
-        return {"preview_url": diseno.design_cache_url_minio}
+    return await serve_preview(request, db, diseno, pedido_id, "design", diseno.design_path, w)
+
+@router.get("/preview/design/{pedido_id}/{version}.webp")
+async def preview_design_version(
+    pedido_id: int,
+    version: str,
+    request: Request,
+    w: Optional[int] = Query(None, description="Ancho máximo de la previsualización"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Versión inmutable de la previsualización del diseño (el hash de contenido va en la URL).
+    """
+    if not PREVIEW_ENABLED:
+        raise HTTPException(status_code=403, detail="Previsualización no habilitada")
+    check_preview_width(w)
+    # El contenido de una versión nunca cambia: no hace falta consultar la BD
+    if etag_matches(request, version):
+        return not_modified(version, immutable=True)
+
+    diseno = await get_first_design(db, pedido_id)
+    if not diseno:
+        raise HTTPException(status_code=404, detail="Diseño no encontrado para el pedido")
 
-    # 2. Buscar en caché local
-    cache_file = get_cached_preview(pedido_id, "design")
-    if cache_file:
-        return StreamingResponse(open(cache_file, "rb"), media_type="image/webp")
+    return await serve_preview(request, db, diseno, pedido_id, "design", diseno.design_path, w, version)
 
-    # 3. Revisar si la previsualización ya está en la nube (Yandex Disk)
-    if diseno.design_cache_path:
-        local_cache = os.path.join(CACHE_DESIGN_DIR, f"cache_design_{pedido_id}.webp")
-        try:
-            download_from_cloud(diseno.design_cache_path, local_cache)
-            return StreamingResponse(open(local_cache, "rb"), media_type="image/webp")
-        except Exception:
-            pass
-
-    # 4. Descargar el archivo original desde la nube y generar la previsualización
-    original_filename = os.path.basename(diseno.design_path)
-    temp_download = os.path.join(UPLOAD_FOLDER, original_filename)
-    try:
-        download_from_cloud(diseno.design_path, temp_download)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al descargar diseño: {str(e)}")
+def parse_batch_item(item) -> tuple:
+    """
+    Valida un elemento de POST /previews/batch y retorna (pedido_id, tipo, ancho).
+    """
+    if not isinstance(item, dict) or not isinstance(item.get("pedido_id"), int):
+        raise HTTPException(status_code=400, detail="Cada elemento debe tener un 'pedido_id' entero")
+    tipo = item.get("tipo", "original")
+    if tipo not in ("original", "design"):
+        raise HTTPException(status_code=400, detail="El tipo de previsualización debe ser 'original' o 'design'")
+    width = item.get("w")
+    check_preview_width(width)
+    return item["pedido_id"], tipo, width
+
+_batch_render_semaphore = asyncio.Semaphore(PREVIEW_BATCH_CONCURRENCY)
+
+async def render_batch_previews(misses: list):
+    """
+    Tarea en background de POST /previews/batch: genera las previsualizaciones que faltaban
+    (como mucho PREVIEW_BATCH_CONCURRENCY a la vez entre todas las peticiones, para no llenar la
+    cola del motor de render), guarda su ETag y encola la subida a Yandex Disk y MinIO.
+    'misses' es una lista de (pedido_id, tipo, id del dueño, ancho, ruta original, tamaño del
+    original, ruta en Yandex).
+    """
+    async def render_one(pedido_id, tipo, owner_id, width, source_path, source_size, cloud_cache_path):
+        async with _batch_render_semaphore:
+            try:
+                preview_bytes, generated = await get_or_build_preview(
+                    pedido_id, tipo, source_path, cloud_cache_path, width, source_size=source_size
+                )
+                async with SessionLocal() as db:
+                    owner = await db.get(Pedido if tipo == "original" else Diseno, owner_id)
+                    if owner is None:
+                        return
+                    await store_preview_etag(db, owner, pedido_id, tipo, width, preview_etag(preview_bytes))
+                    if generated:
+                        await enqueue_preview_sync(db, owner, pedido_id, tipo, width, source_path)
+            except Exception as e:
+                print(f"Error generando previsualización del lote ({tipo} {pedido_id}, w={width}): {e}")
+
+    await asyncio.gather(*(render_one(*miss) for miss in misses))
+
+@router.post("/previews/batch", response_model=dict)
+async def preview_batch(
+    items: List[dict] = Body(..., embed=True, description="Lista de {pedido_id, tipo ('original' o 'design'), w}"),
+    db: AsyncSession = Depends(get_db),
+    background_tasks: BackgroundTasks = None,
+):
+    """
+    Previsualizaciones de muchos pedidos en una sola petición (p. ej. una galería).
+    Pedidos, diseños, variantes por ancho y previsualizaciones compartidas por contenido se
+    resuelven con una consulta IN cada una, sin importar cuántos elementos haya. Lo que ya está
+    en MinIO se retorna como URL firmada (se firma localmente) y lo que solo está en la caché
+    local como URL versionada; lo que falta se genera en background y se reporta 'pendiente'
+    para que el cliente vuelva a pedirlo más tarde.
+    """
+    if not PREVIEW_ENABLED:
+        raise HTTPException(status_code=403, detail="Previsualización no habilitada")
+    if len(items) > PREVIEW_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Demasiadas previsualizaciones en el lote (máximo {PREVIEW_BATCH_MAX_ITEMS})")
+    requested = [parse_batch_item(item) for item in items]
 
-    preview_bytes = await asyncio.to_thread(generate_preview, temp_download)
-    cache_file = set_cached_preview(pedido_id, "design", preview_bytes)
-    os.remove(temp_download)
+    pedido_ids = {pedido_id for pedido_id, tipo, _ in requested if tipo == "original"}
+    design_pedido_ids = {pedido_id for pedido_id, tipo, _ in requested if tipo == "design"}
+    widths = {width for _, _, width in requested if width is not None}
 
-    # 5. Subir la previsualización a la nube (Yandex Disk y MinIO) en background
-    preview_filename = f"cache_design_{pedido_id}webp"
-    if background_tasks:
-        background_tasks.add_task(upload_preview_and_update_db, cache_file, preview_filename, diseno, "design")
+    pedidos = {}
+    if pedido_ids:
+        result = await db.execute(select(Pedido).where(Pedido.id.in_(pedido_ids)))
+        pedidos = {p.id: p for p in result.scalars()}
+    disenos = {}
+    if design_pedido_ids:
+        # Como en /preview/design, se usa el primer diseño de cada pedido
+        result = await db.execute(
+            select(Diseno).where(Diseno.pedido_id.in_(design_pedido_ids)).order_by(Diseno.pedido_id, Diseno.id)
+        )
+        for diseno in result.scalars():
+            disenos.setdefault(diseno.pedido_id, diseno)
+    variants = {}
+    if widths:
+        result = await db.execute(select(PreviewVariant).where(
+            PreviewVariant.pedido_id.in_(pedido_ids | design_pedido_ids),
+            PreviewVariant.width.in_(widths),
+        ))
+        variants = {(v.pedido_id, v.tipo, v.width): v for v in result.scalars()}
 
-    return StreamingResponse(io.BytesIO(preview_bytes), media_type="image/webp")
+    def owner_of(pedido_id, tipo):
+        return pedidos.get(pedido_id) if tipo == "original" else disenos.get(pedido_id)
+
+    def locations(pedido_id, tipo, width):
+        owner = owner_of(pedido_id, tipo)
+        if width is None:
+            if tipo == "original":
+                return owner.original_cache_path_minio, owner.original_cache_path, owner.original_preview_etag
+            return owner.design_cache_path_minio, owner.design_cache_path, owner.design_preview_etag
+        variant = variants.get((pedido_id, tipo, width))
+        if variant is None:
+            return None, None, None
+        return variant.cache_path_minio, variant.cache_path, variant.etag
+
+    # Otros pedidos con el mismo archivo pudieron haber subido ya la previsualización
+    shared_wanted = {
+        (owner_sha256(owner_of(pedido_id, tipo), tipo), width or 0)
+        for pedido_id, tipo, width in requested
+        if owner_of(pedido_id, tipo) is not None and not locations(pedido_id, tipo, width)[0]
+    }
+    shared = {}
+    shas = {sha256 for sha256, _ in shared_wanted if sha256}
+    if shas:
+        result = await db.execute(select(BlobPreview).where(
+            BlobPreview.sha256.in_(shas),
+            BlobPreview.width.in_({width for _, width in shared_wanted}),
+        ))
+        shared = {(bp.sha256, bp.width): bp for bp in result.scalars() if bp.cache_path_minio}
+
+    results = []
+    misses = {}
+    for pedido_id, tipo, width in requested:
+        entry = {"pedido_id": pedido_id, "tipo": tipo, "w": width}
+        results.append(entry)
+        owner = owner_of(pedido_id, tipo)
+        if owner is None:
+            entry["estado"] = "no_encontrado"
+            continue
+        minio_path, cloud_cache_path, etag = locations(pedido_id, tipo, width)
+        blob_preview = shared.get((owner_sha256(owner, tipo), width or 0))
+        if not minio_path and blob_preview is not None:
+            minio_path, etag = blob_preview.cache_path_minio, blob_preview.etag
+        if minio_path:
+            entry.update(estado="ok", preview_url=generate_minio_presigned_url(minio_path))
+        elif etag and await get_cached_preview(pedido_id, tipo, width):
+            entry.update(estado="ok", preview_url=versioned_preview_url(pedido_id, tipo, etag, width))
+        else:
+            entry["estado"] = "pendiente"
+            source_path = owner.original_path if tipo == "original" else owner.design_path
+            misses[(pedido_id, tipo, width)] = (
+                pedido_id, tipo, owner.id, width, source_path, owner_size(owner, tipo), cloud_cache_path
+            )
+
+    if misses and background_tasks is not None:
+        background_tasks.add_task(render_batch_previews, list(misses.values()))
+
+    return {
+        "items": results,
+        "ok": sum(1 for entry in results if entry["estado"] == "ok"),
+        "pending": sum(1 for entry in results if entry["estado"] == "pendiente"),
+    }
 
 # Endpoint 5: Conversión para impresión (Fase 3)
-@router.post("/convert/{pedido_id}", response_model=dict)
-def convert_design(pedido_id: int, db: Session = Depends(get_db)):
-    diseno = db.query(Diseno).filter(Diseno.pedido_id == pedido_id).first()
+PRINT_CONVERT_JOB = "print_convert"
+
+async def convert_print(payload: dict) -> dict:
+    """
+    Handler de los trabajos 'print_convert': descarga el diseño, lo convierte en el pool de
+    conversión (con la memoria acotada, ver render_engine.convert) escribiendo el resultado al
+    disco, lo sube a Yandex Disk y guarda la ruta en el diseño. Retorna la ruta convertida, que
+    queda como resultado del trabajo. Los errores se propagan para que la cola lo reintente, salvo
+    los PermanentJobError de render_engine.convert (archivo que nunca se podrá convertir), que lo
+    marcan fallido de inmediato.
+    """
+    diseno_id, formato = payload["diseno_id"], payload["formato"]
+    async with SessionLocal() as db:
+        diseno = await db.get(Diseno, diseno_id)
+        if diseno is None:
+            print("No se encontró el diseño a convertir: ", diseno_id)
+            return None
+        design_path = diseno.design_path
+
+    converted_filename = f"converted_{diseno_id}{PRINT_FORMATS[formato]}"
+    temp_dir = tempfile.mkdtemp(prefix=f"convert_{diseno_id}_", dir=UPLOAD_FOLDER)
+    try:
+        source_path = os.path.join(temp_dir, os.path.basename(design_path))
+        await download_from_cloud(design_path, source_path)
+        converted_path = os.path.join(temp_dir, converted_filename)
+        await render_engine.convert(source_path, converted_path, formato)
+        cloud_converted_path = await upload_to_cloud(converted_path, converted_filename)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    async with SessionLocal() as db:
+        diseno = await db.get(Diseno, diseno_id)
+        if diseno is not None:
+            diseno.converted_path = cloud_converted_path
+            diseno.estado = "convertido"
+            await db.commit()
+    print(f"Se subió el diseño convertido ({formato}) a Yandex Disk: ", cloud_converted_path)
+    return {"converted_path": cloud_converted_path}
+
+def conversion_status(job: Job) -> dict:
+    status = {
+        "job_id": job.id,
+        "pedido_id": job.payload.get("pedido_id"),
+        "formato": job.payload.get("formato"),
+        "estado": job.estado,
+        "attempts": job.attempts,
+    }
+    if job.estado == DONE:
+        status["converted_path"] = (job.result or {}).get("converted_path")
+    elif job.last_error:
+        status["error"] = job.last_error
+    return status
+
+@router.post("/convert/{pedido_id}", response_model=dict, status_code=202)
+async def convert_design(
+    pedido_id: int,
+    formato: str = Query("jpeg", description="Formato de salida: jpeg (progresivo), tiff o pdf"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Encola la conversión para impresión del diseño del pedido y retorna el id del trabajo;
+    su estado se consulta en GET /convert/jobs/{job_id}. Volver a pedir la misma conversión
+    mientras está pendiente retorna el mismo trabajo.
+    """
+    if formato not in PRINT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado; use uno de: {', '.join(PRINT_FORMATS)}")
+    diseno = await get_first_design(db, pedido_id)
     if not diseno:
         raise HTTPException(status_code=404, detail="Diseño no encontrado para el pedido")
 
-    # Conversión a JPEG optimizado (ejemplo)
-    try:
-        from PIL import Image
-        import io
-        # Se asume que la ruta de diseño es un archivo local o se debe descargar previamente;
-        # aquí se simplifica la lógica usando directamente la ruta
-        with Image.open(diseno.design_path) as img:
-            output = io.BytesIO()
-            img.save(output, format="JPEG", quality=90)
-            converted_bytes = output.getvalue()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error en conversión: {str(e)}")
+    job = await enqueue_job(
+        db, PRINT_CONVERT_JOB, f"{PRINT_CONVERT_JOB}:{diseno.id}:{formato}",
+        {"pedido_id": pedido_id, "diseno_id": diseno.id, "formato": formato},
+        max_attempts=CONVERT_MAX_ATTEMPTS,
+    )
+    return {**conversion_status(job), "status_url": f"/convert/jobs/{job.id}"}
+
+@router.get("/convert/jobs/{job_id}", response_model=dict)
+async def get_conversion(job_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Estado de una conversión para impresión: pendiente, en_proceso, completado (con la ruta
+    del archivo convertido) o fallido (con el último error).
+    """
+    job = await db.get(Job, job_id)
+    if job is None or job.kind != PRINT_CONVERT_JOB:
+        raise HTTPException(status_code=404, detail="Conversión no encontrada")
+    return conversion_status(job)
+
+def design_summary(diseno: Diseno, include_previews: bool = False) -> dict:
+    """
+    Representación de un diseño en las respuestas de consulta de pedidos.
+    """
+    summary = {
+        "design_id": diseno.id,
+        "design_path": diseno.design_path,
+        "converted_path": diseno.converted_path,
+        "estado": diseno.estado,
+        "fecha": diseno.fecha,
+    }
+    if include_previews:
+        summary["preview_url"] = (
+            generate_minio_presigned_url(diseno.design_cache_path_minio) if diseno.design_cache_path_minio else None
+        )
+    return summary
 
-    converted_filename = f"converted_{os.path.basename(diseno.design_path).split('.')[0]}.jpg"
-    converted_path = os.path.join(UPLOAD_FOLDER, converted_filename)
-    with open(converted_path, "wb") as f:
-        f.write(converted_bytes)
+def encode_cursor(pedido: Pedido) -> str:
+    """
+    Cursor opaco de paginación: la posición (fecha, id) del último pedido de la página.
+    """
+    raw = json.dumps([pedido.fecha.isoformat(), pedido.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
+def decode_cursor(cursor: str) -> tuple:
     try:
-        cloud_converted_path = upload_to_cloud(converted_path, converted_filename)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error subiendo archivo convertido a Yandex Disk: {str(e)}")
+        fecha, pedido_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return naive_utc(datetime.fromisoformat(fecha)), int(pedido_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+
+def naive_utc(value: datetime) -> datetime:
+    """
+    Las fechas se guardan en UTC sin zona: un filtro con zona horaria (p. ej. ?desde=...-03:00)
+    se pasa a UTC antes de compararlo con la columna.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+# Listado de pedidos (paginación por cursor)
+@router.get("/pedidos", response_model=dict)
+async def list_pedidos(
+    estado: Optional[str] = Query(None, description="Filtrar por estado"),
+    desde: Optional[datetime] = Query(None, description="Fecha mínima (inclusive)"),
+    hasta: Optional[datetime] = Query(None, description="Fecha máxima (exclusive)"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor de la página anterior"),
+    include_designs: bool = Query(False, description="Incluir los diseños de cada pedido"),
+    include_previews: bool = Query(False, description="Incluir URLs firmadas de las previsualizaciones en MinIO"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Lista los pedidos del más reciente al más antiguo.
+    La paginación es por cursor (keyset sobre (fecha, id)): cada página continúa justo después
+    del último pedido de la anterior usando el índice, así que cuesta lo mismo la página 1 que
+    la 10.000 (con OFFSET la BD tendría que recorrer y descartar todas las filas anteriores).
+    Los diseños se cargan en una sola consulta adicional por página y las URLs se firman localmente.
+    """
+    query = select(Pedido)
+    if estado is not None:
+        query = query.where(Pedido.estado == estado)
+    if desde is not None:
+        query = query.where(Pedido.fecha >= naive_utc(desde))
+    if hasta is not None:
+        query = query.where(Pedido.fecha < naive_utc(hasta))
+    if cursor:
+        query = query.where(tuple_(Pedido.fecha, Pedido.id) < tuple_(*decode_cursor(cursor)))
+    if include_designs:
+        query = query.options(selectinload(Pedido.disenos))
+
+    # Se pide una fila extra para saber si hay otra página
+    result = await db.execute(query.order_by(Pedido.fecha.desc(), Pedido.id.desc()).limit(limit + 1))
+    pedidos = result.scalars().all()
+    has_more = len(pedidos) > limit
+    pedidos = pedidos[:limit]
 
-    diseno.converted_path = cloud_converted_path
-    db.commit()
+    items = []
+    for pedido in pedidos:
+        item = {
+            "pedido_id": pedido.id,
+            "client_info": pedido.client_info,
+            "fecha": pedido.fecha,
+            "estado": pedido.estado,
+            "original_path": pedido.original_path,
+        }
+        if include_previews:
+            item["preview_url"] = (
+                generate_minio_presigned_url(pedido.original_cache_path_minio) if pedido.original_cache_path_minio else None
+            )
+        if include_designs:
+            item["designs"] = [design_summary(d, include_previews) for d in sorted(pedido.disenos, key=lambda d: d.id)]
+        items.append(item)
 
-    return {"converted_path": cloud_converted_path, "estado": "convertido"}
+    return {
+        "items": items,
+        "next_cursor": encode_cursor(pedidos[-1]) if has_more else None,
+    }
 
 # Endpoint 6: Consulta del estado del pedido (Historial y Seguimiento)
 @router.get("/pedido/{pedido_id}", response_model=dict)
-def get_pedido(pedido_id: int, db: Session = Depends(get_db)):
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+async def get_pedido(pedido_id: int, db: AsyncSession = Depends(get_db)):
+    # Pedido y diseños en una sola consulta (LEFT OUTER JOIN)
+    result = await db.execute(
+        select(Pedido)
+        .options(joinedload(Pedido.disenos))
+        .where(Pedido.id == pedido_id)
+    )
+    pedido = result.unique().scalars().first()
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
 
-    diseno = db.query(Diseno).filter(Diseno.pedido_id == pedido_id).first()
+    disenos = sorted(pedido.disenos, key=lambda d: d.id)
+    diseno = disenos[0] if disenos else None
     return {
         "pedido_id": pedido.id,
         "client_info": pedido.client_info,
@@ -297,16 +1127,104 @@ def get_pedido(pedido_id: int, db: Session = Depends(get_db)):
             "design_path": diseno.design_path if diseno else None,
             "converted_path": diseno.converted_path if diseno else None,
             "estado": diseno.estado if diseno else None,
-        }
+        },
+        "designs": [design_summary(d) for d in disenos],
     }
 
+async def stream_download(request: Request, remote_path: str, size: int, sha256: str = None) -> Response:
+    """
+    Respuesta que transmite 'remote_path' desde Yandex Disk sin archivo temporal, con soporte de
+    Range (un solo rango, respetando If-Range) y con el SHA-256 del contenido como ETag.
+    El primer bloque se lee antes de responder, para que un error de rclone sea un 500 y no
+    una respuesta cortada.
+    """
+    if size is None:
+        size = await get_cloud_file_size(remote_path)
+    filename = os.path.basename(remote_path)
+    headers = {"Accept-Ranges": "bytes", "Content-Disposition": f'attachment; filename="{filename}"'}
+    if sha256:
+        headers["ETag"] = f'"{sha256}"'
+        if etag_matches(request, sha256):
+            return Response(status_code=304, headers=headers)
+
+    status_code, offset, count = 200, 0, None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or (sha256 and if_range.strip().strip('"') == sha256)):
+        byte_range = parse_range(range_header, size)
+        if byte_range == "unsatisfiable":
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code, offset, count = 206, start, end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(size if count is None else count)
+
+    stream = stream_from_cloud(remote_path, offset, count)
+    try:
+        first_chunk = await anext(stream, b"")
+    except Exception:
+        await stream.aclose()
+        raise
+
+    async def body():
+        try:
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return StreamingResponse(body(), status_code=status_code, headers=headers, media_type=media_type)
+
+@router.get("/download/{pedido_id}")
+async def download_original(pedido_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Descarga el archivo original del pedido transmitiéndolo desde Yandex Disk (proxy con Range).
+    """
+    pedido = await db.get(Pedido, pedido_id)
+    if not pedido:
+        raise HTTPException(status_code=404, detail="Pedido no encontrado")
+    if not pedido.original_path:
+        raise HTTPException(status_code=404, detail="Archivo original no disponible")
+    remote_path, size, sha256 = pedido.original_path, pedido.original_size, pedido.original_sha256
+    # No se retiene una conexión del pool mientras dura la transferencia
+    await db.commit()
+    try:
+        return await stream_download(request, remote_path, size, sha256)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al descargar archivo: {str(e)}")
+
+@router.get("/download/design/{design_id}")
+async def download_design(design_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Descarga el archivo de un diseño transmitiéndolo desde Yandex Disk (proxy con Range).
+    """
+    diseno = await db.get(Diseno, design_id)
+    if not diseno:
+        raise HTTPException(status_code=404, detail="Diseño no encontrado")
+    remote_path, size, sha256 = diseno.design_path, diseno.design_size, diseno.design_sha256
+    await db.commit()
+    try:
+        return await stream_download(request, remote_path, size, sha256)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al descargar archivo: {str(e)}")
+
 @router.get("/download/link/{pedido_id}", response_model=dict)
-def get_download_link(pedido_id: int, db: Session = Depends(get_db)):
+async def get_download_link(pedido_id: int, db: AsyncSession = Depends(get_db)):
     """
-    Genera y retorna un enlace público para descargar el archivo original asociado al pedido.
-    Se utiliza el comando 'rclone link' para generar el enlace a partir de la ruta en la nube.
+    Retorna un enlace público para descargar el archivo original asociado al pedido.
+    El enlace se genera con 'rclone link' solo la primera vez (o cuando supera
+    PUBLIC_LINK_MAX_AGE_SECONDS): queda guardado en el pedido y en una caché en memoria,
+    así que las consultas siguientes no lanzan procesos (ni consultan la BD si está en memoria).
     """
-    pedido = db.query(Pedido).filter(Pedido.id == pedido_id).first()
+    download_link = cached_link(pedido_id)
+    if download_link:
+        return {"download_link": download_link}
+
+    pedido = await db.get(Pedido, pedido_id)
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
 
@@ -314,13 +1232,63 @@ def get_download_link(pedido_id: int, db: Session = Depends(get_db)):
     if not pedido.original_path:
         raise HTTPException(status_code=404, detail="Archivo original no disponible")
 
-    # Generar el enlace usando rclone
-    command = ["rclone", "link", pedido.original_path]
-    result = subprocess.run(command, capture_output=True, text=True)
+    try:
+        download_link = await resolve_public_link(pedido)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    await db.commit()
+    return {"download_link": download_link}
+
+@router.post("/download/links", response_model=dict)
+async def get_download_links(
+    pedido_ids: List[int] = Body(..., embed=True, description="Ids de los pedidos"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Enlaces públicos de muchos pedidos a la vez. Los que no están en memoria se leen con una sola
+    consulta IN; los que faltan se generan en paralelo (como mucho PUBLIC_LINK_BATCH_CONCURRENCY
+    a la vez) y se guardan con un solo commit. Retorna un resultado por pedido, en el mismo orden.
+    """
+    if len(pedido_ids) > PUBLIC_LINK_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Demasiados pedidos en el lote (máximo {PUBLIC_LINK_BATCH_MAX_ITEMS})")
+
+    links = {pedido_id: cached_link(pedido_id) for pedido_id in pedido_ids}
+    errors = {}
+    missing = [pedido_id for pedido_id, link in links.items() if link is None]
+    pedidos = {}
+    if missing:
+        result = await db.execute(select(Pedido).where(Pedido.id.in_(missing)))
+        pedidos = {p.id: p for p in result.scalars()}
+        semaphore = asyncio.Semaphore(PUBLIC_LINK_BATCH_CONCURRENCY)
+
+        async def resolve(pedido):
+            async with semaphore:
+                try:
+                    links[pedido.id] = await resolve_public_link(pedido)
+                except Exception as e:
+                    errors[pedido.id] = str(e)
 
-    if result.returncode != 0:
-        raise HTTPException(status_code=500, detail=f"Error generando enlace de descarga: {result.stderr}")
+        await asyncio.gather(*(resolve(p) for p in pedidos.values() if p.original_path))
+        await db.commit()
 
-    # El resultado contendrá el enlace público
-    download_link = result.stdout.strip()
-    return {"download_link": download_link}
\ No newline at end of file
+    items = []
+    for pedido_id in pedido_ids:
+        if links.get(pedido_id):
+            items.append({"pedido_id": pedido_id, "estado": "ok", "download_link": links[pedido_id]})
+        elif pedido_id in errors:
+            items.append({"pedido_id": pedido_id, "estado": "error", "error": errors[pedido_id]})
+        elif pedido_id not in pedidos:
+            items.append({"pedido_id": pedido_id, "estado": "no_encontrado"})
+        else:
+            items.append({"pedido_id": pedido_id, "estado": "no_disponible"})
+    return {"items": items}
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Métricas del proceso en formato de texto de Prometheus: duración por etapa (rclone, render
+    con decode/encode, MinIO, SQL), etapas en curso, aciertos y fallos de cada nivel de caché de
+    previsualizaciones y bytes transferidos. Con varios workers, cada uno expone las suyas.
+    """
+    metrics.collect_preview_cache(await get_cache_stats())
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,118 @@
+import hashlib
+from fastapi import Request
+from fastapi.responses import Response, FileResponse
+
+# Las URLs versionadas (con el hash en la ruta) nunca cambian de contenido
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Bloque de lectura de FileResponse cuando el servidor no soporta sendfile (pathsend, p. ej. uvicorn):
+# cada bloque es un salto a un hilo, y con 64 KB (el valor de Starlette) domina el costo en archivos grandes
+FILE_CHUNK_SIZE = 1024 * 1024
+# Las URLs sin versión se pueden guardar, pero hay que revalidarlas con If-None-Match
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+def preview_etag(data: bytes) -> str:
+    """
+    Hash de contenido de una previsualización (128 bits de SHA-256 en hex), usado como ETag y versión.
+    """
+    return hashlib.sha256(data).hexdigest()[:32]
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    True si el encabezado If-None-Match de la petición coincide con 'etag' (o es '*').
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
+
+def not_modified(etag: str, immutable: bool = False) -> Response:
+    """
+    Respuesta 304 con los mismos encabezados de caché que la respuesta completa.
+    """
+    return Response(status_code=304, headers=_cache_headers(etag, immutable))
+
+def preview_response(request: Request, data, etag: str, immutable: bool = False,
+                     content_location: str = None, media_type: str = "image/webp") -> Response:
+    """
+    Sirve 'data' (bytes o memoryview: el rango se corta sin copiar) con ETag y Cache-Control,
+    respondiendo 304 si If-None-Match coincide y 206 si se pide un único rango de bytes (Range,
+    respetando If-Range). Si el rango no es satisfacible responde 416; los rangos múltiples se
+    ignoran y se envía el contenido completo.
+    """
+    headers = _cache_headers(etag, immutable)
+    headers["Accept-Ranges"] = "bytes"
+    if content_location:
+        headers["Content-Location"] = content_location
+
+    if etag_matches(request, etag):
+        return not_modified(etag, immutable)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip().strip('"') == etag):
+        byte_range = parse_range(range_header, len(data))
+        if byte_range == "unsatisfiable":
+            headers["Content-Range"] = f"bytes */{len(data)}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(content=data[start:end + 1], status_code=206, headers=headers, media_type=media_type)
+
+    return Response(content=data, headers=headers, media_type=media_type)
+
+def preview_file_response(request: Request, path: str, etag: str, immutable: bool = False,
+                          content_location: str = None, media_type: str = "image/webp") -> Response:
+    """
+    Como preview_response, pero sirve el archivo 'path' con FileResponse: el servidor lo envía
+    con sendfile cuando lo soporta (extensión pathsend) y si no por bloques, con Content-Length
+    correcto y cerrando el archivo al terminar. FileResponse resuelve Range/If-Range con el ETag dado.
+    """
+    if etag_matches(request, etag):
+        return not_modified(etag, immutable)
+    headers = _cache_headers(etag, immutable)
+    if content_location:
+        headers["Content-Location"] = content_location
+    response = FileResponse(path, headers=headers, media_type=media_type)
+    response.chunk_size = FILE_CHUNK_SIZE
+    return response
+
+def parse_range(header: str, size: int):
+    """
+    Interpreta un encabezado 'Range: bytes=...' con un solo rango.
+    Retorna (inicio, fin) inclusivos, "unsatisfiable", o None si el encabezado no se puede usar.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_text, sep, end_text = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not start_text:
+            # Sufijo: los últimos N bytes
+            length = int(end_text)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+def _cache_headers(etag: str, immutable: bool) -> dict:
+    return {
+        "ETag": f'"{etag}"',
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+    }
@@ -1,39 +1,284 @@
 import io
 import os
+import math
+import time
+import signal
+import shutil
+import struct
+import resource
 import tempfile
 import subprocess
 from PIL import Image
 from fastapi import HTTPException
 
-def generate_preview(image_path: str) -> bytes:
+def render_preview(image_path, width: int = None, timings: dict = None) -> bytes:
     """
-    Abre la imagen desde 'image_path', la convierte a WebP y la comprime.
-    Si el archivo es CDR, lo convierte primero a PNG usando Inkscape.
-    Retorna los bytes de la imagen en formato WebP.
+    Abre la imagen desde 'image_path', la convierte a WebP y la comprime. 'image_path' también
+    puede ser el contenido del archivo (bytes o bytearray leídos en streaming), que se decodifica desde memoria.
+    Si se indica 'width', la previsualización se limita a ese ancho (nunca se amplía) y el costo
+    de decodificación escala con el tamaño de salida: en JPEG se usa Image.draft para que el
+    decodificador reduzca en el dominio DCT, y en el resto Image.thumbnail reduce con Image.reduce.
+    Si el archivo es CDR, lo convierte primero a PNG usando Inkscape (directamente al ancho pedido).
+    Si se pasa 'timings', se guardan en él las duraciones de cada etapa (inkscape, decodificación,
+    reducción y codificación). Retorna los bytes de la imagen en formato WebP. Los errores se
+    propagan tal cual.
     """
-    try:
-        # Verificar si el archivo es un CDR
-        if image_path.lower().endswith('.cdr'):
-            # Crear un archivo temporal para guardar la conversión a PNG
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                tmp_filename = tmp.name
+    if isinstance(image_path, (bytes, bytearray)):
+        with Image.open(io.BytesIO(image_path)) as img:
+            return _encode_webp(img, width, timings)
+    # Verificar si el archivo es un CDR
+    if image_path.lower().endswith('.cdr'):
+        # Crear un archivo temporal para guardar la conversión a PNG
+        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
+            tmp_filename = tmp.name
+        try:
             # Convertir el CDR a PNG usando Inkscape
             command = ["inkscape", image_path, "--export-type=png", "--export-filename", tmp_filename]
+            if width:
+                command.append(f"--export-width={width}")
+            start = time.perf_counter()
             result = subprocess.run(command, capture_output=True, text=True)
+            if timings is not None:
+                timings["inkscape"] = time.perf_counter() - start
             if result.returncode != 0:
-                os.remove(tmp_filename)
                 raise Exception(f"Inkscape falló: {result.stderr}")
             # Abrir la imagen convertida
             with Image.open(tmp_filename) as img:
-                output = io.BytesIO()
-                img.save(output, format="WEBP", quality=75)
+                return _encode_webp(img, width, timings)
+        finally:
             os.remove(tmp_filename)
-            return output.getvalue()
-        else:
-            # Procesamiento normal para otros formatos
-            with Image.open(image_path) as img:
-                output = io.BytesIO()
-                img.save(output, format="WEBP", quality=75)
-                return output.getvalue()
+    else:
+        # Procesamiento normal para otros formatos
+        with Image.open(image_path) as img:
+            return _encode_webp(img, width, timings)
+
+def _encode_webp(img: Image.Image, width: int = None, timings: dict = None) -> bytes:
+    size = None
+    if width and img.width > width:
+        size = (width, max(1, round(img.height * width / img.width)))
+        if img.format == "JPEG":
+            # Decodificar a 1/2, 1/4 o 1/8 de resolución según haga falta
+            img.draft(img.mode, size)
+    start = time.perf_counter()
+    # Pillow decodifica de forma perezosa: se fuerza aquí para medir decodificación y codificación por separado
+    img.load()
+    decoded = time.perf_counter()
+    if size:
+        # thumbnail reduce primero con Image.reduce (reducing_gap) y luego remuestrea al tamaño exacto
+        img.thumbnail(size, reducing_gap=2.0)
+    resized = time.perf_counter()
+    output = io.BytesIO()
+    img.save(output, format="WEBP", quality=75)
+    if timings is not None:
+        timings["preview_decode"] = decoded - start
+        timings["preview_resize"] = resized - decoded
+        timings["preview_encode"] = time.perf_counter() - resized
+    return output.getvalue()
+
+def generate_preview(image_path, width: int = None, timings: dict = None) -> bytes:
+    """
+    Igual que render_preview, pero convierte cualquier error en HTTPException 500.
+    """
+    try:
+        return render_preview(image_path, width, timings)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al generar previsualización: {str(e)}")
+
+# --- Funciones que se ejecutan dentro de los procesos del motor de render (render_engine.py) ---
+
+def init_render_worker(memory_limit_mb: int):
+    """
+    Inicializador de cada proceso de render: limita la memoria virtual del proceso para que
+    una imagen gigante falle con MemoryError en vez de llevarse la máquina.
+    """
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def run_render_job(image_path, width: int, timeout: float) -> tuple:
+    """
+    Ejecuta render_preview con un límite de tiempo (SIGALRM) dentro del proceso de render.
+    Retorna (bytes WebP, duraciones por etapa) para registrarlas en el proceso principal.
+    """
+    timings = {}
+    data = _run_with_alarm(timeout, "el render", render_preview, image_path, width, timings)
+    return data, timings
+
+def _run_with_alarm(timeout: float, what: str, func, *args):
+    def _on_timeout(signum, frame):
+        raise TimeoutError(f"{what} superó {timeout}s")
+
+    signal.signal(signal.SIGALRM, _on_timeout)
+    signal.alarm(max(1, math.ceil(timeout)))
+    try:
+        return func(*args)
+    finally:
+        signal.alarm(0)
+
+# --- Conversión para impresión (se ejecuta en el pool de conversión de render_engine.py) ---
+
+# Formatos de salida de POST /convert y la extensión del archivo convertido
+PRINT_FORMATS = {"jpeg": ".jpg", "tiff": ".tif", "pdf": ".pdf"}
+# Memoria del propio proceso de conversión (intérprete, Pillow, libjpeg/libtiff) además de los píxeles
+CONVERT_PROCESS_OVERHEAD_BYTES = 64 * 1024 * 1024
+
+def print_mode(mode: str) -> str:
+    """
+    Modo de color del archivo para impresión: CMYK y escala de grises se conservan;
+    lo demás (RGBA, P, ...) pasa a RGB, aplanando la transparencia sobre blanco.
+    """
+    if mode == "CMYK":
+        return "CMYK"
+    return "L" if mode in ("1", "L", "LA") else "RGB"
+
+def _pixel_bytes(mode: str) -> int:
+    # Pillow guarda los modos de 1 banda en 1 byte (I;16 en 2) y los demás en 4 bytes por píxel
+    if mode in ("1", "L", "P"):
+        return 1
+    return 2 if mode.startswith("I;16") else 4
+
+def _open_header(image_path: str) -> Image.Image:
+    """
+    Como Image.open (solo lee la cabecera), pero sin el límite global Image.MAX_IMAGE_PIXELS,
+    que en el proceso de la API se deja en su valor por defecto: quien llama compara el tamaño
+    con su propio límite.
+    """
+    Image.init()
+    with open(image_path, "rb") as f:
+        prefix = f.read(16)
+    for fmt in Image.ID:
+        factory, accept = Image.OPEN[fmt]
+        accepted = accept(prefix) if accept else True
+        # Un str es una advertencia de Pillow: el plugin reconoce el formato pero no lo abre
+        if not accepted or isinstance(accepted, str):
+            continue
+        try:
+            return factory(image_path)
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue
+    raise Image.UnidentifiedImageError(f"No se puede identificar el archivo de imagen {image_path!r}")
+
+def estimate_conversion_bytes(image_path: str, formato: str, quality: int, max_pixels: int = None) -> int:
+    """
+    Memoria aproximada que necesita convert_for_print, calculada solo con la cabecera
+    (no se decodifican los píxeles): la imagen decodificada, la copia en el modo de salida
+    si hay que convertirla y, para JPEG progresivo, los coeficientes que libjpeg retiene de toda
+    la imagen y el buffer de salida que reserva Pillow.
+    Lanza Image.DecompressionBombError si la imagen tiene más de 'max_pixels' píxeles.
+    """
+    with _open_header(image_path) as img:
+        if max_pixels and img.width * img.height > max_pixels:
+            raise Image.DecompressionBombError(
+                f"La imagen tiene {img.width * img.height} píxeles, más que el límite de {max_pixels}"
+            )
+        target = print_mode(img.mode)
+        per_pixel = _pixel_bytes(img.mode)
+        if img.mode != target:
+            # P se expande a RGBA antes de aplanar, y el canal alfa se copia como máscara
+            per_pixel += (4 if img.mode == "P" else 0) + _pixel_bytes(target) + 1
+        if formato == "jpeg":
+            per_pixel += 2 * len(target) + (4 if target == "CMYK" else 2 if quality >= 95 else 1)
+        return img.width * img.height * per_pixel + CONVERT_PROCESS_OVERHEAD_BYTES
+
+def _to_print_mode(img: Image.Image) -> Image.Image:
+    target = print_mode(img.mode)
+    if img.mode == target:
+        return img
+    if img.mode == "P":
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    if "A" in img.getbands():
+        flat = Image.new(target, img.size, "white")
+        flat.paste(img.convert(target), mask=img.getchannel("A"))
+        return flat
+    return img.convert(target)
+
+def convert_for_print(image_path: str, dest_path: str, formato: str, quality: int):
+    """
+    Convierte 'image_path' al archivo de impresión 'dest_path' ('jpeg', 'tiff' o 'pdf') conservando
+    la resolución, los DPI y el perfil ICC. La salida se escribe directamente al disco (sin
+    armarla en memoria): JPEG progresivo, TIFF comprimido con Deflate (libtiff escribe franja
+    por franja) o PDF de una página que envuelve el JPEG (el JPEG se copia al PDF por bloques).
+    Los errores se propagan tal cual.
+    """
+    with Image.open(image_path) as img:
+        dpi = img.info.get("dpi") or (300, 300)
+        options = {"dpi": dpi}
+        if img.info.get("icc_profile"):
+            options["icc_profile"] = img.info["icc_profile"]
+        out = _to_print_mode(img)
+        try:
+            if formato == "jpeg":
+                out.save(dest_path, "JPEG", quality=quality, progressive=True, **options)
+            elif formato == "tiff":
+                out.save(dest_path, "TIFF", compression="tiff_adobe_deflate", **options)
+            elif formato == "pdf":
+                jpeg_path = dest_path + ".jpg"
+                try:
+                    out.save(jpeg_path, "JPEG", quality=quality, **options)
+                    _write_pdf_from_jpeg(jpeg_path, dest_path, out.size, out.mode, dpi)
+                finally:
+                    if os.path.exists(jpeg_path):
+                        os.remove(jpeg_path)
+            else:
+                raise ValueError(f"Formato de impresión no soportado: {formato}")
+        finally:
+            if out is not img:
+                out.close()
+
+def _write_pdf_from_jpeg(jpeg_path: str, pdf_path: str, size: tuple, mode: str, dpi: tuple):
+    """
+    Escribe un PDF de una página cuyo contenido es el JPEG 'jpeg_path' (filtro DCTDecode, sin
+    recomprimir), con el tamaño de página que corresponde a los DPI de la imagen.
+    """
+    width, height = size
+    page_width, page_height = width * 72 / dpi[0], height * 72 / dpi[1]
+    colorspace = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}[mode]
+    # Pillow guarda los JPEG CMYK invertidos (convención de Adobe)
+    decode = " /Decode [1 0 1 0 1 0 1 0]" if mode == "CMYK" else ""
+    content = f"q {page_width:.4f} 0 0 {page_height:.4f} 0 0 cm /Im0 Do Q".encode()
+    offsets = []
+    with open(pdf_path, "wb") as out:
+        def begin_object():
+            offsets.append(out.tell())
+            out.write(f"{len(offsets)} 0 obj\n".encode())
+
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        begin_object()
+        out.write(b"<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+        begin_object()
+        out.write(b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n")
+        begin_object()
+        out.write((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.4f} {page_height:.4f}] "
+            f"/Resources << /XObject << /Im0 4 0 R >> >> /Contents 5 0 R >>\nendobj\n"
+        ).encode())
+        begin_object()
+        out.write((
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace {colorspace} "
+            f"/BitsPerComponent 8 /Filter /DCTDecode{decode} /Length {os.path.getsize(jpeg_path)} >>\nstream\n"
+        ).encode())
+        with open(jpeg_path, "rb") as jpeg:
+            shutil.copyfileobj(jpeg, out, 1024 * 1024)
+        out.write(b"\nendstream\nendobj\n")
+        begin_object()
+        out.write(f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream\nendobj\n")
+        xref = out.tell()
+        out.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            out.write(f"{offset:010d} 00000 n \n".encode())
+        out.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+def init_convert_worker(memory_limit_mb: int, max_pixels: int):
+    """
+    Inicializador de cada proceso de conversión: límite de memoria como en los de render y el
+    límite de píxeles de Pillow subido a CONVERT_MAX_PIXELS (los archivos de impresión superan
+    con facilidad el límite por defecto).
+    """
+    init_render_worker(memory_limit_mb)
+    Image.MAX_IMAGE_PIXELS = max_pixels or None
+
+def run_convert_job(image_path: str, dest_path: str, formato: str, quality: int, timeout: float):
+    """
+    Ejecuta convert_for_print con un límite de tiempo (SIGALRM) dentro del proceso de conversión.
+    """
+    _run_with_alarm(timeout, "la conversión", convert_for_print, image_path, dest_path, formato, quality)
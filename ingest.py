@@ -0,0 +1,149 @@
+import hashlib
+import os
+import zipfile
+from fastapi import UploadFile, HTTPException
+from fastapi.responses import JSONResponse
+
+from config import UPLOAD_CHUNK_SIZE, MAX_UPLOAD_SIZE, BULK_MAX_REQUEST_SIZE, BULK_ZIP_MAX_TOTAL_SIZE, BULK_ZIP_MAX_RATIO
+from metrics import track_stage, BYTES_TRANSFERRED
+
+# Margen para los encabezados multipart y los campos de formulario que acompañan al archivo
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+def max_request_size(path: str):
+    """
+    Content-Length máximo aceptado para una petición a 'path', o None si no hay límite.
+    """
+    if path == "/pedidos/bulk":
+        return BULK_MAX_REQUEST_SIZE or None
+    return MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD_BYTES if MAX_UPLOAD_SIZE else None
+
+class UploadSizeLimitMiddleware:
+    """
+    Rechaza con 413 las peticiones cuyo Content-Length supera max_request_size, antes de leer el
+    cuerpo: Starlette vuelca el multipart completo a su archivo temporal antes de que el endpoint
+    vea el UploadFile, así que el límite de save_upload_file llega tarde para ahorrar ese I/O.
+    Sin Content-Length (chunked) la petición sigue y el límite lo aplica save_upload_file.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            limit = max_request_size(scope["path"])
+            content_length = dict(scope["headers"]).get(b"content-length")
+            if limit is not None and content_length is not None and content_length.isdigit() and int(content_length) > limit:
+                response = JSONResponse(
+                    status_code=413,
+                    content={"detail": f"La petición supera el tamaño máximo permitido ({limit} bytes)"},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+async def save_upload_file(file: UploadFile, dest_path: str) -> tuple:
+    """
+    Guarda el archivo subido en 'dest_path' leyendo bloques de UPLOAD_CHUNK_SIZE bytes,
+    de modo que la memoria usada por subida sea constante sin importar el tamaño del archivo.
+    Calcula el SHA-256 y el tamaño mientras escribe.
+    Retorna una tupla (sha256_hex, size_bytes).
+    Lanza HTTPException 413 si el archivo supera MAX_UPLOAD_SIZE (el archivo parcial se elimina).
+    Para entonces Starlette ya recibió el cuerpo completo: esta comprobación solo evita guardar y
+    subir el archivo; el rechazo temprano por Content-Length lo hace UploadSizeLimitMiddleware.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with track_stage("save_upload"), open(dest_path, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if MAX_UPLOAD_SIZE and size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"El archivo supera el tamaño máximo permitido ({MAX_UPLOAD_SIZE} bytes)"
+                    )
+                sha256.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    BYTES_TRANSFERRED.inc("upload_received", amount=size)
+    return sha256.hexdigest(), size
+
+def _max_extracted_size(archive_size: int):
+    """
+    Máximo de bytes descomprimidos que se aceptan de un zip de 'archive_size' bytes, o None si no
+    hay límite. La relación se mide sobre el zip completo (y como si pesara al menos 1 MB): archivos
+    pequeños y muy compresibles (p. ej. un SVG) no alcanzan para rechazarlo, un miembro "bomba" sí.
+    """
+    limits = []
+    if BULK_ZIP_MAX_TOTAL_SIZE:
+        limits.append(BULK_ZIP_MAX_TOTAL_SIZE)
+    if BULK_ZIP_MAX_RATIO:
+        limits.append(int(max(archive_size, 1024 * 1024) * BULK_ZIP_MAX_RATIO))
+    return min(limits) if limits else None
+
+def _too_large_detail(max_total: int) -> str:
+    return f"El zip descomprimido supera el máximo permitido ({max_total} bytes); posible zip bomb"
+
+def extract_zip(archive_path: str, dest_dir: str, max_items: int) -> list:
+    """
+    Extrae los archivos de un zip a 'dest_dir' de a bloques de UPLOAD_CHUNK_SIZE bytes (sin cargar
+    ningún miembro completo en memoria), calculando SHA-256 y tamaño de cada uno.
+    Los directorios y archivos ocultos (p. ej. __MACOSX) se omiten; los nombres internos no se usan
+    como rutas locales. Un miembro que supere MAX_UPLOAD_SIZE se reporta con error y no se extrae.
+    Retorna una lista de dicts con 'filename' y, según el caso, 'path', 'sha256' y 'size' o 'error'.
+    Lanza HTTPException 400 si el archivo no es un zip válido, tiene más de 'max_items' archivos o
+    descomprimido ocupa más de BULK_ZIP_MAX_TOTAL_SIZE o de BULK_ZIP_MAX_RATIO veces el zip (zip bomb).
+    """
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="El archivo no es un zip válido")
+    with archive:
+        members = [
+            m for m in archive.infolist()
+            if not m.is_dir() and not any(part.startswith((".", "__MACOSX")) for part in m.filename.split("/"))
+        ]
+        if len(members) > max_items:
+            raise HTTPException(status_code=400, detail=f"El zip tiene más de {max_items} archivos")
+        # Límite del total descomprimido; se comprueba primero con los tamaños declarados y después
+        # con los bytes realmente extraídos, porque la cabecera del zip puede mentir
+        max_total = _max_extracted_size(os.path.getsize(archive_path))
+        if max_total is not None and sum(m.file_size for m in members) > max_total:
+            raise HTTPException(status_code=400, detail=_too_large_detail(max_total))
+        total = 0
+        items = []
+        for index, member in enumerate(members):
+            filename = os.path.basename(member.filename)
+            dest_path = os.path.join(dest_dir, f"item_{index}{os.path.splitext(filename)[1]}")
+            sha256 = hashlib.sha256()
+            size = 0
+            try:
+                with archive.open(member) as src, open(dest_path, "wb") as f:
+                    while True:
+                        chunk = src.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        # Se cuenta lo descomprimido: el tamaño declarado en el zip no es confiable
+                        if max_total is not None and total + size > max_total:
+                            raise HTTPException(status_code=400, detail=_too_large_detail(max_total))
+                        if MAX_UPLOAD_SIZE and size > MAX_UPLOAD_SIZE:
+                            raise ValueError(f"supera el tamaño máximo permitido ({MAX_UPLOAD_SIZE} bytes)")
+                        sha256.update(chunk)
+                        f.write(chunk)
+            except Exception as e:
+                if os.path.exists(dest_path):
+                    os.remove(dest_path)
+                if isinstance(e, HTTPException):
+                    raise
+                items.append({"filename": filename, "error": str(e)})
+                continue
+            total += size
+            items.append({"filename": filename, "path": dest_path, "sha256": sha256.hexdigest(), "size": size})
+        return items
@@ -0,0 +1,145 @@
+import asyncio
+import os
+
+from config import INKSCAPE_POOL_SIZE, INKSCAPE_TIMEOUT_SECONDS, INKSCAPE_STARTUP_TIMEOUT_SECONDS, INKSCAPE_HEALTHCHECK_IDLE_SECONDS
+
+# Prompt que imprime 'inkscape --shell' cuando está listo para la siguiente línea de acciones
+PROMPT = b"> "
+
+class InkscapeShell:
+    """
+    Un proceso 'inkscape --shell' de larga duración al que se le envían acciones por stdin.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.last_used = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            "inkscape", "--shell",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await self._read_until_prompt(INKSCAPE_STARTUP_TIMEOUT_SECONDS)
+        self.last_used = asyncio.get_running_loop().time()
+
+    async def run(self, actions: str, timeout: float) -> bytes:
+        """
+        Envía una línea de acciones y espera al siguiente prompt. Retorna la salida del shell.
+        """
+        self.process.stdin.write(actions.encode() + b"\n")
+        await self.process.stdin.drain()
+        output = await self._read_until_prompt(timeout)
+        self.last_used = asyncio.get_running_loop().time()
+        return output
+
+    async def healthy(self) -> bool:
+        """
+        True si el proceso sigue vivo; si lleva mucho tiempo inactivo, además debe responder a una línea vacía.
+        """
+        if not self.running:
+            return False
+        if asyncio.get_running_loop().time() - self.last_used < INKSCAPE_HEALTHCHECK_IDLE_SECONDS:
+            return True
+        try:
+            await self.run("", 5)
+            return True
+        except Exception:
+            return False
+
+    async def stop(self):
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+            await self.process.wait()
+        self.process = None
+
+    async def _read_until_prompt(self, timeout: float) -> bytes:
+        output = b""
+
+        async def read():
+            nonlocal output
+            while not output.endswith(PROMPT):
+                chunk = await self.process.stdout.read(4096)
+                if not chunk:
+                    raise Exception("Inkscape terminó inesperadamente")
+                output += chunk
+
+        try:
+            await asyncio.wait_for(read(), timeout)
+        except asyncio.TimeoutError:
+            raise Exception(f"Inkscape no respondió en {timeout}s")
+        return output
+
+class InkscapePool:
+    """
+    Pool de procesos 'inkscape --shell' reutilizables. Cada proceso se arranca la primera vez que
+    se usa, se verifica antes de cada trabajo y se reinicia si murió o dejó de responder.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle = asyncio.Queue()
+        for _ in range(size):
+            self._idle.put_nowait(InkscapeShell())
+
+    async def export_png(self, source_path: str, png_path: str, width: int = None):
+        """
+        Rasteriza 'source_path' (p. ej. un CDR) a 'png_path', directamente al ancho 'width' si se
+        indica, de modo que nunca se rasteriza la obra a tamaño completo para una miniatura.
+        """
+        if ";" in source_path or ";" in png_path:
+            raise ValueError("Las rutas para Inkscape no pueden contener ';'")
+        # export-width:0 deja el ancho sin fijar: las opciones de exportación persisten entre trabajos del shell
+        actions = (
+            f"file-open:{source_path};export-type:png;export-filename:{png_path};"
+            f"export-width:{width or 0};export-do;file-close"
+        )
+        shell = await self._idle.get()
+        try:
+            if not await shell.healthy():
+                await shell.stop()
+                await shell.start()
+            await shell.run(actions, INKSCAPE_TIMEOUT_SECONDS)
+        except BaseException:
+            # Estado desconocido (timeout, cancelación, caída): se reinicia en el próximo uso
+            await shell.stop()
+            raise
+        finally:
+            self._idle.put_nowait(shell)
+        if not os.path.exists(png_path) or os.path.getsize(png_path) == 0:
+            raise Exception(f"Inkscape no pudo exportar {os.path.basename(source_path)}")
+
+    async def shutdown(self):
+        while not self._idle.empty():
+            await self._idle.get_nowait().stop()
+
+_pool = None
+
+def get_pool() -> InkscapePool:
+    """
+    Retorna el pool de Inkscape del proceso, o None si está deshabilitado (INKSCAPE_POOL_SIZE=0).
+    """
+    global _pool
+    if _pool is None and INKSCAPE_POOL_SIZE > 0:
+        _pool = InkscapePool(INKSCAPE_POOL_SIZE)
+    return _pool
+
+async def shutdown():
+    """
+    Detiene los procesos de Inkscape (apagado de la aplicación).
+    """
+    global _pool
+    if _pool is not None:
+        await _pool.shutdown()
+        _pool = None
@@ -0,0 +1,230 @@
+import os
+import random
+import socket
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (
+    JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS, JOB_RETRY_MAX_SECONDS, JOB_LEASE_SECONDS,
+    JOB_HEARTBEAT_SECONDS, JOB_POLL_INTERVAL_SECONDS,
+)
+from database import Job, SessionLocal
+
+# Estados de un trabajo
+PENDING = "pendiente"
+RUNNING = "en_proceso"
+DONE = "completado"
+FAILED = "fallido"
+
+class PermanentJobError(Exception):
+    """
+    Error de un handler que no se arregla reintentando (p. ej. el archivo no se puede procesar):
+    el trabajo se marca fallido sin gastar los intentos que le quedan.
+    """
+
+def _now() -> datetime:
+    # Todas las fechas de la cola se guardan en UTC sin zona, calculadas en Python
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+async def enqueue_job(db: AsyncSession, kind: str, key: str, payload: dict, max_attempts: int = None) -> Job:
+    """
+    Encola un trabajo de forma idempotente y hace commit.
+    Si ya hay uno pendiente o en proceso con la misma 'key' no se crea otro; si el anterior
+    terminó (completado o fallido) se reactiva con el nuevo payload.
+    """
+    job = (await db.execute(select(Job).where(Job.key == key))).scalars().first()
+    if job is None:
+        job = Job(kind=kind, key=key, payload=payload, estado=PENDING, attempts=0,
+                  max_attempts=max_attempts or JOB_MAX_ATTEMPTS, run_at=_now())
+        try:
+            async with db.begin_nested():
+                db.add(job)
+        except IntegrityError:
+            # Otra petición lo encoló al mismo tiempo
+            job = (await db.execute(select(Job).where(Job.key == key))).scalars().first()
+    elif job.estado in (DONE, FAILED):
+        job.kind = kind
+        job.payload = payload
+        job.estado = PENDING
+        job.attempts = 0
+        job.max_attempts = max_attempts or JOB_MAX_ATTEMPTS
+        job.run_at = _now()
+        job.last_error = None
+        job.result = None
+        job.updated_at = _now()
+    await db.commit()
+    return job
+
+async def claim_jobs(db: AsyncSession, worker_id: str, limit: int) -> list:
+    """
+    Toma hasta 'limit' trabajos listos para ejecutarse y los marca en_proceso para 'worker_id'.
+    En PostgreSQL los candidatos se leen con FOR UPDATE SKIP LOCKED, así varios workers no se
+    bloquean entre sí; en SQLite (que no lo soporta) la actualización condicional por fila
+    garantiza que cada trabajo lo tome un solo worker. También recupera los trabajos cuyo
+    worker dejó de renovar el lease (p. ej. porque murió o se reinició): eso cuenta como un
+    intento, y si ya no quedan intentos el trabajo se marca fallido en vez de tomarse, para que
+    un trabajo que tumba a su worker (OOM, crash) no se reintente para siempre.
+    Retorna una lista de (id, kind, payload).
+    """
+    now = _now()
+    ready = or_(
+        (Job.estado == PENDING) & (Job.run_at <= now),
+        (Job.estado == RUNNING) & (Job.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS)),
+    )
+    candidates = (await db.execute(
+        select(Job.id, Job.estado, Job.locked_at, Job.attempts, Job.max_attempts)
+        .where(ready)
+        .order_by(Job.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )).all()
+    claimed = []
+    for job_id, estado, locked_at, attempts, max_attempts in candidates:
+        values = dict(estado=RUNNING, locked_by=worker_id, locked_at=now, updated_at=now)
+        if estado == RUNNING:
+            values.update(attempts=attempts + 1, last_error="Lease vencido: el worker dejó de renovarlo")
+            if attempts + 1 >= max_attempts:
+                values.update(estado=FAILED, locked_by=None, locked_at=None)
+        result = await db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.estado == estado, Job.attempts == attempts,
+                   Job.locked_at.is_(None) if locked_at is None else Job.locked_at == locked_at)
+            .values(**values)
+        )
+        if result.rowcount == 1:
+            if values["estado"] == RUNNING:
+                claimed.append(job_id)
+            else:
+                print(f"Trabajo {job_id} fallido: su worker dejó vencer el lease y no quedan intentos")
+    await db.commit()
+    if not claimed:
+        return []
+    rows = (await db.execute(select(Job.id, Job.kind, Job.payload).where(Job.id.in_(claimed)))).all()
+    return [(job_id, kind, payload) for job_id, kind, payload in rows]
+
+def _owned_by(job_id: int, worker_id: str):
+    # El trabajo sigue en proceso y tomado por este worker (nadie lo recuperó por lease vencido)
+    return (Job.id == job_id) & (Job.estado == RUNNING) & (Job.locked_by == worker_id)
+
+async def renew_lease(db: AsyncSession, job_id: int, worker_id: str) -> bool:
+    """
+    Renueva el lease de un trabajo en curso. Retorna False si el worker ya no lo tiene.
+    """
+    now = _now()
+    result = await db.execute(update(Job).where(_owned_by(job_id, worker_id)).values(locked_at=now, updated_at=now))
+    await db.commit()
+    return result.rowcount == 1
+
+async def complete_job(db: AsyncSession, job_id: int, worker_id: str, result=None) -> bool:
+    """
+    Marca el trabajo completado si 'worker_id' todavía lo tiene. Retorna False si no.
+    """
+    now = _now()
+    updated = await db.execute(update(Job).where(_owned_by(job_id, worker_id)).values(
+        estado=DONE, locked_by=None, locked_at=None, last_error=None, result=result, updated_at=now,
+    ))
+    await db.commit()
+    return updated.rowcount == 1
+
+async def fail_job(db: AsyncSession, job_id: int, worker_id: str, error: str, permanent: bool = False) -> bool:
+    """
+    Registra un intento fallido. Reprograma el trabajo con espera exponencial (con jitter)
+    o lo marca fallido si agotó sus intentos o si el error es 'permanent'. Retorna True si se
+    reintentará.
+    No hace nada si 'worker_id' ya no tiene el trabajo (otro worker lo recuperó).
+    """
+    job = (await db.execute(select(Job).where(_owned_by(job_id, worker_id)).with_for_update())).scalars().first()
+    if job is None:
+        return False
+    now = _now()
+    job.attempts += 1
+    job.last_error = error
+    job.locked_by = None
+    job.locked_at = None
+    job.updated_at = now
+    retry = not permanent and job.attempts < job.max_attempts
+    if retry:
+        delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1), JOB_RETRY_MAX_SECONDS)
+        job.estado = PENDING
+        job.run_at = now + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+    else:
+        job.estado = FAILED
+    await db.commit()
+    return retry
+
+async def _heartbeat(job_id: int, worker_id: str):
+    """
+    Renueva el lease cada JOB_HEARTBEAT_SECONDS mientras corre el trabajo. Termina si el worker
+    perdió el trabajo (el lease venció y otro worker lo recuperó).
+    """
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            async with SessionLocal() as db:
+                if not await renew_lease(db, job_id, worker_id):
+                    return
+        except Exception as e:
+            # Un fallo puntual de la base no debe cortar el trabajo; se reintenta en el próximo latido
+            print(f"Error renovando el lease del trabajo {job_id}: {e}")
+
+async def _run_job(handlers: dict, job_id: int, kind: str, payload: dict, worker_id: str):
+    handler = handlers.get(kind)
+    try:
+        if handler is None:
+            raise Exception(f"No hay handler para trabajos de tipo '{kind}'")
+        work = asyncio.ensure_future(handler(payload))
+        heartbeat = asyncio.ensure_future(_heartbeat(job_id, worker_id))
+        try:
+            await asyncio.wait({work, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            heartbeat.cancel()
+            if not work.done():
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+        if work.cancelled():
+            print(f"Trabajo {job_id} ({kind}) cancelado: otro worker lo recuperó")
+            return
+        result = work.result()
+    except Exception as e:
+        async with SessionLocal() as db:
+            retry = await fail_job(db, job_id, worker_id, f"{type(e).__name__}: {e}",
+                                   permanent=isinstance(e, PermanentJobError))
+        print(f"Trabajo {job_id} ({kind}) falló{' (se reintentará)' if retry else ''}: {e}")
+        return
+    async with SessionLocal() as db:
+        if not await complete_job(db, job_id, worker_id, result):
+            print(f"Trabajo {job_id} ({kind}) terminó, pero otro worker ya lo había recuperado")
+
+async def run_worker(handlers: dict, concurrency: int, stop_event: asyncio.Event, worker_id: str = None):
+    """
+    Bucle de un worker: toma trabajos mientras tenga cupo (hasta 'concurrency' a la vez) y los
+    ejecuta con el handler de su tipo, renovando el lease de cada uno mientras corre. Si no hay
+    trabajos espera JOB_POLL_INTERVAL_SECONDS.
+    Termina cuando se activa 'stop_event', esperando a los trabajos en curso.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    running = set()
+    while not stop_event.is_set():
+        free = concurrency - len(running)
+        claimed = []
+        if free > 0:
+            try:
+                async with SessionLocal() as db:
+                    claimed = await claim_jobs(db, worker_id, free)
+            except Exception as e:
+                print(f"Error tomando trabajos de la cola: {e}")
+        for job_id, kind, payload in claimed:
+            task = asyncio.create_task(_run_job(handlers, job_id, kind, payload, worker_id))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if claimed and len(running) < concurrency:
+            continue  # puede haber más trabajos listos
+        # Esperar a que se libere un cupo, llegue la señal de parada o pase el intervalo de sondeo
+        stop_waiter = asyncio.ensure_future(stop_event.wait())
+        await asyncio.wait(running | {stop_waiter}, timeout=JOB_POLL_INTERVAL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+        stop_waiter.cancel()
+    if running:
+        await asyncio.gather(*running, return_exceptions=True)
@@ -1,9 +1,40 @@
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from endpoints import router as api_router
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+from storage import start_storage, stop_storage
+from config import JOB_WORKER_IN_API, JOB_WORKER_CONCURRENCY
+from jobs import run_worker
+from worker import HANDLERS
+import render_engine
+import inkscape_pool
+from ingest import UploadSizeLimitMiddleware
 
-app = FastAPI(title="API de Gestión de Pedidos y Diseños")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Arranque: inicializar el backend de almacenamiento (rclone rcd si RCLONE_MODE=rcd)
+    await start_storage()
+    # La cola de trabajos también se procesa aquí salvo que se use solo worker.py (JOB_WORKER_IN_API=false)
+    stop_event = asyncio.Event()
+    worker_task = None
+    if JOB_WORKER_IN_API:
+        worker_task = asyncio.create_task(run_worker(HANDLERS, JOB_WORKER_CONCURRENCY, stop_event))
+    yield
+    # Apagado
+    stop_event.set()
+    if worker_task is not None:
+        await worker_task
+    await stop_storage()
+    render_engine.shutdown()
+    await inkscape_pool.shutdown()
+
+app = FastAPI(title="API de Gestión de Pedidos y Diseños", lifespan=lifespan)
+
+# Rechazar las subidas demasiado grandes por su Content-Length, antes de recibir el cuerpo
+# (se agrega antes que CORS para que la respuesta 413 también lleve sus encabezados)
+app.add_middleware(UploadSizeLimitMiddleware)
 
 # Habilitar CORS para permitir solicitudes de cualquier origen
 app.add_middleware(
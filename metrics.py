@@ -0,0 +1,237 @@
+import re
+import time
+import bisect
+import threading
+from sqlalchemy import event
+
+# Límites (segundos) de los histogramas de duración: de 1 ms a 2 minutos
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Un solo lock para todas las métricas: registrar es una suma bajo lock (sin contención en el event loop)
+_lock = threading.Lock()
+_registry = []
+_INF_LABEL = 'le="+Inf"'
+
+class _Metric:
+    """
+    Métrica con etiquetas; cada combinación de valores de etiqueta es una serie.
+    Las métricas son del proceso: con varios workers de uvicorn cada uno expone las suyas.
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        _registry.append(self)
+
+    def _label_text(self, labels: tuple, extra: str = None) -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _samples(self):
+        with _lock:
+            return [(labels, self._sample_value(value)) for labels, value in self._series.items()]
+
+    def _sample_value(self, value):
+        return value
+
+    def values(self) -> dict:
+        """
+        Copia de las series: {valores de etiqueta: valor} (en histogramas, (cuentas, suma)).
+        """
+        return dict(self._samples())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._samples()):
+            lines.append(f"{self.name}{self._label_text(labels)} {_number(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with _lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        with _lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        with _lock:
+            self._series[labels] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        # Cuentas por intervalo (no acumuladas): observar es un bisect y dos sumas
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def _sample_value(self, value):
+        return list(value[0]), value[1]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (counts, total) in sorted(self._samples()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._label_text(labels, le)} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{self._label_text(labels, _INF_LABEL)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._label_text(labels)} {cumulative}")
+        return lines
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def render() -> str:
+    """
+    Retorna todas las métricas registradas en el formato de texto de Prometheus (versión 0.0.4).
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Métricas de la aplicación ---
+
+STAGE_SECONDS = Histogram(
+    "app_stage_duration_seconds",
+    "Duración de cada etapa de los flujos de subida y previsualización.",
+    ("stage",),
+)
+STAGE_IN_FLIGHT = Gauge("app_stage_in_flight", "Ejecuciones en curso de cada etapa.", ("stage",))
+STAGE_ERRORS = Counter("app_stage_errors_total", "Ejecuciones de cada etapa que terminaron con error.", ("stage",))
+DB_QUERY_SECONDS = Histogram(
+    "app_db_query_duration_seconds",
+    "Duración de las sentencias SQL, por tipo de sentencia.",
+    ("operation",),
+)
+PREVIEW_CACHE_REQUESTS = Counter(
+    "app_preview_cache_requests_total",
+    "Consultas a cada nivel de caché de previsualizaciones (minio, memory, disk, cloud) y su resultado.",
+    ("tier", "result"),
+)
+PREVIEWS_GENERATED = Counter(
+    "app_previews_generated_total",
+    "Previsualizaciones generadas, por origen del archivo (local, stream, download).",
+    ("source",),
+)
+BYTES_TRANSFERRED = Counter(
+    "app_bytes_transferred_total",
+    "Bytes movidos hacia o desde el almacenamiento, por dirección.",
+    ("direction",),
+)
+PREVIEW_CACHE_EVICTIONS = Counter(
+    "app_preview_cache_evictions_total",
+    "Entradas desalojadas de la caché local de previsualizaciones, por nivel.",
+    ("tier",),
+)
+PREVIEW_CACHE_BYTES = Gauge("app_preview_cache_bytes", "Bytes ocupados por la caché local de previsualizaciones.", ("tier",))
+PREVIEW_CACHE_ENTRIES = Gauge("app_preview_cache_entries", "Entradas en la caché local de previsualizaciones.", ("tier",))
+
+class _StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        STAGE_IN_FLIGHT.inc(self.stage)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage)
+        STAGE_IN_FLIGHT.dec(self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(self.stage)
+        return False
+
+def track_stage(stage: str) -> _StageTimer:
+    """
+    Context manager que mide la duración de 'stage', la cuenta como en curso mientras dura y
+    registra si termina con una excepción. Se usa con 'with' también dentro de funciones async.
+    """
+    return _StageTimer(stage)
+
+def observe_stages(timings: dict):
+    """
+    Registra duraciones medidas en otro proceso (p. ej. decode/encode en el pool de render).
+    """
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage)
+
+def collect_preview_cache(stats: dict):
+    """
+    Copia a las métricas los contadores de la caché local (preview_cache.get_cache_stats). La
+    caché ya los lleva, así que sus aciertos no pagan nada extra por petición; se llama al servir
+    /metrics. Un fallo en memoria es una consulta que llegó al disco.
+    """
+    with _lock:
+        PREVIEW_CACHE_REQUESTS._series[("memory", "hit")] = stats["memory_hits"]
+        PREVIEW_CACHE_REQUESTS._series[("memory", "miss")] = stats["disk_hits"] + stats["misses"]
+        PREVIEW_CACHE_REQUESTS._series[("disk", "hit")] = stats["disk_hits"]
+        PREVIEW_CACHE_REQUESTS._series[("disk", "miss")] = stats["misses"]
+        PREVIEW_CACHE_EVICTIONS._series[("memory",)] = stats["memory_evictions"]
+        PREVIEW_CACHE_EVICTIONS._series[("disk",)] = stats["evictions"]
+    PREVIEW_CACHE_BYTES.set(stats["memory_bytes"], "memory")
+    PREVIEW_CACHE_BYTES.set(stats["disk_bytes"], "disk")
+    PREVIEW_CACHE_ENTRIES.set(stats["memory_entries"], "memory")
+    PREVIEW_CACHE_ENTRIES.set(stats["disk_entries"], "disk")
+
+# Primera palabra de la sentencia SQL (SELECT, INSERT, ...), ignorando espacios y paréntesis iniciales
+_SQL_OPERATION = re.compile(r"^[\s(]*(\w+)")
+
+def instrument_engine(engine):
+    """
+    Mide cada sentencia SQL del engine (async o sync) con los eventos de cursor de SQLAlchemy.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["metrics_query_start"].pop()
+        match = _SQL_OPERATION.match(statement)
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, match.group(1).upper() if match else "OTHER")
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("metrics_query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+        STAGE_ERRORS.inc("db")
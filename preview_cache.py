@@ -1,29 +1,380 @@
 import os
 import time
-from config import CACHE_ORIGINAL_DIR, CACHE_DESIGN_DIR, CACHE_EXPIRATION_SECONDS
+import asyncio
+import sqlite3
+import tempfile
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from config import (
+    CACHE_ORIGINAL_DIR, CACHE_DESIGN_DIR, CACHE_EXPIRATION_SECONDS,
+    CACHE_MAX_BYTES, CACHE_EVICTION_POLICY, CACHE_INDEX_PATH,
+    CACHE_MEMORY_MAX_BYTES, CACHE_MEMORY_MAX_ITEM_BYTES,
+)
+from http_cache import preview_etag
 
-def get_cached_preview(pedido_id: int, tipo: str) -> str:
+# Los accesos (aciertos y fecha del último) se escriben en el índice por lotes, como mucho cada
+# este intervalo y siempre antes de desalojar
+ACCESS_UPDATE_INTERVAL_SECONDS = 60
+# Al superar el presupuesto se libera hasta dejar la caché en este porcentaje del máximo
+EVICTION_TARGET_RATIO = 0.9
+
+# Resultado de PreviewCache.lookup: 'data' (memoryview) si está en memoria, o 'path' si se sirve desde disco
+CachedPreview = namedtuple("CachedPreview", ["data", "path", "etag", "size"])
+
+def preview_filename(pedido_id: int, tipo: str, width: int = None) -> str:
     """
-    Retorna la ruta del archivo en caché si existe y no ha expirado.
-    'tipo' debe ser 'original' o 'design'.
+    Nombre de archivo de la previsualización; se usa igual en la caché local, Yandex Disk y MinIO.
+    Sin 'width' es la previsualización a resolución completa.
+    """
+    if width:
+        return f"cache_{tipo}_{pedido_id}_w{width}.webp"
+    return f"cache_{tipo}_{pedido_id}.webp"
+
+class PreviewCache:
     """
+    Caché de previsualizaciones en dos niveles:
+    - memoria: LRU por proceso, limitado a CACHE_MEMORY_MAX_BYTES, para las más pedidas;
+    - disco: un archivo por previsualización, limitado a CACHE_MAX_BYTES y desalojado por LRU o LFU.
+    El índice del disco es un SQLite compartido entre workers, de modo que sobrevive a reinicios.
+    Las escrituras son atómicas (archivo temporal + rename), nunca se sirve un archivo a medio escribir.
+    Los métodos que tocan el disco o el índice bloquean (p. ej. esperando el lock de escritura de
+    otro worker): desde el event loop se llaman en un hilo (ver las funciones del módulo). El nivel
+    de memoria tiene su propio lock y nunca espera al índice.
+    """
+
+    def __init__(self, index_path: str, max_bytes: int, memory_max_bytes: int, memory_max_item_bytes: int,
+                 expiration_seconds: int, policy: str = "lru"):
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_max_item_bytes = memory_max_item_bytes
+        self.expiration_seconds = expiration_seconds
+        self.policy = policy
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "memory_evictions": 0}
+        self._memory = OrderedDict()  # clave -> (memoryview, creado, etag)
+        self._memory_bytes = 0
+        # Accesos aún no escritos en el índice: clave -> [aciertos, último acceso]
+        self._pending_access = {}
+        self._last_access_flush = time.time()
+        self._memory_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+
+    def _index(self) -> sqlite3.Connection:
+        # Se abre en el primer uso (en un hilo, no en el event loop); se llama con _db_lock tomado
+        if self._db is None:
+            db = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            # 'totals' lleva la ocupación al día con triggers: aplicar el presupuesto no recorre el índice
+            db.executescript("""
+                BEGIN IMMEDIATE;
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,
+                    created REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, etag TEXT);
+                CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+                CREATE TABLE IF NOT EXISTS totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL, entries INTEGER NOT NULL);
+                INSERT OR IGNORE INTO totals (id, bytes, entries) SELECT 0, COALESCE(SUM(size), 0), COUNT(*) FROM entries;
+                CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+                    UPDATE totals SET bytes = bytes + NEW.size, entries = entries + 1 WHERE id = 0; END;
+                CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                    UPDATE totals SET bytes = bytes - OLD.size, entries = entries - 1 WHERE id = 0; END;
+                CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+                    UPDATE totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 0; END;
+                COMMIT;
+            """)
+            # Índices creados antes de guardar el ETag de cada entrada
+            if "etag" not in {row[1] for row in db.execute("PRAGMA table_info(entries)")}:
+                db.execute("ALTER TABLE entries ADD COLUMN etag TEXT")
+            self._db = db
+        return self._db
+
+    def get_path(self, key: str, path: str):
+        """
+        Retorna 'path' si la entrada está en memoria, o en disco y vigente, o None. Bloquea.
+        """
+        if self.memory_lookup(key) is not None:
+            return path
+        return path if self._disk_entry(key, path) is not None else None
+
+    def _disk_entry(self, key: str, path: str):
+        """
+        Retorna (tamaño, etag) de la entrada en disco si está vigente, o None; etag puede ser None
+        en entradas adoptadas o de índices anteriores.
+        """
+        now = time.time()
+        with self._db_lock:
+            db = self._index()
+            row = db.execute("SELECT size, created, etag FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                # Archivo de una versión anterior o índice perdido: se adopta si sigue vigente
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    self.stats["misses"] += 1
+                    return None
+                row = (stat.st_size, stat.st_mtime, None)
+                db.execute(
+                    "INSERT OR IGNORE INTO entries (key, path, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, path, stat.st_size, stat.st_mtime, now),
+                )
+                self._enforce_budget()
+            size, created, etag = row
+            if now - created >= self.expiration_seconds or not os.path.exists(path):
+                self._remove(key, path)
+                self.stats["misses"] += 1
+                return None
+            with self._memory_lock:
+                self._record_access(key, now)
+            self._flush_access()
+            self.stats["disk_hits"] += 1
+            return size, etag
+
+    def memory_lookup(self, key: str):
+        """
+        Retorna un CachedPreview si la entrada está en el nivel de memoria, o None. No toca el
+        índice ni el disco: se puede llamar desde el event loop.
+        """
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if now - entry[1] < self.expiration_seconds:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                self._record_access(key, now)
+                view, _, etag = entry
+                return CachedPreview(view, None, etag, view.nbytes)
+            self._forget_memory(key)
+            return None
+
+    def _record_access(self, key: str, now: float):
+        # Cada acierto (también los de memoria) cuenta para LRU/LFU; se escriben al índice por lotes.
+        # Se llama con _memory_lock tomado
+        access = self._pending_access.setdefault(key, [0, now])
+        access[0] += 1
+        access[1] = now
+
+    def _flush_access(self, force: bool = False):
+        """
+        Escribe en el índice los accesos acumulados, como mucho cada ACCESS_UPDATE_INTERVAL_SECONDS
+        (o siempre con 'force', antes de desalojar). Se llama con _db_lock tomado.
+        """
+        now = time.time()
+        if not force and now - self._last_access_flush < ACCESS_UPDATE_INTERVAL_SECONDS:
+            return
+        with self._memory_lock:
+            pending, self._pending_access = self._pending_access, {}
+        self._last_access_flush = now
+        if pending:
+            self._index().executemany(
+                "UPDATE entries SET hits = hits + ?, last_access = MAX(last_access, ?) WHERE key = ?",
+                [(hits, last_access, key) for key, (hits, last_access) in pending.items()],
+            )
+
+    def get_bytes(self, key: str, path: str):
+        """
+        Retorna los bytes de la entrada desde memoria o disco (promoviéndola a memoria), o None.
+        Bloquea.
+        """
+        entry = self.memory_lookup(key)
+        if entry is not None:
+            return entry.data.obj
+        if self._disk_entry(key, path) is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Otro worker la desalojó entre la consulta y la lectura
+            return None
+        self._remember(key, data, os.path.getmtime(path), preview_etag(data))
+        return data
+
+    def lookup(self, key: str, path: str):
+        """
+        Retorna un CachedPreview para servir la entrada sin copiarla, o None. Bloquea.
+        - nivel de memoria: 'data' es un memoryview de los bytes guardados (cortarlo no copia);
+        - disco: las entradas que caben en memoria se leen y se promueven; las grandes se sirven
+          desde 'path' (sendfile) sin leerlas, con el ETag guardado en el índice.
+        """
+        entry = self.memory_lookup(key)
+        if entry is not None:
+            return entry
+        disk_entry = self._disk_entry(key, path)
+        if disk_entry is None:
+            return None
+        size, etag = disk_entry
+        try:
+            if size <= self.memory_max_item_bytes:
+                with open(path, "rb") as f:
+                    data = f.read()
+                etag = etag or self._store_etag(key, preview_etag(data))
+                view = self._remember(key, data, os.path.getmtime(path), etag)
+                return CachedPreview(view, None, etag, len(data))
+            if etag is None:
+                digest = hashlib.sha256()
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(block)
+                # Igual que preview_etag, pero leyendo por bloques
+                etag = self._store_etag(key, digest.hexdigest()[:32])
+            return CachedPreview(None, path, etag, size)
+        except FileNotFoundError:
+            # Otro worker la desalojó entre la consulta y la lectura
+            return None
+
+    def _store_etag(self, key: str, etag: str) -> str:
+        with self._db_lock:
+            self._index().execute("UPDATE entries SET etag = ? WHERE key = ?", (etag, key))
+        return etag
+
+    def set(self, key: str, path: str, data: bytes) -> str:
+        """
+        Escribe la entrada de forma atómica, la registra en el índice y aplica el presupuesto de
+        disco. Bloquea.
+        """
+        directory = os.path.dirname(path)
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp_", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        now = time.time()
+        etag = preview_etag(data)
+        with self._db_lock:
+            self._index().execute(
+                "INSERT INTO entries (key, path, size, created, last_access, hits, etag) VALUES (?, ?, ?, ?, ?, 0, ?)"
+                " ON CONFLICT (key) DO UPDATE SET path = excluded.path, size = excluded.size, created = excluded.created,"
+                " last_access = excluded.last_access, hits = 0, etag = excluded.etag",
+                (key, path, len(data), now, now, etag),
+            )
+            self._enforce_budget()
+        self._remember(key, data, now, etag)
+        return path
+
+    def get_stats(self) -> dict:
+        with self._db_lock:
+            disk_bytes, disk_entries = self._index().execute("SELECT bytes, entries FROM totals").fetchone()
+        with self._memory_lock:
+            return dict(self.stats, disk_bytes=disk_bytes, disk_entries=disk_entries,
+                        memory_bytes=self._memory_bytes, memory_entries=len(self._memory))
+
+    def _enforce_budget(self):
+        db = self._index()
+        (total,) = db.execute("SELECT bytes FROM totals").fetchone()
+        if total <= self.max_bytes:
+            return
+        # LFU y LRU deben ver los accesos que aún no se escribieron
+        self._flush_access(force=True)
+        order = "hits ASC, last_access ASC" if self.policy == "lfu" else "last_access ASC"
+        target = self.max_bytes * EVICTION_TARGET_RATIO
+        for key, path, size in db.execute(f"SELECT key, path, size FROM entries ORDER BY {order}").fetchall():
+            if total <= target:
+                break
+            self._remove(key, path)
+            self.stats["evictions"] += 1
+            total -= size
+
+    def _remove(self, key: str, path: str):
+        # Se llama con _db_lock tomado
+        self._index().execute("DELETE FROM entries WHERE key = ?", (key,))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        with self._memory_lock:
+            self._forget_memory(key)
+            self._pending_access.pop(key, None)
+
+    def _remember(self, key: str, data: bytes, created: float, etag: str):
+        # El memoryview se crea una sola vez y se reutiliza en cada respuesta
+        view = memoryview(data)
+        if len(data) > self.memory_max_item_bytes:
+            return view
+        with self._memory_lock:
+            self._forget_memory(key)
+            self._memory[key] = (view, created, etag)
+            self._memory_bytes += view.nbytes
+            while self._memory_bytes > self.memory_max_bytes and self._memory:
+                _, (evicted, _, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.nbytes
+                self.stats["memory_evictions"] += 1
+        return view
+
+    def _forget_memory(self, key: str):
+        # Se llama con _memory_lock tomado
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[0].nbytes
+
+_cache = None
+
+def get_cache() -> PreviewCache:
+    global _cache
+    if _cache is None:
+        _cache = PreviewCache(
+            CACHE_INDEX_PATH, CACHE_MAX_BYTES, CACHE_MEMORY_MAX_BYTES, CACHE_MEMORY_MAX_ITEM_BYTES,
+            CACHE_EXPIRATION_SECONDS, CACHE_EVICTION_POLICY,
+        )
+    return _cache
+
+def _cache_entry(pedido_id: int, tipo: str, width: int = None) -> tuple:
     cache_dir = CACHE_ORIGINAL_DIR if tipo == "original" else CACHE_DESIGN_DIR
-    cache_file = os.path.join(cache_dir, f"cache_{tipo}_{pedido_id}.webp")
-    if os.path.exists(cache_file):
-        # Verificar si el archivo ha expirado
-        mod_time = os.path.getmtime(cache_file)
-        if time.time() - mod_time < CACHE_EXPIRATION_SECONDS:
-            return cache_file
-        else:
-            os.remove(cache_file)
-    return None
-
-def set_cached_preview(pedido_id: int, tipo: str, data: bytes):
+    filename = preview_filename(pedido_id, tipo, width)
+    return f"{tipo}/{filename}", os.path.join(cache_dir, filename)
+
+async def get_cached_preview(pedido_id: int, tipo: str, width: int = None) -> str:
+    """
+    Retorna la ruta del archivo en caché si existe y no ha expirado.
+    'tipo' debe ser 'original' o 'design'; cada ancho ('width') se guarda por separado.
+    """
+    key, path = _cache_entry(pedido_id, tipo, width)
+    cache = get_cache()
+    if cache.memory_lookup(key) is not None:
+        return path
+    return await asyncio.to_thread(cache.get_path, key, path)
+
+async def get_cached_preview_bytes(pedido_id: int, tipo: str, width: int = None) -> bytes:
+    """
+    Retorna los bytes de la previsualización desde el nivel de memoria o el de disco, o None.
+    """
+    key, path = _cache_entry(pedido_id, tipo, width)
+    cache = get_cache()
+    entry = cache.memory_lookup(key)
+    if entry is not None:
+        return entry.data.obj
+    return await asyncio.to_thread(cache.get_bytes, key, path)
+
+async def get_cached_preview_entry(pedido_id: int, tipo: str, width: int = None):
+    """
+    Retorna un CachedPreview (memoryview en memoria o ruta en disco, con su ETag) para servir
+    la previsualización sin copiarla, o None si no está en caché. Un acierto en memoria no
+    sale del event loop; el índice y el disco se consultan en un hilo.
+    """
+    key, path = _cache_entry(pedido_id, tipo, width)
+    cache = get_cache()
+    entry = cache.memory_lookup(key)
+    if entry is not None:
+        return entry
+    return await asyncio.to_thread(cache.lookup, key, path)
+
+async def set_cached_preview(pedido_id: int, tipo: str, data: bytes, width: int = None):
     """
     Guarda la previsualización en la carpeta de caché correspondiente.
     """
-    cache_dir = CACHE_ORIGINAL_DIR if tipo == "original" else CACHE_DESIGN_DIR
-    cache_file = os.path.join(cache_dir, f"cache_{tipo}_{pedido_id}.webp")
-    with open(cache_file, "wb") as f:
-        f.write(data)
-    return cache_file
+    key, path = _cache_entry(pedido_id, tipo, width)
+    return await asyncio.to_thread(get_cache().set, key, path, data)
+
+async def get_cache_stats() -> dict:
+    """
+    Contadores de aciertos, fallos y desalojos de la caché, más su ocupación actual.
+    """
+    return await asyncio.to_thread(get_cache().get_stats)
@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from config import PUBLIC_LINK_MAX_AGE_SECONDS, PUBLIC_LINK_CACHE_TTL_SECONDS, PUBLIC_LINK_CACHE_SIZE
+from storage import get_public_link
+from singleflight import SingleFlight
+
+# Caché en memoria delante de la BD: id del pedido -> (enlace, expira)
+_links = OrderedDict()
+_link_flights = SingleFlight()
+
+def _now() -> datetime:
+    # Fechas en UTC sin zona, como en la cola de trabajos
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def cached_link(pedido_id: int):
+    """
+    Enlace del pedido si está en la caché en memoria (sin consultar la BD), o None.
+    """
+    entry = _links.get(pedido_id)
+    if entry is None:
+        return None
+    link, expires = entry
+    if expires < time.monotonic():
+        del _links[pedido_id]
+        return None
+    _links.move_to_end(pedido_id)
+    return link
+
+def _remember_link(pedido_id: int, link: str, fecha: datetime):
+    """
+    Guarda el enlace en la caché por PUBLIC_LINK_CACHE_TTL_SECONDS, pero no más allá del momento
+    en que cumple PUBLIC_LINK_MAX_AGE_SECONDS desde 'fecha' (cuando se generó).
+    """
+    expires = time.monotonic() + PUBLIC_LINK_CACHE_TTL_SECONDS
+    if PUBLIC_LINK_MAX_AGE_SECONDS:
+        remaining = (fecha + timedelta(seconds=PUBLIC_LINK_MAX_AGE_SECONDS) - _now()).total_seconds()
+        expires = min(expires, time.monotonic() + remaining)
+    _links[pedido_id] = (link, expires)
+    _links.move_to_end(pedido_id)
+    while len(_links) > PUBLIC_LINK_CACHE_SIZE:
+        _links.popitem(last=False)
+
+def stored_link(pedido):
+    """
+    Enlace guardado en el pedido, o None si no hay o superó PUBLIC_LINK_MAX_AGE_SECONDS.
+    """
+    if not pedido.public_link or pedido.public_link_fecha is None:
+        return None
+    if PUBLIC_LINK_MAX_AGE_SECONDS and pedido.public_link_fecha < _now() - timedelta(seconds=PUBLIC_LINK_MAX_AGE_SECONDS):
+        return None
+    return pedido.public_link
+
+async def resolve_public_link(pedido) -> str:
+    """
+    Enlace público del archivo original del pedido: el guardado en el pedido si sigue vigente o,
+    si no, uno nuevo generado con rclone (una sola vez por archivo aunque lo pidan varias
+    peticiones a la vez), que se guarda en el pedido (el llamador hace commit).
+    En ambos casos queda en la caché en memoria.
+    """
+    link = stored_link(pedido)
+    if link is None:
+        remote_path = pedido.original_path
+        link, _ = await _link_flights.do(remote_path, lambda: get_public_link(remote_path))
+        pedido.public_link = link
+        pedido.public_link_fecha = _now()
+    _remember_link(pedido.id, link, pedido.public_link_fecha)
+    return link
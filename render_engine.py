@@ -0,0 +1,221 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from PIL import Image, UnidentifiedImageError
+
+from config import (
+    RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_TIMEOUT_SECONDS, RENDER_MEMORY_LIMIT_MB, RENDER_MAX_TASKS_PER_CHILD,
+    CONVERT_WORKERS, CONVERT_MEMORY_BUDGET_MB, CONVERT_MEMORY_LIMIT_MB, CONVERT_MAX_PIXELS, CONVERT_JPEG_QUALITY,
+    CONVERT_QUEUE_TIMEOUT_SECONDS, CONVERT_TIMEOUT_SECONDS,
+)
+from image_processing import (
+    PRINT_FORMATS, init_render_worker, run_render_job, init_convert_worker, run_convert_job, estimate_conversion_bytes,
+)
+import inkscape_pool
+from jobs import PermanentJobError
+from metrics import track_stage, observe_stages
+
+# Margen extra que el proceso principal espera por encima del timeout del propio worker
+TIMEOUT_GRACE_SECONDS = 5
+
+_executor = None
+# Trabajos en ejecución + en cola; si se agota se responde 503 en vez de encolar sin límite
+_slots = asyncio.Semaphore(RENDER_WORKERS + RENDER_QUEUE_SIZE)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            # 'spawn' es obligatorio para reciclar workers (max_tasks_per_child)
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_render_worker,
+            initargs=(RENDER_MEMORY_LIMIT_MB,),
+            max_tasks_per_child=RENDER_MAX_TASKS_PER_CHILD or None,
+        )
+    return _executor
+
+def _discard_pool(executor: ProcessPoolExecutor):
+    """
+    Cierra un pool de procesos y mata sus workers sin esperarlos. El llamador deja de usarlo y
+    la siguiente petición crea otro. Sirve para los workers muertos (BrokenProcessPool) y para
+    los que siguen ocupados tras un timeout: SIGALRM no interrumpe un decode/encode dentro del
+    código C de Pillow, y un worker que sigue trabajando no debe liberar su cupo.
+    """
+    # shutdown() olvida los procesos: se toman antes
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.kill()
+
+async def render(image_path, width: int = None) -> bytes:
+    """
+    Genera la previsualización WebP de 'image_path' (limitada a 'width' si se indica)
+    en el pool de procesos de render.
+    Se envía la ruta del archivo al worker, o su contenido si 'image_path' son bytes leídos en
+    streaming (formatos que Pillow abre directamente). Los CDR se rasterizan antes, al ancho
+    pedido, en el pool de procesos 'inkscape --shell' (inkscape_pool.py) si está habilitado.
+    Lanza HTTPException 503 si la cola está llena, 504 si se supera RENDER_TIMEOUT_SECONDS
+    y 500 ante cualquier otro error. Tras un timeout se descarta el pool (y con él el render que
+    no terminó, y los que corrían a la vez): el cupo solo se libera cuando su trabajo ya no corre.
+    """
+    global _executor
+    if _slots.locked():
+        raise HTTPException(status_code=503, detail="Demasiadas previsualizaciones en proceso, intente más tarde")
+
+    async with _slots:
+        loop = asyncio.get_running_loop()
+        executor = _get_executor()
+        png_path = None
+        future = None
+        try:
+            inkscape = inkscape_pool.get_pool()
+            if inkscape is not None and isinstance(image_path, str) and image_path.lower().endswith(".cdr"):
+                png_path = os.path.splitext(image_path)[0] + ".png"
+                with track_stage("inkscape"):
+                    await inkscape.export_png(image_path, png_path, width)
+                image_path = png_path
+            # 'render' incluye la espera por un worker libre; decode/encode se miden dentro del worker
+            with track_stage("render"):
+                future = loop.run_in_executor(executor, run_render_job, image_path, width, RENDER_TIMEOUT_SECONDS)
+                preview_bytes, timings = await asyncio.wait_for(future, RENDER_TIMEOUT_SECONDS + TIMEOUT_GRACE_SECONDS)
+            observe_stages(timings)
+            return preview_bytes
+        except (TimeoutError, asyncio.TimeoutError):
+            # El worker puede seguir en el código C de Pillow: se mata para no liberar el cupo con
+            # el trabajo todavía en curso (si el timeout fue de Inkscape, el pool no se tocó)
+            if future is not None and _executor is executor:
+                _executor = None
+                _discard_pool(executor)
+            raise HTTPException(status_code=504, detail="Tiempo de espera agotado al generar previsualización")
+        except BrokenProcessPool:
+            # Un worker murió (p. ej. OOM killer): se descarta el pool y se crea otro en la siguiente petición
+            if _executor is executor:
+                _executor = None
+                _discard_pool(executor)
+            raise HTTPException(status_code=500, detail="Error al generar previsualización: el proceso de render terminó inesperadamente")
+        except MemoryError:
+            raise HTTPException(status_code=500, detail="Error al generar previsualización: la imagen supera el límite de memoria")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error al generar previsualización: {str(e)}")
+        finally:
+            if png_path and os.path.exists(png_path):
+                os.remove(png_path)
+
+class _MemoryBudget:
+    """
+    Semáforo por bytes: cada conversión reserva la memoria que estima usar y espera mientras
+    no quepa en el presupuesto.
+    """
+    def __init__(self, total: int):
+        self.total = total
+        self.used = 0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self, amount: int):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.used + amount <= self.total)
+            self.used += amount
+
+    async def release(self, amount: int):
+        async with self._changed:
+            self.used -= amount
+            self._changed.notify_all()
+
+_convert_executor = None
+_convert_budget = _MemoryBudget(CONVERT_MEMORY_BUDGET_MB * 1024 * 1024)
+
+def _get_convert_executor() -> ProcessPoolExecutor:
+    global _convert_executor
+    if _convert_executor is None:
+        # Pool propio: una conversión larga no ocupa los procesos de las previsualizaciones
+        _convert_executor = ProcessPoolExecutor(
+            max_workers=CONVERT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_convert_worker,
+            initargs=(CONVERT_MEMORY_LIMIT_MB, CONVERT_MAX_PIXELS),
+            max_tasks_per_child=RENDER_MAX_TASKS_PER_CHILD or None,
+        )
+    return _convert_executor
+
+async def convert(image_path: str, dest_path: str, formato: str):
+    """
+    Convierte 'image_path' al archivo de impresión 'dest_path' ('jpeg', 'tiff' o 'pdf') en el
+    pool de procesos de conversión. Antes se estima su memoria con la cabecera de la imagen y se
+    espera (hasta CONVERT_QUEUE_TIMEOUT_SECONDS) a que quepa en CONVERT_MEMORY_BUDGET_MB, de modo
+    que las conversiones simultáneas nunca sumen más memoria que el presupuesto. Los CDR se
+    rasterizan antes a resolución completa con Inkscape.
+    Lanza PermanentJobError si el formato no está soportado, si la imagen no se puede abrir, si
+    supera CONVERT_MAX_PIXELS o si no cabe en el presupuesto (reintentar no cambiaría nada), y
+    Exception si se agota alguna espera o si la conversión falla (el trabajo de la cola se reintenta).
+    """
+    global _convert_executor
+    if formato not in PRINT_FORMATS:
+        raise PermanentJobError(f"Formato de impresión no soportado: {formato}")
+    png_path = None
+    try:
+        inkscape = inkscape_pool.get_pool()
+        if inkscape is not None and image_path.lower().endswith(".cdr"):
+            png_path = os.path.splitext(image_path)[0] + ".png"
+            with track_stage("inkscape"):
+                await inkscape.export_png(image_path, png_path)
+            image_path = png_path
+
+        # El límite de píxeles se compara aquí explícitamente: Image.MAX_IMAGE_PIXELS solo se sube
+        # dentro de los workers de conversión (init_convert_worker)
+        try:
+            needed = await asyncio.to_thread(
+                estimate_conversion_bytes, image_path, formato, CONVERT_JPEG_QUALITY, CONVERT_MAX_PIXELS,
+            )
+        except (Image.DecompressionBombError, UnidentifiedImageError) as e:
+            raise PermanentJobError(str(e))
+        if needed > _convert_budget.total:
+            raise PermanentJobError(
+                f"La conversión necesita ~{needed // (1024 * 1024)} MB, más que CONVERT_MEMORY_BUDGET_MB"
+            )
+        try:
+            await asyncio.wait_for(_convert_budget.acquire(needed), CONVERT_QUEUE_TIMEOUT_SECONDS)
+        except (TimeoutError, asyncio.TimeoutError):
+            raise Exception("Tiempo de espera agotado esperando memoria para la conversión")
+        loop = asyncio.get_running_loop()
+        executor = _get_convert_executor()
+        try:
+            future = loop.run_in_executor(
+                executor, run_convert_job, image_path, dest_path, formato, CONVERT_JPEG_QUALITY, CONVERT_TIMEOUT_SECONDS,
+            )
+            with track_stage("convert"):
+                await asyncio.wait_for(future, CONVERT_TIMEOUT_SECONDS + TIMEOUT_GRACE_SECONDS)
+        except (TimeoutError, asyncio.TimeoutError):
+            # Como en render: la memoria reservada no se libera mientras el worker siga convirtiendo
+            if _convert_executor is executor:
+                _convert_executor = None
+                _discard_pool(executor)
+            raise Exception("Tiempo de espera agotado en la conversión para impresión")
+        except BrokenProcessPool:
+            if _convert_executor is executor:
+                _convert_executor = None
+                _discard_pool(executor)
+            raise Exception("El proceso de conversión terminó inesperadamente")
+        except MemoryError:
+            raise Exception("La imagen supera el límite de memoria del proceso de conversión")
+        finally:
+            await _convert_budget.release(needed)
+    finally:
+        if png_path and os.path.exists(png_path):
+            os.remove(png_path)
+
+def shutdown():
+    """
+    Detiene los pools de procesos de render y de conversión (apagado de la aplicación).
+    """
+    global _executor, _convert_executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+    if _convert_executor is not None:
+        _convert_executor.shutdown(wait=True, cancel_futures=True)
+        _convert_executor = None
@@ -0,0 +1,63 @@
+import asyncio
+import fcntl
+import os
+import zlib
+from contextlib import asynccontextmanager
+
+# Intervalo de sondeo mientras otro proceso tiene el lock de archivo
+LOCK_POLL_SECONDS = 0.05
+# Número de archivos de lock por directorio: las claves se reparten entre ellos
+LOCK_STRIPES = 256
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave dentro de un proceso: la primera
+    ejecuta la función y las demás esperan y reciben el mismo resultado (o la misma excepción).
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, fn):
+        """
+        Ejecuta 'await fn()' una sola vez por 'key' mientras haya una ejecución en curso.
+        Retorna una tupla (resultado, compartido); 'compartido' es False solo para quien lanzó la ejecución.
+        Cancelar a un llamador no cancela el trabajo compartido.
+        """
+        task = self._tasks.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._tasks[key] = task
+
+        def _forget(done_task):
+            if self._tasks.get(key) is done_task:
+                del self._tasks[key]
+            # Evita el aviso de "excepción nunca recuperada" si todos los llamadores se cancelaron
+            if not done_task.cancelled():
+                done_task.exception()
+
+        task.add_done_callback(_forget)
+        return await asyncio.shield(task), False
+
+@asynccontextmanager
+async def file_lock(directory: str, key: str):
+    """
+    Lock exclusivo entre procesos (p. ej. workers de uvicorn) para 'key', usando flock sobre
+    uno de LOCK_STRIPES archivos en 'directory'. Se sondea sin bloquear el event loop.
+    """
+    stripe = zlib.crc32(key.encode()) % LOCK_STRIPES
+    lock_path = os.path.join(directory, f".lock_{stripe:03d}")
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+        yield
+    finally:
+        # Cerrar el descriptor libera el lock
+        os.close(fd)
@@ -1,46 +1,577 @@
+import io
 import os
-import subprocess
-from config import RCLONE_REMOTE, MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_BUCKET_NAME
+import json
+import time
+import shutil
+import secrets
+import tempfile
+import asyncio
+import contextlib
+import httpx
+import urllib3
+from urllib.parse import quote
+from config import (
+    RCLONE_REMOTE, RCLONE_MAX_CONCURRENCY, RCLONE_TIMEOUT_SECONDS,
+    RCLONE_MODE, RCLONE_DAEMON_ADDR, RCLONE_DAEMON_STARTUP_TIMEOUT, RCLONE_BATCH_TRANSFERS,
+    RCLONE_BATCH_MIN_BYTES_PER_SECOND,
+    RCLONE_DAEMON_USER, RCLONE_DAEMON_PASS, RCLONE_DAEMON_AUTH_FILE,
+    CLOUD_STREAM_CHUNK_SIZE, CLOUD_STREAM_MAX_CONCURRENCY, CLOUD_READ_MAX_CONCURRENCY,
+    MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_BUCKET_NAME, MINIO_MAX_CONCURRENCY,
+    MINIO_SECURE, MINIO_REGION, MINIO_POOL_SIZE, MINIO_CONNECT_TIMEOUT, MINIO_READ_TIMEOUT,
+    MINIO_PRESIGNED_URL_EXPIRY_SECONDS, MINIO_PRESIGNED_URL_WINDOW_SECONDS, MINIO_PRESIGNED_URL_CACHE_SIZE,
+)
 from minio import Minio
 from minio.error import S3Error
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from metrics import track_stage, BYTES_TRANSFERRED
 
-def upload_to_cloud(local_path: str, filename: str) -> str:
+# Un semáforo por backend: limita cuántas transferencias corren a la vez en este worker
+_rclone_semaphore = asyncio.Semaphore(RCLONE_MAX_CONCURRENCY)
+_minio_semaphore = asyncio.Semaphore(MINIO_MAX_CONCURRENCY)
+# Las lecturas en streaming pueden durar lo que tarde el cliente: tienen su propio límite
+_stream_semaphore = asyncio.Semaphore(CLOUD_STREAM_MAX_CONCURRENCY)
+# Las lecturas completas a memoria (previsualizaciones) no compiten con las descargas por ese cupo
+_read_semaphore = asyncio.Semaphore(CLOUD_READ_MAX_CONCURRENCY)
+
+async def _run_rclone(args: list, error_message: str, timeout: float = RCLONE_TIMEOUT_SECONDS) -> str:
+    """
+    Ejecuta 'rclone <args>' como subproceso asyncio sin bloquear el event loop.
+    Si se agota 'timeout' o la tarea se cancela, se mata el proceso hijo.
+    Retorna la salida estándar; lanza Exception con 'error_message' si rclone falla.
+    """
+    async with _rclone_semaphore:
+        process = await asyncio.create_subprocess_exec(
+            "rclone", *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            await _kill_process(process)
+            raise Exception(f"{error_message}: tiempo de espera agotado ({timeout}s)")
+        except BaseException:
+            # Cancelación (cliente desconectado, apagado, etc.): no dejar rclone huérfano
+            await _kill_process(process)
+            raise
+        if process.returncode != 0:
+            raise Exception(f"{error_message}: {stderr.decode(errors='replace')}")
+        return stdout.decode(errors="replace")
+
+async def _kill_process(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+# --- Modo rcd: un único 'rclone rcd' por worker, controlado por su API HTTP local ---
+#
+# 'rclone copy <archivo> <remoto>/<nombre>' trata el destino como carpeta, de modo que los
+# archivos subidos quedan en '<remoto>/<nombre>/<nombre>'. El modo rcd respeta esa misma
+# estructura para que ambos modos lean y escriban los mismos objetos.
+
+_rcd_process = None
+_rcd_client = None
+_rcd_lock = asyncio.Lock()
+
+class _DaemonUnavailable(Exception):
+    """El daemon dejó de responder y no se pudo volver a arrancar: la operación se hace en modo proceso."""
+
+def _daemon_credentials() -> tuple:
+    """
+    Retorna (usuario, contraseña) de la API del daemon. Sin RCLONE_DAEMON_PASS la contraseña se
+    genera la primera vez y se guarda en RCLONE_DAEMON_AUTH_FILE; se crea con un enlace duro
+    desde un temporal, así que si varios workers arrancan a la vez todos leen la misma.
+    """
+    if RCLONE_DAEMON_PASS:
+        return RCLONE_DAEMON_USER, RCLONE_DAEMON_PASS
+    if not os.path.exists(RCLONE_DAEMON_AUTH_FILE):
+        # mkstemp crea el archivo con permisos 0600
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(RCLONE_DAEMON_AUTH_FILE))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_urlsafe(32))
+            try:
+                os.link(temp_path, RCLONE_DAEMON_AUTH_FILE)
+            except FileExistsError:
+                pass  # lo creó otro worker
+        finally:
+            os.remove(temp_path)
+    with open(RCLONE_DAEMON_AUTH_FILE) as f:
+        return RCLONE_DAEMON_USER, f.read().strip()
+
+async def start_storage():
+    """
+    Inicializa el backend de almacenamiento: verifica una sola vez el bucket de MinIO y,
+    en modo rcd, reutiliza un 'rclone rcd' que ya escuche en RCLONE_DAEMON_ADDR
+    (p. ej. lanzado por otro worker) o arranca uno nuevo. Si el daemon no responde se sigue
+    en modo proceso.
+    """
+    global _rcd_client
+    try:
+        await asyncio.to_thread(ensure_minio_bucket)
+    except Exception as e:
+        # MinIO es opcional para servir: se sigue arrancando y las subidas fallarán con su propio error
+        print(f"No se pudo verificar el bucket de MinIO '{MINIO_BUCKET_NAME}': {e}")
+    if RCLONE_MODE != "rcd" or _rcd_client is not None:
+        return
+    client = httpx.AsyncClient(
+        base_url=f"http://{RCLONE_DAEMON_ADDR}",
+        auth=_daemon_credentials(),
+        timeout=RCLONE_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=RCLONE_MAX_CONCURRENCY + CLOUD_STREAM_MAX_CONCURRENCY + CLOUD_READ_MAX_CONCURRENCY,
+            max_keepalive_connections=RCLONE_MAX_CONCURRENCY,
+        ),
+    )
+    try:
+        await _ensure_daemon(client)
+    except Exception as e:
+        await client.aclose()
+        print(f"No se pudo usar rclone rcd, se usa un proceso rclone por operación: {e}")
+        return
+    _rcd_client = client
+
+async def _ensure_daemon(client: httpx.AsyncClient):
+    """
+    Verifica que un 'rclone rcd' responda en RCLONE_DAEMON_ADDR y, si no, arranca uno (del que
+    este worker pasa a ser dueño). Lanza Exception si no responde en RCLONE_DAEMON_STARTUP_TIMEOUT.
+    """
+    global _rcd_process
+    if await _rcd_alive(client):
+        return
+    user, password = _daemon_credentials()
+    # Las credenciales van por el entorno y no como argumentos, que cualquiera ve con 'ps'.
+    # --rc-serve expone los archivos de los remotos por HTTP (con Range) para stream_from_cloud
+    _rcd_process = await asyncio.create_subprocess_exec(
+        "rclone", "rcd", "--rc-addr", RCLONE_DAEMON_ADDR, "--rc-serve",
+        env=dict(os.environ, RCLONE_RC_USER=user, RCLONE_RC_PASS=password),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + RCLONE_DAEMON_STARTUP_TIMEOUT
+    while not await _rcd_alive(client):
+        if _rcd_process is not None and _rcd_process.returncode is not None:
+            # El puerto lo tomó otro worker; se seguirá usando ese daemon
+            _rcd_process = None
+        if loop.time() > deadline:
+            if _rcd_process is not None:
+                await _kill_process(_rcd_process)
+                _rcd_process = None
+            raise Exception(f"rclone rcd no respondió en {RCLONE_DAEMON_ADDR}")
+        await asyncio.sleep(0.1)
+
+async def _recover_daemon(client: httpx.AsyncClient):
+    """
+    Se llama cuando no se pudo conectar con el daemon (p. ej. se detuvo el worker que lo había
+    arrancado): lo vuelve a arrancar. Si no es posible, este worker pasa al modo proceso y se
+    lanza _DaemonUnavailable para que el llamador repita la operación con un proceso rclone.
+    """
+    global _rcd_client
+    async with _rcd_lock:
+        if _rcd_client is client:
+            try:
+                await _ensure_daemon(client)
+                return
+            except Exception as e:
+                print(f"rclone rcd dejó de responder, se usa un proceso rclone por operación: {e}")
+                _rcd_client = None
+                await client.aclose()
+    if _rcd_client is None:
+        raise _DaemonUnavailable()
+
+async def stop_storage():
+    """
+    Cierra el cliente HTTP del modo rcd y detiene el daemon si lo arrancó este worker (los demás
+    workers que lo usaban arrancan otro en su siguiente operación).
+    """
+    global _rcd_process, _rcd_client
+    if _rcd_client is not None:
+        await _rcd_client.aclose()
+        _rcd_client = None
+    if _rcd_process is not None:
+        if _rcd_process.returncode is None:
+            _rcd_process.terminate()
+            try:
+                await asyncio.wait_for(_rcd_process.wait(), 5)
+            except asyncio.TimeoutError:
+                await _kill_process(_rcd_process)
+        _rcd_process = None
+
+async def _rcd_alive(client: httpx.AsyncClient) -> bool:
+    try:
+        response = await client.post("/rc/noop", json={}, timeout=1)
+    except httpx.HTTPError:
+        return False
+    if response.status_code in (401, 403):
+        raise Exception(f"el rclone rcd de {RCLONE_DAEMON_ADDR} rechazó las credenciales (RCLONE_DAEMON_PASS)")
+    return response.status_code == 200
+
+async def _rcd_call(command: str, params: dict, error_message: str) -> dict:
+    """
+    Ejecuta un comando de la API de control remoto de rclone (p. ej. 'operations/copyfile').
+    Lanza _DaemonUnavailable si el daemon no responde y no se pudo volver a arrancar.
+    """
+    async with _rclone_semaphore:
+        for retry in (False, True):
+            client = _rcd_client
+            if client is None:
+                raise _DaemonUnavailable()
+            try:
+                response = await client.post(f"/{command}", json=params)
+                break
+            except httpx.ConnectError as e:
+                if retry:
+                    raise Exception(f"{error_message}: {e}")
+                await _recover_daemon(client)
+            except httpx.HTTPError as e:
+                raise Exception(f"{error_message}: {e}")
+    if response.status_code != 200:
+        try:
+            detail = response.json().get("error", response.text)
+        except ValueError:
+            detail = response.text
+        raise Exception(f"{error_message}: {detail}")
+    return response.json()
+
+def _split_remote(remote_path: str) -> tuple:
+    """
+    Separa 'remoto:ruta/archivo' en ('remoto:', 'ruta/archivo') como lo espera la API rc.
+    """
+    fs, _, remote = remote_path.partition(":")
+    return f"{fs}:", remote
+
+# --- API pública ---
+
+async def upload_to_cloud(local_path: str, filename: str) -> str:
     """
     Sube el archivo localizado en 'local_path' a Yandex Disk usando Rclone.
     Retorna la ruta remota (string) en Yandex Disk.
     """
     remote_path = os.path.join(RCLONE_REMOTE, filename)
-    command = ["rclone", "copy", local_path, remote_path]
-    result = subprocess.run(command, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise Exception(f"Rclone falló: {result.stderr}")
+    with track_stage("upload_to_cloud"):
+        try:
+            if _rcd_client is None:
+                raise _DaemonUnavailable()
+            fs, remote = _split_remote(remote_path)
+            absolute_path = os.path.abspath(local_path)
+            await _rcd_call("operations/copyfile", {
+                "srcFs": os.path.dirname(absolute_path),
+                "srcRemote": os.path.basename(absolute_path),
+                "dstFs": fs,
+                "dstRemote": f"{remote}/{os.path.basename(absolute_path)}",
+            }, "Rclone falló")
+        except _DaemonUnavailable:
+            await _run_rclone(["copy", local_path, remote_path], "Rclone falló")
+    BYTES_TRANSFERRED.inc("upload_cloud", amount=os.path.getsize(local_path))
     return remote_path
 
-def download_from_cloud(remote_path: str, local_path: str):
+async def _uploaded_sizes(names: list) -> dict:
+    """
+    Tamaño en Yandex Disk de cada ruta '<nombre>/<archivo>' de 'names' (relativa a RCLONE_REMOTE)
+    que ya existe, con un solo 'rclone lsf --files-from' (no lista el resto del remoto).
+    """
+    with tempfile.NamedTemporaryFile("w", prefix="rclone_files_", suffix=".txt", delete=False) as f:
+        f.write("\n".join(names) + "\n")
+    try:
+        output = await _run_rclone(
+            ["lsf", RCLONE_REMOTE, "--files-from", f.name, "--files-only", "-R", "--format", "sp"],
+            "Rclone falló al listar",
+        )
+    finally:
+        os.remove(f.name)
+    sizes = {}
+    for line in output.splitlines():
+        size, _, name = line.partition(";")
+        if name:
+            sizes[name] = int(size)
+    return sizes
+
+async def upload_batch_to_cloud(files: list) -> list:
+    """
+    Sube varios archivos a Yandex Disk; 'files' es una lista de (ruta local, nombre remoto).
+    En modo proceso se usa una sola invocación 'rclone copy --transfers RCLONE_BATCH_TRANSFERS'
+    sobre un árbol temporal (enlaces duros) con la misma estructura '<nombre>/<nombre>' que deja
+    upload_to_cloud, con un tiempo máximo que crece con el total de bytes. Si esa invocación
+    falla, se consulta qué archivos llegaron completos y solo los demás se suben uno por uno
+    (así se sabe cuál falló).
+    En modo rcd cada archivo es una llamada HTTP barata y se suben en paralelo.
+    Retorna, en el mismo orden, la ruta remota de cada archivo o la excepción con que falló.
+    """
+    if not files:
+        return []
+    sizes = [os.path.getsize(local_path) for local_path, _ in files]
+    names = [f"{filename}/{os.path.basename(local_path)}" for local_path, filename in files]
+    uploaded = {}
+    if _rcd_client is None and len(files) > 1:
+        stage_dir = tempfile.mkdtemp(prefix="rclone_batch_", dir=os.path.dirname(os.path.abspath(files[0][0])))
+        try:
+            for (local_path, filename), name in zip(files, names):
+                os.makedirs(os.path.join(stage_dir, filename), exist_ok=True)
+                target = os.path.join(stage_dir, name)
+                try:
+                    os.link(local_path, target)
+                except OSError:
+                    shutil.copyfile(local_path, target)
+            timeout = RCLONE_TIMEOUT_SECONDS + sum(sizes) / RCLONE_BATCH_MIN_BYTES_PER_SECOND
+            with track_stage("upload_batch_to_cloud"):
+                await _run_rclone(
+                    ["copy", stage_dir, RCLONE_REMOTE, "--transfers", str(RCLONE_BATCH_TRANSFERS)],
+                    "Rclone falló", timeout=timeout,
+                )
+            BYTES_TRANSFERRED.inc("upload_cloud", amount=sum(sizes))
+            return [os.path.join(RCLONE_REMOTE, filename) for _, filename in files]
+        except Exception as e:
+            print(f"Subida por lotes falló, se suben uno por uno los archivos que no llegaron: {e}")
+            try:
+                uploaded = await _uploaded_sizes(names)
+            except Exception as e:
+                print(f"No se pudo consultar qué archivos del lote se subieron: {e}")
+        finally:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+    results = [None] * len(files)
+    pending = []
+    for index, ((local_path, filename), name, size) in enumerate(zip(files, names, sizes)):
+        if uploaded.get(name) == size:
+            results[index] = os.path.join(RCLONE_REMOTE, filename)
+            BYTES_TRANSFERRED.inc("upload_cloud", amount=size)
+        else:
+            pending.append(index)
+    outcomes = await asyncio.gather(
+        *(upload_to_cloud(*files[index]) for index in pending),
+        return_exceptions=True,
+    )
+    for index, outcome in zip(pending, outcomes):
+        results[index] = outcome
+    return results
+
+async def download_from_cloud(remote_path: str, local_path: str):
     """
     Descarga el archivo desde Yandex Disk (ruta remota) a 'local_path' usando Rclone.
     """
-    command = ["rclone", "copy", remote_path, os.path.dirname(local_path)]
-    result = subprocess.run(command, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise Exception(f"Rclone falló al descargar: {result.stderr}")
+    with track_stage("download_from_cloud"):
+        try:
+            if _rcd_client is None:
+                raise _DaemonUnavailable()
+            fs, remote = _split_remote(remote_path)
+            absolute_path = os.path.abspath(local_path)
+            await _rcd_call("operations/copyfile", {
+                "srcFs": fs,
+                "srcRemote": f"{remote}/{os.path.basename(absolute_path)}",
+                "dstFs": os.path.dirname(absolute_path),
+                "dstRemote": os.path.basename(absolute_path),
+            }, "Rclone falló al descargar")
+        except _DaemonUnavailable:
+            await _run_rclone(["copy", remote_path, os.path.dirname(local_path)], "Rclone falló al descargar")
+    BYTES_TRANSFERRED.inc("download_cloud", amount=os.path.getsize(local_path))
+
+async def _rcd_stream(remote_path: str, offset: int, count: int):
+    """
+    stream_from_cloud en modo rcd. Si no se puede conectar con el daemon (antes de recibir nada)
+    se intenta volver a arrancarlo y se repite una vez, o se lanza _DaemonUnavailable.
+    """
+    fs, remote = _split_remote(remote_path)
+    url = f"/[{fs}]/{quote(remote)}/{quote(os.path.basename(remote))}"
+    headers = {}
+    if offset or count is not None:
+        end = "" if count is None else offset + count - 1
+        headers["Range"] = f"bytes={offset}-{end}"
+    for retry in (False, True):
+        client = _rcd_client
+        if client is None:
+            raise _DaemonUnavailable()
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.status_code not in (200, 206):
+                    await response.aread()
+                    raise Exception(f"Rclone falló al leer: HTTP {response.status_code} {response.text[:200]}")
+                async for chunk in response.aiter_bytes(CLOUD_STREAM_CHUNK_SIZE):
+                    BYTES_TRANSFERRED.inc("stream_cloud", amount=len(chunk))
+                    yield chunk
+            return
+        except httpx.ConnectError as e:
+            if retry:
+                raise Exception(f"Rclone falló al leer: {e}")
+            await _recover_daemon(client)
+        except httpx.HTTPError as e:
+            raise Exception(f"Rclone falló al leer: {e}")
+
+async def _cloud_chunks(remote_path: str, offset: int, count: int):
+    """
+    Lectura de stream_from_cloud y read_from_cloud, sin límite de concurrencia (lo pone cada una).
+    En modo proceso, si rclone pasa RCLONE_TIMEOUT_SECONDS sin entregar datos se mata el proceso
+    (en modo rcd el cliente HTTP aplica el mismo tiempo de espera por lectura).
+    """
+    try:
+        if _rcd_client is None:
+            raise _DaemonUnavailable()
+        async with contextlib.aclosing(_rcd_stream(remote_path, offset, count)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+        return
+    except _DaemonUnavailable:
+        pass  # antes de leer nada: se sigue con 'rclone cat'
 
-def delete_from_cloud(remote_path: str):
+    args = ["cat", remote_path]
+    if offset:
+        args += ["--offset", str(offset)]
+    if count is not None:
+        args += ["--count", str(count)]
+    process = await asyncio.create_subprocess_exec(
+        "rclone", *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(process.stdout.read(CLOUD_STREAM_CHUNK_SIZE), RCLONE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                raise Exception(f"Rclone falló al leer: tiempo de espera agotado ({RCLONE_TIMEOUT_SECONDS}s sin datos)")
+            if not chunk:
+                break
+            BYTES_TRANSFERRED.inc("stream_cloud", amount=len(chunk))
+            yield chunk
+        try:
+            stderr, returncode = await asyncio.wait_for(
+                asyncio.gather(process.stderr.read(), process.wait()), RCLONE_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            raise Exception(f"Rclone falló al leer: tiempo de espera agotado ({RCLONE_TIMEOUT_SECONDS}s)")
+        if returncode != 0:
+            raise Exception(f"Rclone falló al leer: {stderr.decode(errors='replace')}")
+    finally:
+        await _kill_process(process)
+
+async def stream_from_cloud(remote_path: str, offset: int = 0, count: int = None):
+    """
+    Lee el archivo de Yandex Disk en 'remote_path' como un iterador asíncrono de bloques de
+    CLOUD_STREAM_CHUNK_SIZE bytes, sin escribir nada al disco. Con 'offset'/'count' se lee solo
+    ese rango. En modo proceso se usa 'rclone cat --offset --count'; en modo rcd, el servidor
+    HTTP del daemon (--rc-serve) con un encabezado Range. Si el consumidor deja de leer, se
+    cierra la lectura (y se mata el proceso rclone). Lanza Exception si rclone falla.
+    """
+    async with _stream_semaphore:
+        async with contextlib.aclosing(_cloud_chunks(remote_path, offset, count)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+async def read_from_cloud(remote_path: str, max_bytes: int = None):
+    """
+    Lee el archivo completo a memoria (como mucho CLOUD_READ_MAX_CONCURRENCY a la vez). Retorna
+    un bytearray, o None si supera 'max_bytes' (el llamador puede entonces descargarlo a disco
+    con download_from_cloud). Los bloques se copian al buffer a medida que llegan.
+    """
+    buffer = bytearray()
+    async with _read_semaphore:
+        with track_stage("read_from_cloud"):
+            async with contextlib.aclosing(_cloud_chunks(remote_path, 0, None)) as chunks:
+                async for chunk in chunks:
+                    if max_bytes is not None and len(buffer) + len(chunk) > max_bytes:
+                        return None
+                    buffer += chunk
+    return buffer
+
+async def get_cloud_file_size(remote_path: str) -> int:
+    """
+    Tamaño en bytes del archivo de Yandex Disk en 'remote_path'.
+    """
+    try:
+        if _rcd_client is None:
+            raise _DaemonUnavailable()
+        result = await _rcd_call("operations/size", {"fs": remote_path}, "Rclone falló al consultar el tamaño")
+    except _DaemonUnavailable:
+        result = json.loads(await _run_rclone(["size", "--json", remote_path], "Rclone falló al consultar el tamaño"))
+    return result["bytes"]
+
+async def delete_from_cloud(remote_path: str):
     """
     Borra el archivo localizado en 'remote_path' de Yandex Disk usando Rclone.
     """
-    command = ["rclone", "delete", remote_path]
-    result = subprocess.run(command, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise Exception(f"Rclone falló al borrar: {result.stderr}")
+    try:
+        if _rcd_client is None:
+            raise _DaemonUnavailable()
+        fs, remote = _split_remote(remote_path)
+        await _rcd_call("operations/deletefile", {
+            "fs": fs,
+            "remote": f"{remote}/{os.path.basename(remote)}",
+        }, "Rclone falló al borrar")
+    except _DaemonUnavailable:
+        await _run_rclone(["delete", remote_path], "Rclone falló al borrar")
+
+async def get_public_link(remote_path: str) -> str:
+    """
+    Genera un enlace público para 'remote_path' usando 'rclone link'.
+    """
+    try:
+        if _rcd_client is None:
+            raise _DaemonUnavailable()
+        fs, remote = _split_remote(remote_path)
+        result = await _rcd_call("operations/publiclink", {"fs": fs, "remote": remote}, "Error generando enlace de descarga")
+        return result["url"]
+    except _DaemonUnavailable:
+        output = await _run_rclone(["link", remote_path], "Error generando enlace de descarga")
+        return output.strip()
+
+async def get_storage_stats() -> dict:
+    """
+    Retorna las estadísticas de transferencia del daemon rclone ('core/stats').
+    En modo process (o si el daemon dejó de responder) retorna un diccionario vacío.
+    """
+    try:
+        if _rcd_client is None:
+            raise _DaemonUnavailable()
+        return await _rcd_call("core/stats", {}, "Error consultando estadísticas de rclone")
+    except _DaemonUnavailable:
+        return {}
+
+# --- MinIO: un cliente compartido por proceso (un único pool de conexiones urllib3) ---
 
-def upload_to_minio(file_path: str, object_name: str):
-    """Sube un archivo a MinIO.
+_minio_client = None
+
+def get_minio_client() -> Minio:
+    """
+    Retorna el cliente MinIO del proceso, creándolo la primera vez.
+    El pool HTTP se dimensiona con MINIO_POOL_SIZE.
+    """
+    global _minio_client
+    if _minio_client is None:
+        http_client = urllib3.PoolManager(
+            maxsize=MINIO_POOL_SIZE,
+            timeout=urllib3.Timeout(connect=MINIO_CONNECT_TIMEOUT, read=MINIO_READ_TIMEOUT),
+            retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        )
+        _minio_client = Minio(
+            MINIO_ENDPOINT,
+            access_key=MINIO_ACCESS_KEY,
+            secret_key=MINIO_SECRET_KEY,
+            secure=MINIO_SECURE,
+            region=MINIO_REGION,  # con la región fija, presignar no consulta la ubicación del bucket
+            http_client=http_client,
+        )
+    return _minio_client
+
+def ensure_minio_bucket():
+    """
+    Verifica (y crea si falta) el bucket de previsualizaciones. Se llama una sola vez
+    al arrancar la aplicación, no en cada subida.
+    """
+    minio_client = get_minio_client()
+    if not minio_client.bucket_exists(MINIO_BUCKET_NAME):
+        minio_client.make_bucket(MINIO_BUCKET_NAME)
+
+async def upload_to_minio(source, object_name: str, content_type: str = "image/webp"):
+    """Sube un archivo a MinIO sin bloquear el event loop.
 
     Args:
-        file_path (str): La ruta local del archivo a subir.
+        source: Ruta local del archivo, bytes en memoria o un objeto tipo archivo abierto en modo binario.
         object_name (str): El nombre con el que se guardará el objeto en MinIO.
+        content_type (str): Content-Type del objeto (por defecto: image/webp).
 
     Returns:
         str: La ruta del objeto en MinIO (formato: minio://bucket_name/object_name).
@@ -48,26 +579,38 @@ def upload_to_minio(file_path: str, object_name: str):
     Raises:
         Exception: Si ocurre un error al subir el archivo a MinIO.
     """
+    async with _minio_semaphore:
+        with track_stage("upload_to_minio"):
+            return await asyncio.to_thread(_upload_to_minio_sync, source, object_name, content_type)
+
+def _upload_to_minio_sync(source, object_name: str, content_type: str):
     try:
-        minio_client = Minio(
-            MINIO_ENDPOINT,
-            access_key=MINIO_ACCESS_KEY,
-            secret_key=MINIO_SECRET_KEY,
-            secure=False  # Establecer en True si tu servidor MinIO usa HTTPS
-        )
-        found = minio_client.bucket_exists(MINIO_BUCKET_NAME)
-        if not found:
-            minio_client.make_bucket(MINIO_BUCKET_NAME)
+        minio_client = get_minio_client()
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                length = os.fstat(f.fileno()).st_size
+                minio_client.put_object(MINIO_BUCKET_NAME, object_name, f, length, content_type=content_type)
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            length = len(source)
+            minio_client.put_object(MINIO_BUCKET_NAME, object_name, io.BytesIO(source), length, content_type=content_type)
         else:
-            print(f"El bucket '{MINIO_BUCKET_NAME}' ya existe")
-
-        minio_client.fput_object(MINIO_BUCKET_NAME, object_name, file_path)
+            # Objeto tipo archivo: se sube desde la posición actual hasta el final
+            position = source.tell()
+            length = source.seek(0, os.SEEK_END) - position
+            source.seek(position)
+            minio_client.put_object(MINIO_BUCKET_NAME, object_name, source, length, content_type=content_type)
+        BYTES_TRANSFERRED.inc("upload_minio", amount=length)
         return f"minio://{MINIO_BUCKET_NAME}/{object_name}"
     except S3Error as e:
         raise Exception(f"Error al subir a MinIO: {e}")
 
-def generate_minio_presigned_url(object_path: str, expiry_seconds: int = 60 * 60 * 24): # Expira en 24 horas por defecto
-    """Genera una URL presignada para un objeto en MinIO.
+def generate_minio_presigned_url(object_path: str, expiry_seconds: int = MINIO_PRESIGNED_URL_EXPIRY_SECONDS):
+    """Genera (o reutiliza) una URL presignada para un objeto en MinIO.
+
+    Firmar es un cálculo HMAC local (el cliente conoce la región), así que no hay tráfico de red.
+    Las URLs se memorizan en un LRU por (objeto, expiración, ventana de tiempo): dentro de una
+    ventana de MINIO_PRESIGNED_URL_WINDOW_SECONDS se devuelve la misma URL, firmada al inicio
+    de la ventana, por lo que siempre le quedan al menos 'expiry_seconds' menos la ventana de vida.
 
     Args:
         object_path (str): La ruta del objeto en MinIO (formato: minio://bucket_name/object_name).
@@ -79,20 +622,21 @@ def generate_minio_presigned_url(object_path: str, expiry_seconds: int = 60 * 60
     Raises:
         Exception: Si ocurre un error al generar la URL presignada.
     """
+    window = min(MINIO_PRESIGNED_URL_WINDOW_SECONDS, expiry_seconds // 2) or 1
+    window_start = int(time.time()) // window * window
+    return _presign_minio_url(object_path, expiry_seconds, window_start)
+
+@lru_cache(maxsize=MINIO_PRESIGNED_URL_CACHE_SIZE)
+def _presign_minio_url(object_path: str, expiry_seconds: int, window_start: int) -> str:
     try:
-        minio_client = Minio(
-            MINIO_ENDPOINT,
-            access_key=MINIO_ACCESS_KEY,
-            secret_key=MINIO_SECRET_KEY,
-            secure=False
-        )
+        minio_client = get_minio_client()
         bucket_name, object_name = object_path[len("minio://"):].split("/", 1)
-        url = minio_client.get_presigned_url(
+        return minio_client.get_presigned_url(
             "GET",
             bucket_name,
             object_name,
-            expires=timedelta(seconds=expiry_seconds)
+            expires=timedelta(seconds=expiry_seconds),
+            request_date=datetime.fromtimestamp(window_start, timezone.utc),
         )
-        return url
     except S3Error as e:
-        raise Exception(f"Error al generar la URL presignada de MinIO: {e}")
\ No newline at end of file
+        raise Exception(f"Error al generar la URL presignada de MinIO: {e}")
@@ -0,0 +1,62 @@
+"""
+Entorno de las pruebas: el mismo que usan los benchmarks (benchmarks/fakes.py), es decir un
+directorio temporal con las carpetas de subida y caché, SQLite, un remoto rclone 'bench:' sobre
+un directorio local (el rclone instalado si lo hay, si no el shim) y un S3 falso en lugar de
+MinIO. Debe definirse antes de importar config/database/endpoints.
+
+    python -m pytest -q
+"""
+import asyncio
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fakes import isolated_environment  # noqa: E402
+
+# Se decide antes de que isolated_environment ponga el shim primero en el PATH
+REAL_RCLONE = shutil.which("rclone") is not None
+
+TEST_DIR, S3 = isolated_environment("tests_", real_rclone=REAL_RCLONE)
+# La cola la procesan las pruebas, no un worker dentro de la API
+os.environ.update({"JOB_WORKER_IN_API": "false", "EAGER_PREVIEW_ENABLED": "false", "RENDER_WORKERS": "1"})
+
+from database import Base, engine  # noqa: E402
+
+
+def run(coro):
+    """
+    Ejecuta la corrutina en un event loop nuevo y cierra las conexiones del engine al terminar
+    (las de aiosqlite quedan ligadas al loop que las abrió).
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def database():
+    """
+    Esquema vacío para cada prueba (en producción lo crea Alembic).
+    """
+    async def reset():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+
+    run(reset())
+    yield
+
+
+def pytest_sessionfinish(session, exitstatus):
+    S3.stop()
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
@@ -0,0 +1,16 @@
+"""
+Reemplazos de image_processing.run_render_job y run_convert_job para las pruebas del motor de render (se importa en
+los procesos del pool, así que no depende de conftest).
+"""
+import time
+
+
+def run_forever(image_path, width, timeout):
+    # Como un decode largo dentro del código C de Pillow: sin alarma que lo interrumpa
+    while True:
+        time.sleep(60)
+
+
+def convert_forever(image_path, dest_path, formato, quality, timeout):
+    # Igual, en lugar de image_processing.run_convert_job
+    run_forever(image_path, None, timeout)
@@ -0,0 +1,68 @@
+import io
+
+import httpx
+from PIL import Image
+from sqlalchemy import select
+
+from conftest import run
+from database import BlobPreview, Diseno, Job, SessionLocal
+import endpoints
+import main
+
+
+def image_bytes(color: str) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(output, format="JPEG")
+    return output.getvalue()
+
+
+def dominant_channel(preview: bytes) -> int:
+    pixel = Image.open(io.BytesIO(preview)).convert("RGB").getpixel((32, 24))
+    return pixel.index(max(pixel))
+
+
+async def pending_sync_jobs() -> list:
+    async with SessionLocal() as db:
+        jobs = (await db.execute(select(Job).where(Job.kind == endpoints.PREVIEW_SYNC_JOB))).scalars().all()
+        return [job.payload for job in jobs]
+
+
+def test_second_design_does_not_replace_first_design_preview(monkeypatch):
+    monkeypatch.setattr(endpoints, "EAGER_PREVIEW_ENABLED", True)
+    app = main.app
+
+    async def scenario():
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post("/pedido", files={"file": ("original.jpg", image_bytes("green"), "image/jpeg")})
+                pedido_id = response.json()["pedido_id"]
+                # Las previsualizaciones al subir corren en background, antes de que vuelva la respuesta
+                first = (await client.post(f"/design/{pedido_id}", files={"file": ("a.jpg", image_bytes("red"), "image/jpeg")})).json()
+                second = (await client.post(f"/design/{pedido_id}", files={"file": ("b.jpg", image_bytes("blue"), "image/jpeg")})).json()
+
+                # Solo el primer diseño tiene previsualización y trabajo de sincronización
+                cached = await endpoints.get_cached_preview_bytes(pedido_id, "design")
+                assert dominant_channel(cached) == 0
+                design_jobs = [job for job in await pending_sync_jobs() if job["tipo"] == "design"]
+                assert [job["owner_id"] for job in design_jobs] == [first["design_id"]]
+                async with SessionLocal() as db:
+                    assert (await db.get(Diseno, second["design_id"])).design_preview_etag is None
+
+                # Un trabajo del segundo diseño (p. ej. encolado antes de esta corrección) no registra nada
+                await endpoints.sync_preview({**design_jobs[0], "owner_id": second["design_id"]})
+                for job in design_jobs:
+                    await endpoints.sync_preview(job)
+                async with SessionLocal() as db:
+                    designs = {d.id: d for d in (await db.execute(select(Diseno))).scalars()}
+                    blob_previews = {bp.sha256: bp for bp in (await db.execute(select(BlobPreview))).scalars()}
+                first_design, second_design = designs[first["design_id"]], designs[second["design_id"]]
+                assert first_design.design_cache_path_minio
+                assert second_design.design_cache_path_minio is None
+                assert blob_previews[first_design.design_sha256].etag == first_design.design_preview_etag
+                assert second_design.design_sha256 not in blob_previews
+
+                response = await client.get(f"/preview/design/{pedido_id}")
+                assert response.status_code == 200 and "preview_url" in response.json()
+
+    run(scenario())
@@ -0,0 +1,60 @@
+import os
+import zipfile
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from conftest import run
+import ingest
+import main
+
+
+def make_zip(path, members: dict) -> str:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_extracts_regular_archive(tmp_path):
+    data = os.urandom(200_000)
+    archive = make_zip(tmp_path / "ok.zip", {"a.jpg": data, "dir/b.png": b"png", "__MACOSX/._a.jpg": b"x"})
+    os.mkdir(tmp_path / "out")
+    items = ingest.extract_zip(archive, str(tmp_path / "out"), 10)
+    assert [(item["filename"], item["size"]) for item in items] == [("a.jpg", len(data)), ("b.png", 3)]
+
+
+def test_rejects_high_compression_ratio(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "BULK_ZIP_MAX_RATIO", 10)
+    # 30 MB de ceros se comprimen a ~30 KB: más de 10 veces el mínimo de 1 MB
+    archive = make_zip(tmp_path / "bomb.zip", {"a.jpg": b"ok", "bomb.tif": bytes(30 * 1024 * 1024)})
+    os.mkdir(tmp_path / "out")
+    with pytest.raises(HTTPException) as error:
+        ingest.extract_zip(archive, str(tmp_path / "out"), 10)
+    assert error.value.status_code == 400
+    assert error.value.detail.endswith("posible zip bomb")
+
+
+def test_rejects_total_size_over_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "BULK_ZIP_MAX_TOTAL_SIZE", 250_000)
+    archive = make_zip(tmp_path / "big.zip", {"a.jpg": os.urandom(200_000), "b.jpg": os.urandom(200_000)})
+    os.mkdir(tmp_path / "out")
+    with pytest.raises(HTTPException):
+        ingest.extract_zip(archive, str(tmp_path / "out"), 10)
+
+
+def test_oversized_upload_is_rejected_by_content_length(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_UPLOAD_SIZE", 1000)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            data = os.urandom(ingest.MULTIPART_OVERHEAD_BYTES + 2000)
+            response = await client.post("/pedido", files={"file": ("big.jpg", data, "image/jpeg")})
+            assert response.status_code == 413
+            assert response.json()["detail"].startswith("La petición supera")
+            # No llegó al endpoint; las peticiones sin cuerpo no se ven afectadas
+            assert (await client.get("/pedidos")).json()["items"] == []
+
+    run(scenario())
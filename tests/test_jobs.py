@@ -0,0 +1,157 @@
+import asyncio
+from datetime import timedelta
+
+from sqlalchemy import update
+
+from conftest import run
+from database import Job, SessionLocal
+import jobs
+
+
+async def enqueue(count: int, max_attempts: int = 3) -> list:
+    async with SessionLocal() as db:
+        return [(await jobs.enqueue_job(db, "test", f"test:{i}", {"i": i}, max_attempts)).id for i in range(count)]
+
+
+async def claim(worker_id: str, limit: int = 10) -> list:
+    async with SessionLocal() as db:
+        return [job_id for job_id, _, _ in await jobs.claim_jobs(db, worker_id, limit)]
+
+
+async def get_job(job_id: int) -> Job:
+    async with SessionLocal() as db:
+        return await db.get(Job, job_id)
+
+
+async def expire_lease(job_id: int):
+    async with SessionLocal() as db:
+        expired = jobs._now() - timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1)
+        await db.execute(update(Job).where(Job.id == job_id).values(locked_at=expired))
+        await db.commit()
+
+
+def test_concurrent_workers_claim_each_job_once():
+    async def scenario():
+        job_ids = await enqueue(6)
+        flat = []
+        while len(flat) < len(job_ids):
+            # Los workers que pierden la carrera por un candidato lo toman otro en el siguiente sondeo
+            claimed = await asyncio.gather(*(claim(f"w{i}", 4) for i in range(3)))
+            assert any(claimed)
+            flat += [job_id for batch in claimed for job_id in batch]
+        assert sorted(flat) == sorted(job_ids)
+        assert await claim("w3") == []
+
+    run(scenario())
+
+
+def test_expired_lease_is_reclaimed_once_and_counts_as_an_attempt():
+    async def scenario():
+        [job_id] = await enqueue(1, max_attempts=2)
+        assert await claim("dead") == [job_id]
+        assert await claim("other") == []  # lease vigente
+
+        await expire_lease(job_id)
+        assert await claim("alive") == [job_id]
+        job = await get_job(job_id)
+        assert (job.locked_by, job.attempts) == ("alive", 1)
+
+        # El worker anterior termina tarde: no pisa al que lo recuperó
+        async with SessionLocal() as db:
+            assert not await jobs.complete_job(db, job_id, "dead", {"from": "dead"})
+            assert not await jobs.fail_job(db, job_id, "dead", "boom")
+        assert (await get_job(job_id)).estado == jobs.RUNNING
+
+        # Vuelve a morir: sin intentos restantes se marca fallido en vez de tomarse otra vez
+        await expire_lease(job_id)
+        assert await claim("third") == []
+        job = await get_job(job_id)
+        assert (job.estado, job.attempts, job.locked_by) == (jobs.FAILED, 2, None)
+
+    run(scenario())
+
+
+def test_failures_back_off_until_attempts_run_out():
+    async def scenario():
+        [job_id] = await enqueue(1, max_attempts=2)
+        assert await claim("w") == [job_id]
+        async with SessionLocal() as db:
+            assert await jobs.fail_job(db, job_id, "w", "boom")
+        job = await get_job(job_id)
+        assert (job.estado, job.attempts, job.last_error) == (jobs.PENDING, 1, "boom")
+        assert job.run_at > jobs._now()
+        assert await claim("w") == []  # todavía en espera
+
+        async with SessionLocal() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(run_at=jobs._now()))
+            await db.commit()
+        assert await claim("w") == [job_id]
+        async with SessionLocal() as db:
+            assert not await jobs.fail_job(db, job_id, "w", "boom")
+        assert (await get_job(job_id)).estado == jobs.FAILED
+
+    run(scenario())
+
+
+def test_permanent_errors_fail_without_retrying():
+    async def broken(payload):
+        raise jobs.PermanentJobError("formato no soportado")
+
+    async def scenario():
+        [job_id] = await enqueue(1, max_attempts=5)
+        assert await claim("w") == [job_id]
+        await jobs._run_job({"test": broken}, job_id, "test", {}, "w")
+        job = await get_job(job_id)
+        assert (job.estado, job.attempts) == (jobs.FAILED, 1)
+        assert job.last_error == "PermanentJobError: formato no soportado"
+
+    run(scenario())
+
+
+def test_heartbeat_keeps_long_jobs_leased(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.05)
+
+    async def slow(payload):
+        await asyncio.sleep(0.3)
+        return {"ok": True}
+
+    async def scenario():
+        [job_id] = await enqueue(1)
+        assert await claim("w") == [job_id]
+        claimed_at = (await get_job(job_id)).locked_at
+        runner = asyncio.create_task(jobs._run_job({"test": slow}, job_id, "test", {}, "w"))
+        await asyncio.sleep(0.2)
+        assert (await get_job(job_id)).locked_at > claimed_at
+        await runner
+        job = await get_job(job_id)
+        assert (job.estado, job.result) == (jobs.DONE, {"ok": True})
+
+    run(scenario())
+
+
+def test_job_is_cancelled_when_another_worker_reclaims_it(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.05)
+    cancelled = asyncio.Event()
+
+    async def stuck(payload):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def scenario():
+        [job_id] = await enqueue(1)
+        assert await claim("slow") == [job_id]
+        runner = asyncio.create_task(jobs._run_job({"test": stuck}, job_id, "test", {}, "slow"))
+        await asyncio.sleep(0.1)
+        # Como si el worker se hubiera colgado más que el lease y otro lo hubiera recuperado
+        async with SessionLocal() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(locked_by="fast"))
+            await db.commit()
+        await asyncio.wait_for(runner, 5)
+        assert cancelled.is_set()
+        job = await get_job(job_id)
+        assert (job.estado, job.locked_by) == (jobs.RUNNING, "fast")
+
+    run(scenario())
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy import insert, select, text
+
+from conftest import run
+from database import Pedido, SessionLocal
+import main
+
+
+async def list_all(client: httpx.AsyncClient, **params) -> list:
+    ids, cursor = [], None
+    for _ in range(20):
+        page = (await client.get("/pedidos", params={**params, **({"cursor": cursor} if cursor else {})})).json()
+        ids += [item["pedido_id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids
+    raise AssertionError(f"La paginación no termina: {ids}")
+
+
+def test_cursor_pagination_with_identical_timestamps():
+    same_second = datetime(2020, 1, 1, 12, 0, 0)
+
+    async def scenario():
+        async with SessionLocal() as db:
+            # Varios pedidos en el mismo instante, y otros con la fecha que asigna la aplicación
+            await db.execute(insert(Pedido), [{"original_path": f"p{i}", "fecha": same_second} for i in range(5)])
+            await db.execute(insert(Pedido), [{"original_path": f"q{i}"} for i in range(5)])
+            await db.commit()
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            ids = await list_all(client, limit=2)
+            assert ids == [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+            # Un filtro con zona horaria se compara en UTC
+            desde = (same_second - timedelta(hours=3)).replace(tzinfo=timezone(timedelta(hours=-3)))
+            hasta = desde + timedelta(seconds=1)
+            assert await list_all(client, limit=2, desde=desde.isoformat(), hasta=hasta.isoformat()) == [5, 4, 3, 2, 1]
+
+    run(scenario())
+
+
+def test_cursor_pagination_mixes_server_and_application_defaults():
+    async def scenario():
+        async with SessionLocal() as db:
+            # Filas del modelo (utcnow en Python) intercaladas con inserciones que usan el default del servidor
+            for i in range(4):
+                await db.execute(insert(Pedido), [{"original_path": f"app{i}"}])
+                await db.execute(text("INSERT INTO pedidos (original_path) VALUES (:path)"), {"path": f"raw{i}"})
+            await db.commit()
+            rows = (await db.execute(select(Pedido.id, Pedido.fecha).order_by(Pedido.fecha.desc(), Pedido.id.desc()))).all()
+            stored = (await db.execute(text("SELECT fecha FROM pedidos"))).scalars().all()
+        # Mismo formato en la base, y ambos en UTC
+        assert {len(value) for value in stored} == {26}
+        assert all(abs(fecha - datetime.now(timezone.utc).replace(tzinfo=None)) < timedelta(minutes=1) for _, fecha in rows)
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for limit in (1, 2, 3):
+                assert await list_all(client, limit=limit) == [pedido_id for pedido_id, _ in rows]
+
+    run(scenario())
@@ -0,0 +1,45 @@
+import os
+
+from preview_cache import PreviewCache
+
+
+def make_cache(directory, max_bytes, policy="lru", memory_max_bytes=1024 ** 2) -> PreviewCache:
+    return PreviewCache(os.path.join(directory, "index.sqlite"), max_bytes, memory_max_bytes, 1024 ** 2, 3600, policy)
+
+
+def set_entry(cache: PreviewCache, directory, name: str, size: int):
+    cache.set(name, os.path.join(directory, name), os.urandom(size))
+
+
+def test_totals_follow_inserts_replacements_and_removals(tmp_path):
+    cache = make_cache(tmp_path, 10_000)
+    set_entry(cache, tmp_path, "a", 1000)
+    set_entry(cache, tmp_path, "b", 2000)
+    set_entry(cache, tmp_path, "a", 1500)  # reemplazo
+    stats = cache.get_stats()
+    assert (stats["disk_bytes"], stats["disk_entries"]) == (3500, 2)
+
+    # Borrado por fuera (p. ej. otro worker): se detecta al consultar el disco
+    os.remove(tmp_path / "b")
+    cache._memory.clear()
+    assert cache.lookup("b", str(tmp_path / "b")) is None
+    assert cache.get_stats()["disk_bytes"] == 1500
+
+    # Otro proceso abre el mismo índice y ve la misma ocupación
+    assert make_cache(tmp_path, 10_000).get_stats()["disk_bytes"] == 1500
+
+
+def test_lfu_counts_every_hit_including_memory_hits(tmp_path):
+    cache = make_cache(tmp_path, 3500, policy="lfu")
+    set_entry(cache, tmp_path, "hot", 1000)
+    set_entry(cache, tmp_path, "cold", 1000)
+    set_entry(cache, tmp_path, "warm", 1000)
+    for _ in range(5):
+        assert cache.memory_lookup("hot") is not None
+    assert cache.memory_lookup("warm") is not None
+
+    # Supera el presupuesto: se desaloja la menos usada aunque los aciertos no estén aún en el índice
+    set_entry(cache, tmp_path, "new", 1000)
+    assert not os.path.exists(tmp_path / "cold")
+    assert os.path.exists(tmp_path / "hot") and os.path.exists(tmp_path / "warm")
+    assert cache.stats["evictions"] == 1
@@ -0,0 +1,21 @@
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from conftest import run
+import public_links
+
+
+def test_cached_link_expires_with_the_link_not_with_the_cache_ttl(monkeypatch):
+    monkeypatch.setattr(public_links, "PUBLIC_LINK_MAX_AGE_SECONDS", 3600)
+    monkeypatch.setattr(public_links, "PUBLIC_LINK_CACHE_TTL_SECONDS", 3600)
+    # Enlace guardado hace casi PUBLIC_LINK_MAX_AGE_SECONDS: todavía vigente, por medio segundo
+    pedido = SimpleNamespace(
+        id=1, original_path="bench:remote/1", public_link="https://disk.example/1",
+        public_link_fecha=public_links._now() - timedelta(seconds=3599.5),
+    )
+
+    assert run(public_links.resolve_public_link(pedido)) == "https://disk.example/1"
+    assert public_links.cached_link(1) == "https://disk.example/1"
+    time.sleep(0.6)
+    assert public_links.cached_link(1) is None
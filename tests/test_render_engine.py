@@ -0,0 +1,117 @@
+import asyncio
+import io
+import multiprocessing
+import struct
+import time
+import zlib
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from conftest import run
+from image_processing import estimate_conversion_bytes
+from jobs import PermanentJobError
+import render_engine
+import stuck_render
+
+
+def image_bytes() -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (64, 48), "red").save(output, format="JPEG")
+    return output.getvalue()
+
+
+def test_render_timeout_kills_the_worker_and_frees_its_slot(monkeypatch):
+    monkeypatch.setattr(render_engine, "RENDER_TIMEOUT_SECONDS", 1)
+    monkeypatch.setattr(render_engine, "TIMEOUT_GRACE_SECONDS", 1)
+    monkeypatch.setattr(render_engine, "run_render_job", stuck_render.run_forever)
+
+    async def scenario():
+        monkeypatch.setattr(render_engine, "_slots", asyncio.Semaphore(1))
+        with pytest.raises(HTTPException) as error:
+            await render_engine.render(image_bytes())
+        assert error.value.status_code == 504
+        assert not render_engine._slots.locked()
+        assert render_engine._executor is None
+        # El proceso colgado ya no existe
+        deadline = time.monotonic() + 10
+        while multiprocessing.active_children() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        assert multiprocessing.active_children() == []
+
+        # El siguiente render usa un pool nuevo y no espera al trabajo colgado
+        monkeypatch.undo()
+        monkeypatch.setattr(render_engine, "_slots", asyncio.Semaphore(1))
+        preview = await asyncio.wait_for(render_engine.render(image_bytes()), 60)
+        assert Image.open(io.BytesIO(preview)).format == "WEBP"
+
+    try:
+        run(scenario())
+    finally:
+        render_engine.shutdown()
+
+
+def png_header(width: int, height: int) -> bytes:
+    """
+    PNG con solo la cabecera de una imagen de width x height (los píxeles no se leen).
+    """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b"")
+
+
+def test_conversion_pixel_limit_does_not_touch_pillow_global(monkeypatch, tmp_path):
+    # 20000 x 10000 supera el doble del límite por defecto de Pillow, que Image.open rechazaría
+    path = tmp_path / "big.png"
+    path.write_bytes(png_header(20_000, 10_000))
+    default_limit = Image.MAX_IMAGE_PIXELS
+
+    assert estimate_conversion_bytes(str(path), "tiff", 90, 1_000_000_000) > 20_000 * 10_000
+
+    monkeypatch.setattr(render_engine, "CONVERT_MAX_PIXELS", 100_000_000)
+    with pytest.raises(PermanentJobError, match="más que el límite"):
+        run(render_engine.convert(str(path), str(tmp_path / "big.tif"), "tiff"))
+    assert Image.MAX_IMAGE_PIXELS == default_limit
+
+
+def test_conversions_that_cannot_succeed_are_permanent_errors(monkeypatch, tmp_path):
+    path = tmp_path / "big.png"
+    path.write_bytes(png_header(20_000, 10_000))
+    monkeypatch.setattr(render_engine, "_convert_budget", render_engine._MemoryBudget(64 * 1024 * 1024))
+    with pytest.raises(PermanentJobError, match="CONVERT_MEMORY_BUDGET_MB"):
+        run(render_engine.convert(str(path), str(tmp_path / "big.tif"), "tiff"))
+
+    not_an_image = tmp_path / "notes.txt"
+    not_an_image.write_text("esto no es una imagen")
+    with pytest.raises(PermanentJobError):
+        run(render_engine.convert(str(not_an_image), str(tmp_path / "notes.tif"), "tiff"))
+
+    with pytest.raises(PermanentJobError, match="no soportado"):
+        run(render_engine.convert(str(path), str(tmp_path / "big.bmp"), "bmp"))
+
+
+def test_convert_timeout_kills_the_worker_before_releasing_its_memory(monkeypatch, tmp_path):
+    path = tmp_path / "design.png"
+    Image.new("RGB", (64, 48), "red").save(path)
+    monkeypatch.setattr(render_engine, "CONVERT_TIMEOUT_SECONDS", 1)
+    monkeypatch.setattr(render_engine, "TIMEOUT_GRACE_SECONDS", 1)
+    monkeypatch.setattr(render_engine, "run_convert_job", stuck_render.convert_forever)
+
+    async def scenario():
+        monkeypatch.setattr(render_engine, "_convert_budget", render_engine._MemoryBudget(1024 ** 3))
+        with pytest.raises(Exception, match="Tiempo de espera agotado"):
+            await render_engine.convert(str(path), str(tmp_path / "design.tif"), "tiff")
+        assert render_engine._convert_budget.used == 0
+        assert render_engine._convert_executor is None
+        deadline = time.monotonic() + 10
+        while multiprocessing.active_children() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        assert multiprocessing.active_children() == []
+
+    try:
+        run(scenario())
+    finally:
+        render_engine.shutdown()
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import shutil
+import socket
+import stat
+import sys
+
+import httpx
+import pytest
+
+from conftest import REAL_RCLONE, TEST_DIR, run
+from config import RCLONE_REMOTE, UPLOAD_FOLDER
+import storage
+
+requires_rclone = pytest.mark.skipif(not REAL_RCLONE, reason="el modo rcd necesita el rclone instalado")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def rcd(monkeypatch):
+    """
+    Modo rcd contra el remoto local 'bench:', con un daemon en un puerto libre.
+    """
+    monkeypatch.setattr(storage, "RCLONE_MODE", "rcd")
+    monkeypatch.setattr(storage, "RCLONE_DAEMON_ADDR", f"127.0.0.1:{free_port()}")
+    monkeypatch.setattr(storage, "RCLONE_DAEMON_STARTUP_TIMEOUT", 5)
+
+
+def run_rcd(coro):
+    """
+    Como run, deteniendo el daemon y cerrando su cliente en el mismo event loop.
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await storage.stop_storage()
+
+    return run(main())
+
+
+def write_file(name: str, data: bytes) -> str:
+    path = os.path.join(UPLOAD_FOLDER, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_daemon_credentials_are_generated_once_and_private(monkeypatch):
+    auth_file = os.path.join(TEST_DIR, "rclone_rcd.auth")
+    monkeypatch.setattr(storage, "RCLONE_DAEMON_AUTH_FILE", auth_file)
+    monkeypatch.setattr(storage, "RCLONE_DAEMON_PASS", None)
+
+    user, password = storage._daemon_credentials()
+    assert len(password) >= 32
+    assert stat.S_IMODE(os.stat(auth_file).st_mode) == 0o600
+    # Otro worker lee la misma contraseña
+    assert storage._daemon_credentials() == (user, password)
+    assert not [name for name in os.listdir(TEST_DIR) if name.startswith(".tmp_")]
+
+
+def test_preview_reads_have_their_own_concurrency_limit(monkeypatch):
+    data = os.urandom(300_000)
+    local_path = write_file("read_limit.bin", data)
+
+    async def scenario():
+        remote_path = await storage.upload_to_cloud(local_path, "read_limit.bin")
+        # Todas las descargas en streaming del worker ocupadas
+        monkeypatch.setattr(storage, "_stream_semaphore", asyncio.Semaphore(0))
+        assert await asyncio.wait_for(storage.read_from_cloud(remote_path), 10) == data
+        assert await storage.read_from_cloud(remote_path, len(data) - 1) is None
+
+    run(scenario())
+
+
+def test_process_mode_read_times_out_when_rclone_hangs(monkeypatch, tmp_path):
+    hung = tmp_path / "rclone"
+    hung.write_text("#!/bin/sh\nexec sleep 30\n")
+    hung.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(storage, "RCLONE_TIMEOUT_SECONDS", 0.5)
+
+    async def scenario():
+        with pytest.raises(Exception, match="tiempo de espera agotado"):
+            await asyncio.wait_for(storage.read_from_cloud(os.path.join(RCLONE_REMOTE, "hung.bin")), 10)
+
+    run(scenario())
+
+
+@requires_rclone
+def test_rcd_requires_credentials(rcd):
+    async def scenario():
+        await storage.start_storage()
+        assert storage._rcd_client is not None and storage._rcd_process is not None
+        async with httpx.AsyncClient(base_url=f"http://{storage.RCLONE_DAEMON_ADDR}") as anonymous:
+            # config/dump expone el token de Yandex
+            response = await anonymous.post("/config/dump", json={})
+            assert response.status_code == 401
+        assert (await storage._rcd_call("rc/noop", {"ok": 1}, "noop"))["ok"] == 1
+
+    run_rcd(scenario())
+
+
+@requires_rclone
+def test_rcd_round_trip(rcd):
+    data = os.urandom(300_000)
+    local_path = write_file("rcd_round_trip.bin", data)
+
+    async def scenario():
+        await storage.start_storage()
+        remote_path = await storage.upload_to_cloud(local_path, "rcd_round_trip.bin")
+        assert remote_path == os.path.join(RCLONE_REMOTE, "rcd_round_trip.bin")
+        assert await storage.get_cloud_file_size(remote_path) == len(data)
+        assert b"".join([chunk async for chunk in storage.stream_from_cloud(remote_path)]) == data
+        assert b"".join([chunk async for chunk in storage.stream_from_cloud(remote_path, 1000, 500)]) == data[1000:1500]
+        os.remove(local_path)
+        await storage.download_from_cloud(remote_path, local_path)
+        with open(local_path, "rb") as f:
+            assert f.read() == data
+
+    run_rcd(scenario())
+
+
+@requires_rclone
+def test_rcd_restarts_daemon_stopped_by_its_owner(rcd):
+    data = b"x" * 1000
+    local_path = write_file("rcd_restart.bin", data)
+
+    async def scenario():
+        await storage.start_storage()
+        remote_path = await storage.upload_to_cloud(local_path, "rcd_restart.bin")
+        # El worker que arrancó el daemon se apaga: para este worker es un daemon ajeno que desaparece
+        owner = storage._rcd_process
+        storage._rcd_process = None
+        owner.terminate()
+        await owner.wait()
+
+        assert await storage.get_cloud_file_size(remote_path) == len(data)
+        assert storage._rcd_client is not None and storage._rcd_process is not None
+        owner = storage._rcd_process
+        storage._rcd_process = None
+        owner.terminate()
+        await owner.wait()
+        assert b"".join([chunk async for chunk in storage.stream_from_cloud(remote_path)]) == data
+
+    run_rcd(scenario())
+
+
+@requires_rclone
+def test_rcd_falls_back_to_process_mode(rcd, monkeypatch):
+    data = b"y" * 1000
+    local_path = write_file("rcd_fallback.bin", data)
+
+    async def scenario():
+        await storage.start_storage()
+        remote_path = await storage.upload_to_cloud(local_path, "rcd_fallback.bin")
+        owner = storage._rcd_process
+        storage._rcd_process = None
+        owner.terminate()
+        await owner.wait()
+        # El daemon no puede volver a arrancar (la dirección no es válida para 'rclone rcd')
+        monkeypatch.setattr(storage, "RCLONE_DAEMON_ADDR", "256.0.0.1:1")
+        monkeypatch.setattr(storage, "RCLONE_DAEMON_STARTUP_TIMEOUT", 1)
+        assert await storage.get_cloud_file_size(remote_path) == len(data)
+        assert storage._rcd_client is None
+        assert b"".join([chunk async for chunk in storage.stream_from_cloud(remote_path)]) == data
+
+    run_rcd(scenario())
+
+
+def test_failed_batch_only_reuploads_missing_files(monkeypatch, tmp_path):
+    files = [(write_file(f"batch_{i}.bin", os.urandom(10_000 + i)), f"batch_{i}.bin") for i in range(3)]
+    calls = tmp_path / "calls.txt"
+    # rclone que corta la subida por lotes tras el primer archivo y delega todo lo demás
+    flaky = tmp_path / "rclone"
+    flaky.write_text(f"""#!{sys.executable}
+import os, subprocess, sys
+args = sys.argv[1:]
+with open({str(calls)!r}, "a") as f:
+    f.write(" ".join(args[:2]) + "\\n")
+if args[0] == "copy" and os.path.isdir(args[1]):
+    first = sorted(os.listdir(args[1]))[0]
+    subprocess.run([{shutil.which("rclone")!r}, "copy", os.path.join(args[1], first), {RCLONE_REMOTE!r} + "/" + first], check=True)
+    sys.exit("ERROR : se cortó la conexión")
+os.execv({shutil.which("rclone")!r}, ["rclone"] + args)
+""")
+    flaky.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    results = run(storage.upload_batch_to_cloud(files))
+
+    assert results == [os.path.join(RCLONE_REMOTE, filename) for _, filename in files]
+    commands = calls.read_text().splitlines()
+    assert [line.split()[0] for line in commands] == ["copy", "lsf", "copy", "copy"]
+    assert sorted(line.split()[1] for line in commands[2:]) == [files[1][0], files[2][0]]
+
+    async def sizes():
+        return [await storage.get_cloud_file_size(path) for path in results]
+
+    assert run(sizes()) == [os.path.getsize(local_path) for local_path, _ in files]
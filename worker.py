@@ -0,0 +1,40 @@
+import asyncio
+import argparse
+import signal
+
+from config import JOB_WORKER_CONCURRENCY
+from storage import start_storage, stop_storage
+from jobs import run_worker
+from endpoints import PREVIEW_SYNC_JOB, PRINT_CONVERT_JOB, sync_preview, convert_print
+import render_engine
+import inkscape_pool
+
+# Handler de cada tipo de trabajo de la cola
+HANDLERS = {
+    PREVIEW_SYNC_JOB: sync_preview,
+    PRINT_CONVERT_JOB: convert_print,
+}
+
+async def main(concurrency: int):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await start_storage()
+    print(f"Worker de la cola iniciado (concurrencia {concurrency})")
+    try:
+        await run_worker(HANDLERS, concurrency, stop_event)
+    finally:
+        await stop_storage()
+        render_engine.shutdown()
+        await inkscape_pool.shutdown()
+
+if __name__ == "__main__":
+    # Se pueden levantar tantos workers como se quiera (en una o varias máquinas) contra la misma BD:
+    #   python worker.py --concurrency 8
+    parser = argparse.ArgumentParser(description="Worker de la cola de trabajos (sincronización con la nube y conversiones)")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY,
+                        help="Trabajos simultáneos en este worker")
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))